@@ -1,16 +1,21 @@
 import os
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
-import reservas.routing
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'reserva_salas.settings')
 
+# Inicializa o Django antes de importar as rotas: os consumers importam os models
+django_asgi_app = get_asgi_application()
+
+from channels.routing import ProtocolTypeRouter, URLRouter
+from reservas.autenticacao import TokenAuthMiddlewareStack
+import reservas.routing
+
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
-    "websocket": AuthMiddlewareStack(
+    "http": django_asgi_app,
+    # Sessão (Admin do Django) ou Token do DRF (?token=...), validado uma vez por conexão
+    "websocket": TokenAuthMiddlewareStack(
         URLRouter(
             reservas.routing.websocket_urlpatterns
         )
     ),
-}) 
\ No newline at end of file
+})
@@ -28,14 +28,62 @@ INSTALLED_APPS = [
     'django_rest_passwordreset',
 ]
 
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer"
-    }
-}
+def camada_de_canais(redis_url, modo='pubsub'):
+    """
+    Channel layer dos WebSockets.
+    - Com REDIS_URL: as mensagens passam pelo Redis e alcançam conexões de QUALQUER processo
+      Daphne (vários workers/containers). 'pubsub' (padrão) faz um único PUBLISH por group_send,
+      repassado por cada processo às suas conexões; 'filas' usa o RedisChannelLayer clássico
+      (uma fila por conexão, com entrega garantida enquanto a mensagem não expira).
+    - Sem REDIS_URL (desenvolvimento, testes): InMemoryChannelLayer, que só alcança as conexões
+      do próprio processo.
+    """
+    if not redis_url:
+        return {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+    if modo == 'filas':
+        return {"default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {"hosts": [redis_url], "capacity": 1500, "expiry": 30},
+        }}
+    return {"default": {
+        "BACKEND": "channels_redis.pubsub.RedisPubSubChannelLayer",
+        "CONFIG": {"hosts": [redis_url]},
+    }}
+
+
+CHANNEL_LAYERS = camada_de_canais(os.getenv('REDIS_URL', ''), os.getenv('CHANNEL_LAYER_MODO', 'pubsub'))
+
+
+def cache_compartilhado(backend, redis_url):
+    """
+    Cache do Django (reservas/cache.py). CACHE_BACKEND escolhe:
+    - 'redis': compartilhado por todos os processos/containers (padrão quando há REDIS_URL);
+    - 'arquivo': compartilhado pelos processos da mesma máquina, em BASE_DIR/cache;
+    - 'memoria': um cache por processo (padrão sem REDIS_URL: desenvolvimento e testes).
+    """
+    backend = backend or ('redis' if redis_url else 'memoria')
+    if backend == 'redis':
+        configuracao = {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": redis_url}
+    elif backend == 'arquivo':
+        configuracao = {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": os.path.join(BASE_DIR, 'cache'),
+            "OPTIONS": {"MAX_ENTRIES": 10000},
+        }
+    else:
+        configuracao = {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "OPTIONS": {"MAX_ENTRIES": 10000},
+        }
+    return {"default": {**configuracao, "KEY_PREFIX": "reservas"}}
+
+
+CACHES = cache_compartilhado(os.getenv('CACHE_BACKEND', ''), os.getenv('REDIS_URL', ''))
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    # Recusa (429) o excesso de escritas/relatórios simultâneos antes de ele esperar na fila
+    'reservas.limites.LimiteConcorrenciaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -74,6 +122,18 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # O SQLite ignora SELECT ... FOR UPDATE. Com IMMEDIATE, cada transação reserva a escrita
+            # já no BEGIN, então as gravações de Reserva (verificação + INSERT) ficam enfileiradas.
+            # 'timeout' é quanto tempo (s) uma transação espera a sua vez antes de falhar.
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # Banco de testes em arquivo (como em produção): o SQLite em memória compartilhada
+        # usa locks por tabela que ignoram o 'timeout', quebrando os testes de concorrência.
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
@@ -136,14 +196,101 @@ EMAIL_HOST_PASSWORD = '' + os.getenv('EMAIL_PASSWORD', '')
 
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 
+# Fila de saída de e-mails (reservas/emails.py): mensagens por conexão SMTP, tentativas antes
+# do dead letter e espera (segundos) antes da 1ª nova tentativa, que dobra a cada falha.
+# Cada envio agenda o seguinte para a próxima nova tentativa; 'manage.py enviar_emails --continuo'
+# (serviço 'emails' do docker-compose) as retoma também depois de um reinício.
+# EMAIL_FILA_WORKERS: threads do pool próprio dos e-mails (separado de TAREFAS_WORKERS).
+EMAIL_FILA_LOTE = 50
+EMAIL_FILA_TENTATIVAS = 5
+EMAIL_FILA_ESPERA = 60
+EMAIL_FILA_WORKERS = 1
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Tarefas em segundo plano (reservas/tarefas.py): threads do pool de relatórios de cada processo Daphne.
+# TAREFAS_SINCRONAS = True executa as tarefas logo após o commit, na própria requisição (útil em testes).
+TAREFAS_WORKERS = 2
+TAREFAS_SINCRONAS = False
+
+# Horas que os relatórios em segundo plano (pedidos e arquivos em MEDIA_ROOT/relatorios/) são mantidos;
+# 'manage.py expirar_relatorios' apaga os mais antigos.
+RELATORIOS_RETENCAO_HORAS = 24
+
+# Publicação dos eventos de WebSocket (reservas/eventos.py): eventos aguardando envio (além disso,
+# são descartados), janela (segundos) em que uma rajada é agrupada e tempo máximo de cada envio.
+EVENTOS_FILA_MAXIMA = 1000
+EVENTOS_JANELA = 0.05
+EVENTOS_TIMEOUT = 2
+# Horas que as alterações ficam no log de retomada (EventoAgenda); 'manage.py compactar_eventos'
+# apaga as mais antigas e as substituídas por uma alteração mais nova da mesma reserva.
+EVENTOS_RETENCAO_HORAS = 24
+
+# Cache (por processo) de Token -> usuário da autenticação do WebSocket e da API (reservas/autenticacao.py):
+# validade das entradas em segundos e máximo de tokens guardados. Revogações e alterações de usuário
+# chegam aos demais processos pela versão de cada token no CACHES 'default' (com Redis, na hora).
+TOKENS_CACHE_TTL = 60
+TOKENS_CACHE_TAMANHO = 10000
+# Validade do Token de login (reservas.models.ValidadeToken), renovada ao uso depois da metade.
+# 'manage.py expirar_tokens --continuo' apaga os expirados.
+TOKENS_VALIDADE_HORAS = 24 * 7
+
+# Catálogo de Recursos em cache com ETag (reservas/catalogo.py): intervalo máximo, em segundos,
+# para um processo perceber uma alteração de sala feita em outro processo.
+CATALOGO_VERIFICACAO = 5
+
+# Cache compartilhado das leituras (reservas/cache.py): validade (segundos) de cada tipo de resposta,
+# validade das demais e quanto um pedido espera (segundos) pelo cálculo já em andamento da mesma resposta.
+CACHE_TTL = {
+    'busca': 30,
+    'calendario': 300,
+    'meus_agendamentos': 300,
+    'dashboard': 60,
+}
+CACHE_TTL_PADRAO = 60
+CACHE_ESPERA = 5
+
+# Horário de funcionamento das salas (hora local): base das taxas de ocupação.
+# Dias da semana: segunda = 0 ... domingo = 6.
+EXPEDIENTE_INICIO = 7
+EXPEDIENTE_FIM = 22
+EXPEDIENTE_DIAS_SEMANA = [0, 1, 2, 3, 4, 5]
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',  
+        # TokenAuthentication com o usuário em cache (reservas/autenticacao.py): sem SELECT por requisição
+        'reservas.autenticacao.TokenAuthenticationEmCache',
         'rest_framework.authentication.SessionAuthentication', 
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
-    ],}
\ No newline at end of file
+    ],
+    # Janelas fixas contadas no cache compartilhado (reservas/limites.py); excesso = 429 com Retry-After
+    'DEFAULT_THROTTLE_CLASSES': [
+        'reservas.limites.LimitePorCliente',
+        'reservas.limites.LimitePorEndpoint',
+    ],
+    # Proxies reversos na frente do Daphne: com 0, o X-Forwarded-For (forjável) é ignorado
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', '0')),
+}
+
+# Limites de taxa (reservas/limites.py): escopo -> (pedidos aceitos por janela, duração da janela em segundos).
+# 'usuario'/'ip' valem para toda a API; os demais, por usuário (ou IP), só nas rotas do escopo.
+LIMITES_TAXA = {
+    'usuario': (120, 30),
+    'ip': (60, 30),
+    'busca': (20, 20),
+    'reservas': (10, 50),
+    'relatorios': (5, 100),
+    'login': (10, 100),
+}
+# Pedidos simultâneos por processo (reservas.limites.LimiteConcorrenciaMiddleware): escritas na API e
+# relatórios síncronos (PDF/Excel). Acima disso, 429 com Retry-After de CONCORRENCIA_RETRY_AFTER segundos.
+# As vagas são contadas em cada processo Daphne, não no total: com N processos, até N * 'escritas'
+# escritas disputam o SQLite ao mesmo tempo (que continua aceitando um escritor por vez).
+CONCORRENCIA = {
+    'escritas': 8,
+    'relatorios': 2,
+}
+CONCORRENCIA_RETRY_AFTER = 1
\ No newline at end of file
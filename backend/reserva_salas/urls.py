@@ -4,7 +4,10 @@ from django.conf.urls.static import static
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from django.views.decorators.csrf import csrf_exempt
-from reservas.api_views import RecursoViewSet, ReservaViewSet, RegisterView, CustomAuthToken, UserProfileView
+from reservas.api_views import (
+    RecursoViewSet, ReservaViewSet, RelatorioJobViewSet, RegisterView, CustomAuthToken, UserProfileView, MetricasEventosView,
+    RotacionarTokenView,
+)
 from reservas.admin import admin_site, RecursoAdmin, ReservaAdmin, CodigoConviteAdmin
 from reservas.models import Recurso, Reserva, CodigoConvite
 from django.contrib.auth.models import User, Group
@@ -14,6 +17,7 @@ from django.contrib.auth.models import User, Group
 router = DefaultRouter()
 router.register(r'recursos', RecursoViewSet)
 router.register(r'reservas', ReservaViewSet)
+router.register(r'relatorios', RelatorioJobViewSet, basename='relatorio')
 
 
 try:
@@ -31,6 +35,7 @@ urlpatterns = [
     
     
     path('reservas/api-token-auth/', csrf_exempt(CustomAuthToken.as_view()), name='api_token_auth'),
+    path('reservas/api/token/rotacionar/', RotacionarTokenView.as_view(), name='rotacionar_token'),
     
     
     path('reservas/api/register/', RegisterView.as_view(), name='auth_register'),
@@ -39,6 +44,8 @@ urlpatterns = [
     path('reservas/api/password_reset/', include('django_rest_passwordreset.urls', namespace='password_reset')),
 
     path('reservas/api/perfil/', UserProfileView.as_view(), name='user_profile'),
+
+    path('reservas/api/eventos/metricas/', MetricasEventosView.as_view(), name='metricas_eventos'),
     
    
     path('admin/', admin_site.urls), 
@@ -1,10 +1,12 @@
+import datetime
 import json
 from django.contrib import admin
-from django.db.models import Count
+from django.utils import timezone
 from django.core.serializers.json import DjangoJSONEncoder
 from django.utils.html import format_html
 from django.contrib.auth.models import User, Group
-from .models import Recurso, Reserva, CodigoConvite
+from . import cache, emails, notificacoes
+from .models import Recurso, Reserva, CodigoConvite, EmailPendente, EstatisticaReserva
 
 class DashboardAdminSite(admin.AdminSite):
     site_header = "Gestão de Reservas Acadêmicas"
@@ -12,27 +14,46 @@ class DashboardAdminSite(admin.AdminSite):
     index_title = "Dashboard de Controle"
 
     def index(self, request, extra_context=None):
-       
-        
-       
-        total_reservas = Reserva.objects.count()
-        
-     
-        salas_populares = (
-            Reserva.objects
-            .values('recurso__nome')
-            .annotate(total=Count('id'))
-            .order_by('-total')[:5]
+        # Os gráficos ficam no cache compartilhado (reservas/cache.py) até a próxima alteração
+        # de reserva ou sala; o dia entra na chave por causa da janela dos últimos 14 dias
+        hoje = timezone.localdate()
+        extra_context = {
+            **(extra_context or {}),
+            **cache.obter('dashboard', [hoje], lambda: self.graficos(hoje), ['agenda', 'recursos']),
+        }
+        return super().index(request, extra_context=extra_context)
+
+    def graficos(self, hoje):
+        """Dados dos gráficos do Dashboard (já em JSON, prontos para o template)."""
+        # Os números vêm das estatísticas já agregadas (EstatisticaReserva): poucas linhas
+        # lidas, não importa quantas reservas existam
+        estatisticas = EstatisticaReserva.objects.filter(quantidade__gt=0)
+
+        total_reservas = estatisticas.filter(tipo='total').values_list('quantidade', flat=True).first() or 0
+
+        mais_reservados = list(
+            estatisticas.filter(tipo='recurso').order_by('-quantidade').values_list('chave', 'quantidade')[:5]
         )
-        
-       
-        status_reservas = (
-            Reserva.objects
-            .values('status')
-            .annotate(total=Count('id'))
+        nomes = dict(Recurso.objects.filter(pk__in=[int(chave) for chave, _ in mais_reservados]).values_list('pk', 'nome'))
+        salas_populares = [
+            {'recurso__nome': nomes.get(int(chave), '?'), 'total': total} for chave, total in mais_reservados
+        ]
+
+        status_reservas = [
+            {'status': chave, 'total': total}
+            for chave, total in estatisticas.filter(tipo='status').order_by('chave').values_list('chave', 'quantidade')
+        ]
+
+        # Horas ocupadas por dia, nos últimos 14 dias
+        dias = [hoje - datetime.timedelta(days=i) for i in range(13, -1, -1)]
+        minutos_por_dia = dict(
+            EstatisticaReserva.objects
+            .filter(tipo='dia', chave__gte=dias[0].isoformat(), chave__lte=hoje.isoformat())
+            .values_list('chave', 'minutos')
         )
+        chart_ocupacao_labels = [dia.strftime('%d/%m') for dia in dias]
+        chart_ocupacao_data = [round(minutos_por_dia.get(dia.isoformat(), 0) / 60, 1) for dia in dias]
 
-        
         chart_salas_labels = [item['recurso__nome'] for item in salas_populares]
         chart_salas_data = [item['total'] for item in salas_populares]
         
@@ -41,14 +62,16 @@ class DashboardAdminSite(admin.AdminSite):
         chart_status_data = [item['total'] for item in status_reservas]
 
        
-        extra_context = extra_context or {}
-        extra_context['chart_salas_labels'] = json.dumps(chart_salas_labels, cls=DjangoJSONEncoder)
-        extra_context['chart_salas_data'] = json.dumps(chart_salas_data, cls=DjangoJSONEncoder)
-        extra_context['chart_status_labels'] = json.dumps(chart_status_labels, cls=DjangoJSONEncoder)
-        extra_context['chart_status_data'] = json.dumps(chart_status_data, cls=DjangoJSONEncoder)
-        extra_context['total_reservas'] = total_reservas
+        contexto = {}
+        contexto['chart_salas_labels'] = json.dumps(chart_salas_labels, cls=DjangoJSONEncoder)
+        contexto['chart_salas_data'] = json.dumps(chart_salas_data, cls=DjangoJSONEncoder)
+        contexto['chart_status_labels'] = json.dumps(chart_status_labels, cls=DjangoJSONEncoder)
+        contexto['chart_status_data'] = json.dumps(chart_status_data, cls=DjangoJSONEncoder)
+        contexto['chart_ocupacao_labels'] = json.dumps(chart_ocupacao_labels, cls=DjangoJSONEncoder)
+        contexto['chart_ocupacao_data'] = json.dumps(chart_ocupacao_data, cls=DjangoJSONEncoder)
+        contexto['total_reservas'] = total_reservas
+        return contexto
 
-        return super().index(request, extra_context=extra_context)
 
 
 admin_site = DashboardAdminSite(name='dashboard_admin')
@@ -67,6 +90,27 @@ class ReservaAdmin(admin.ModelAdmin):
     date_hierarchy = 'data_hora_inicio'
     list_editable = ('status',)
     ordering = ('-data_hora_inicio',)
+    # Recurso e Usuário de todas as linhas em um único SELECT (evita uma consulta por linha)
+    list_select_related = ('recurso', 'usuario')
+    actions = ['aprovar_pendentes', 'rejeitar_pendentes']
+
+    def _decidir(self, request, queryset, aprovar):
+        # Uma transação e UPDATEs por conjunto (Reserva.decidir_em_lote), não um save() por linha
+        resultado = Reserva.decidir_em_lote(queryset, aprovar=aprovar)
+        notificacoes.notificar_decisoes(resultado)
+        self.message_user(
+            request,
+            f"{len(resultado['aprovadas'])} aprovada(s), {len(resultado['rejeitadas'])} rejeitada(s), "
+            f"{len(resultado['perdedoras'])} rejeitada(s) automaticamente por conflito.",
+        )
+
+    @admin.action(description='Aprovar reservas pendentes selecionadas')
+    def aprovar_pendentes(self, request, queryset):
+        self._decidir(request, queryset, aprovar=True)
+
+    @admin.action(description='Rejeitar reservas pendentes selecionadas')
+    def rejeitar_pendentes(self, request, queryset):
+        self._decidir(request, queryset, aprovar=False)
 
     @admin.display(description='Status')
     def status_colorido(self, obj):
@@ -77,6 +121,22 @@ class ReservaAdmin(admin.ModelAdmin):
             obj.get_status_display()
         )
 
+class EmailPendenteAdmin(admin.ModelAdmin):
+    """Fila de saída de e-mails. Filtrar por 'Falhou' mostra o dead letter, que pode ser reenviado."""
+    list_display = ('assunto', 'destinatarios', 'status', 'tentativas', 'proxima_tentativa', 'criado_em', 'ultimo_erro')
+    list_filter = ('status',)
+    search_fields = ('assunto', 'destinatarios')
+    readonly_fields = [campo.name for campo in EmailPendente._meta.fields]
+    actions = ['reenviar']
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.action(description='Reenviar e-mails selecionados')
+    def reenviar(self, request, queryset):
+        quantidade = emails.reenviar(queryset.exclude(status='E'))
+        self.message_user(request, f"{quantidade} e-mail(s) devolvido(s) à fila de envio.")
+
 class CodigoConviteAdmin(admin.ModelAdmin):
     list_display = ('codigo', 'usado', 'usado_por', 'data_criacao')
     readonly_fields = ('codigo', 'data_criacao', 'usado_por')
@@ -85,5 +145,6 @@ class CodigoConviteAdmin(admin.ModelAdmin):
 admin_site.register(Recurso, RecursoAdmin)
 admin_site.register(Reserva, ReservaAdmin)
 admin_site.register(CodigoConvite, CodigoConviteAdmin)
+admin_site.register(EmailPendente, EmailPendenteAdmin)
 admin_site.register(User)
 admin_site.register(Group)
\ No newline at end of file
@@ -0,0 +1,210 @@
+"""
+Índice em memória da agenda, usado pela busca de salas livres (RecursoViewSet.buscar_disponiveis).
+
+A tela "achar uma sala livre no dia X para Y pessoas" repete a busca a cada ajuste do usuário.
+Em vez de consultar a tabela de reservas toda vez, cada processo mantém, por recurso, as reservas
+ativas ordenadas pelo início: saber se uma sala está ocupada em um intervalo custa uma busca
+binária (O(log n)), sem tocar no banco.
+
+Validade do índice:
+- Neste processo, qualquer save/delete de Reserva ou Recurso o descarta na hora (sinal em models.py).
+- Escritas feitas por outros processos são percebidas pelo ContadorVersao 'agenda': o índice
+  guarda a versão com que foi montado e é recarregado quando ela muda (uma consulta por busca,
+  a uma única linha).
+A busca é apenas informativa: a garantia contra reservas sobrepostas continua no Reserva.save().
+
+O mesmo índice alimenta a sugestão de horários livres (sugerir_horarios): uma varredura única
+(sweep-line) sobre as reservas já ordenadas de cada sala, intercalando as salas por horário.
+"""
+import bisect
+import datetime
+import heapq
+import itertools
+import threading
+from collections import defaultdict
+
+from django.utils import timezone
+
+from . import ocupacao
+from .models import ContadorVersao, Recurso, Reserva
+
+# Reservas que terminaram antes de (momento da carga - JANELA_PASSADO) ficam fora do índice.
+# Buscas que começam antes disso (raras) consultam o banco.
+JANELA_PASSADO = datetime.timedelta(days=1)
+
+# Sugestões de horário: início arredondado para cima nesta grade, período máximo varrido
+GRADE_SUGESTOES = datetime.timedelta(minutes=15)
+PERIODO_MAXIMO_SUGESTOES = datetime.timedelta(days=62)
+
+_indice = None
+_geracao = 0
+_trava = threading.Lock()
+
+
+class _AgendaRecurso:
+    """Reservas ativas de um recurso: inícios em ordem crescente e o maior fim visto até cada posição."""
+    __slots__ = ('intervalos', 'inicios', 'maiores_fins')
+
+    def __init__(self, intervalos):
+        intervalos.sort()
+        self.intervalos = intervalos
+        self.inicios = [inicio for inicio, _ in intervalos]
+        self.maiores_fins = list(itertools.accumulate((fim for _, fim in intervalos), max))
+
+    def ocupado(self, inicio, fim):
+        # Reservas que começam antes do fim desejado são as 'posicao' primeiras;
+        # alguma delas invade o intervalo se o maior fim entre elas passar do início desejado.
+        posicao = bisect.bisect_left(self.inicios, fim)
+        return posicao > 0 and self.maiores_fins[posicao - 1] > inicio
+
+    def intersectando(self, inicio, fim):
+        """Reservas (em ordem de início) que podem intersectar [inicio, fim), localizadas por busca binária."""
+        primeira = bisect.bisect_right(self.maiores_fins, inicio)
+        return self.intervalos[primeira:bisect.bisect_left(self.inicios, fim)]
+
+
+class IndiceAgenda:
+    """Foto da agenda (recursos ativos + reservas ativas a partir de 'corte') em uma versão."""
+
+    def __init__(self, versao, corte, recursos, agendas):
+        self.versao = versao
+        self.corte = corte
+        self.recursos = recursos
+        self.agendas = agendas
+
+    @classmethod
+    def carregar(cls, versao):
+        corte = timezone.now() - JANELA_PASSADO
+        recursos = list(Recurso.objects.filter(ativo=True).order_by('pk'))
+
+        intervalos = defaultdict(list)
+        reservas = (
+            Reserva.objects.ativas().filter(data_hora_fim__gt=corte)
+            .values_list('recurso_id', 'data_hora_inicio', 'data_hora_fim')
+        )
+        for recurso_id, inicio, fim in reservas.iterator(chunk_size=10_000):
+            intervalos[recurso_id].append((inicio, fim))
+
+        agendas = {recurso_id: _AgendaRecurso(lista) for recurso_id, lista in intervalos.items()}
+        return cls(versao, corte, recursos, agendas)
+
+    def cobre(self, inicio):
+        return inicio >= self.corte
+
+    def recursos_livres(self, inicio, fim, capacidade=0):
+        """Recursos ativos com capacidade suficiente e sem reserva ativa que intersecte [inicio, fim)."""
+        livres = []
+        for recurso in self.recursos:
+            if recurso.capacidade_maxima < capacidade:
+                continue
+            agenda = self.agendas.get(recurso.pk)
+            if agenda is None or not agenda.ocupado(inicio, fim):
+                livres.append(recurso)
+        return livres
+
+
+def obter_indice():
+    """Índice da versão atual da agenda, carregando-o do banco se necessário."""
+    global _indice
+    versao = ContadorVersao.atual('agenda')
+    indice = _indice
+    if indice is not None and indice.versao == versao:
+        return indice
+
+    with _trava:
+        geracao = _geracao
+    indice = IndiceAgenda.carregar(versao)
+    with _trava:
+        # Se houve uma escrita durante a carga, a foto pode estar incompleta: serve esta busca,
+        # mas não a guarda para as próximas.
+        if geracao == _geracao:
+            _indice = indice
+    return indice
+
+
+def invalidar():
+    """Descarta o índice deste processo (chamado a cada escrita em Reserva/Recurso)."""
+    global _indice, _geracao
+    with _trava:
+        _geracao += 1
+        _indice = None
+
+
+# Sugestão de horários livres
+
+def _arredondar(instante):
+    """Próximo múltiplo de GRADE_SUGESTOES (10:07 -> 10:15)."""
+    grade = GRADE_SUGESTOES.total_seconds()
+    segundos = -(-instante.timestamp() // grade) * grade
+    return datetime.datetime.fromtimestamp(segundos, tz=instante.tzinfo)
+
+
+def _periodos_abertos(inicio, fim, expediente):
+    """Trechos [a, b) do período em que se pode reservar, em ordem: o horário de funcionamento de cada dia."""
+    if not expediente:
+        yield inicio, fim
+        return
+    abertura, fechamento, dias_abertos = ocupacao.expediente()
+    dia = timezone.localtime(inicio).date()
+    while dia <= timezone.localtime(fim).date():
+        if dia.weekday() in dias_abertos:
+            meia_noite = datetime.datetime.combine(dia, datetime.time.min)
+            a = max(inicio, timezone.make_aware(meia_noite + datetime.timedelta(hours=abertura)))
+            b = min(fim, timezone.make_aware(meia_noite + datetime.timedelta(hours=fechamento)))
+            if a < b:
+                yield a, b
+        dia += datetime.timedelta(days=1)
+
+
+def _janelas_livres(abertos, ocupados, duracao):
+    """
+    Sweep-line: percorre juntos os trechos abertos e as reservas (ordenadas pelo início)
+    e produz, em ordem, cada intervalo livre (inicio, livre_ate) que comporta 'duracao'.
+    """
+    i = 0
+    for a, b in abertos:
+        cursor = a
+        while i < len(ocupados) and ocupados[i][1] <= cursor:
+            i += 1
+        # Reservas que passam do fim deste trecho continuam valendo para o próximo: 'i' não avança sobre elas
+        j = i
+        while j < len(ocupados) and ocupados[j][0] < b:
+            reserva_inicio, reserva_fim = ocupados[j]
+            if reserva_inicio - cursor >= duracao:
+                yield cursor, reserva_inicio
+            cursor = max(cursor, _arredondar(reserva_fim))
+            j += 1
+        if b - cursor >= duracao:
+            yield cursor, b
+
+
+def sugerir_horarios(inicio, fim, duracao, capacidade=0, quantidade=10, expediente=True):
+    """
+    Os 'quantidade' primeiros horários livres de 'duracao' entre 'inicio' e 'fim',
+    somando todos os recursos ativos com a capacidade pedida (um horário por intervalo livre de cada sala).
+    Com 'expediente', só sugere horários dentro do funcionamento (EXPEDIENTE_* no settings.py).
+
+    Cada sala gera seus intervalos livres sob demanda; heapq.merge intercala as salas pelo horário
+    e para assim que as 'quantidade' sugestões saem, sem varrer o período inteiro de todas elas.
+    """
+    # Não se reserva no passado (e o índice sempre cobre de 'agora' em diante)
+    inicio = _arredondar(max(inicio, timezone.now()))
+    if inicio >= fim:
+        return []
+
+    indice = obter_indice()
+    abertos = list(_periodos_abertos(inicio, fim, expediente))
+
+    def livres_do_recurso(recurso):
+        agenda = indice.agendas.get(recurso.pk)
+        ocupados = agenda.intersectando(inicio, fim) if agenda else []
+        for livre_inicio, livre_ate in _janelas_livres(abertos, ocupados, duracao):
+            yield livre_inicio, recurso.pk, livre_ate, recurso
+
+    salas = [
+        livres_do_recurso(recurso) for recurso in indice.recursos if recurso.capacidade_maxima >= capacidade
+    ]
+    return [
+        {'recurso': recurso, 'inicio': livre_inicio, 'fim': livre_inicio + duracao, 'livre_ate': livre_ate}
+        for livre_inicio, _, livre_ate, recurso in itertools.islice(heapq.merge(*salas), quantidade)
+    ]
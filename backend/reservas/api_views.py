@@ -1,26 +1,51 @@
-from django.http import HttpResponse
-from rest_framework import viewsets, permissions, authentication, generics
+from django.http import FileResponse, HttpResponse
+from rest_framework import viewsets, mixins, permissions, generics
 from rest_framework.permissions import AllowAny, IsAuthenticated, IsAuthenticatedOrReadOnly
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from rest_framework.decorators import action
 from rest_framework.authtoken.views import ObtainAuthToken
-from rest_framework.authtoken.models import Token
 from django.contrib.auth.models import User
-from django.core.mail import send_mail
 from django.db.models import Q
-from .models import Recurso, Reserva, CodigoConvite
-from .serializers import RecursoSerializer, ReservaSerializer, UserSerializer, UserProfileSerializer
-
-# Imports para geração de Relatórios
-import openpyxl
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
-from reportlab.lib import colors
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.http import parse_etags
+from .models import Recurso, Reserva, CodigoConvite, RelatorioJob, ValidadeToken
+from .serializers import (
+    RecursoSerializer, ReservaSerializer, ReservaCalendarioSerializer, UserSerializer, UserProfileSerializer,
+    FiltrosRelatorioSerializer, RelatorioJobSerializer, ReservaLoteSerializer, DecisaoLoteSerializer,
+)
+from .tarefas import executar_em_segundo_plano
+from .pagination import CalendarioCursorPagination
+from .autenticacao import TokenAuthenticationEmCache
+from .limites import LimitePorCliente, LimitePorEndpoint
+from . import agenda, cache, catalogo, emails, eventos, notificacoes, ocupacao, relatorios
+
 import datetime
 
-# Imports para WebSocket (Tempo Real)
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
+
+def _parse_data_hora(valor):
+    """
+    Converte um parâmetro de URL (ISO 8601) em datetime com fuso horário.
+    Aceita tanto data/hora completa quanto apenas a data (meia-noite local).
+    Retorna None se o valor for inválido.
+    """
+    if not valor:
+        return None
+
+    valor = valor.strip()
+    # Em query strings, o '+' do offset (ex: -03:00 / +00:00) costuma chegar como espaço
+    data_hora = parse_datetime(valor) or parse_datetime(valor.replace(' ', '+'))
+
+    if data_hora is None:
+        data = parse_date(valor)
+        if data is None:
+            return None
+        data_hora = datetime.datetime.combine(data, datetime.time.min)
+
+    if timezone.is_naive(data_hora):
+        data_hora = timezone.make_aware(data_hora)
+    return data_hora
 
 
 class RecursoViewSet(viewsets.ModelViewSet):
@@ -32,8 +57,34 @@ class RecursoViewSet(viewsets.ModelViewSet):
     """
     queryset = Recurso.objects.all()
     serializer_class = RecursoSerializer
-    authentication_classes = [authentication.TokenAuthentication]
+    authentication_classes = [TokenAuthenticationEmCache]
     permission_classes = [permissions.IsAuthenticatedOrReadOnly] 
+    # Janelas próprias das buscas (veja reservas/limites.py)
+    limites = {'buscar_disponiveis': 'busca', 'sugerir_horarios': 'busca'}
+
+    def list(self, request, *args, **kwargs):
+        """
+        Catálogo com cache HTTP (veja reservas/catalogo.py): a resposta leva um ETag forte e,
+        se o cliente já tem essa versão (If-None-Match), volta 304 sem corpo.
+        Cache-Control: no-cache faz o navegador revalidar a cada uso em vez de confiar na cópia local.
+        """
+        if request.accepted_renderer.format != 'json':
+            return super().list(request, *args, **kwargs)
+
+        def renderizar():
+            dados = self.get_serializer(self.get_queryset(), many=True).data
+            return request.accepted_renderer.render(dados, renderer_context=self.get_renderer_context())
+
+        etag, conteudo = catalogo.obter(request.build_absolute_uri('/'), renderizar)
+        # Comparação fraca (RFC 9110): proxies que comprimem a resposta marcam o ETag com W/
+        enviados = {valor.removeprefix('W/') for valor in parse_etags(request.headers.get('If-None-Match', ''))}
+        if etag in enviados or '*' in enviados:
+            resposta = HttpResponse(status=304)
+        else:
+            resposta = HttpResponse(conteudo, content_type=request.accepted_renderer.media_type)
+        resposta['ETag'] = etag
+        resposta['Cache-Control'] = 'no-cache'
+        return resposta
 
     @action(detail=False, methods=['get'])
     def buscar_disponiveis(self, request):
@@ -48,31 +99,121 @@ class RecursoViewSet(viewsets.ModelViewSet):
         - fim: Data/Hora de fim desejada.
         - capacidade: Número mínimo de pessoas.
         """
-        inicio = request.query_params.get('inicio')
-        fim = request.query_params.get('fim')
-        capacidade = request.query_params.get('capacidade', 0)
+        inicio = _parse_data_hora(request.query_params.get('inicio'))
+        fim = _parse_data_hora(request.query_params.get('fim'))
 
         if not inicio or not fim:
             return Response({"erro": "Datas de início e fim são obrigatórias."}, status=400)
-
-        # 1. Filtro Básico: Salas ativas e com capacidade suficiente
-        recursos = Recurso.objects.filter(ativo=True, capacidade_maxima__gte=capacidade)
-
-        # 2. Lógica de Exclusão (Overlap):
-        # Identificamos as reservas que COLIDEM com o horário desejado.
-        # Regra: (InicioReserva < FimDesejado) E (FimReserva > InicioDesejado)
-        reservas_conflitantes = Reserva.objects.filter(
-            status__in=['C', 'P', 'M'], # Considera Confirmadas, Pendentes e Manutenção
-            data_hora_inicio__lt=fim,
-            data_hora_fim__gt=inicio
-        ).values_list('recurso_id', flat=True)
-
-        # 3. Subtração de Conjuntos:
-        # Lista Final = (Todas as Salas) - (Salas Ocupadas)
-        disponiveis = recursos.exclude(id__in=reservas_conflitantes)
+        if inicio >= fim:
+            return Response({"erro": "O fim deve ser posterior ao início."}, status=400)
+        try:
+            capacidade = int(request.query_params.get('capacidade') or 0)
+        except ValueError:
+            return Response({"erro": "A capacidade deve ser um número inteiro."}, status=400)
+
+        def buscar():
+            # Caminho rápido: índice em memória da agenda (veja reservas/agenda.py), sem consultar as reservas
+            indice = agenda.obter_indice()
+            if indice.cobre(inicio):
+                serializer = self.get_serializer(indice.recursos_livres(inicio, fim, capacidade), many=True)
+                return serializer.data
+
+            # Períodos passados (fora do índice) seguem pelo banco:
+            # 1. Filtro Básico: Salas ativas e com capacidade suficiente
+            recursos = Recurso.objects.filter(ativo=True, capacidade_maxima__gte=capacidade).order_by('pk')
+
+            # 2. Lógica de Exclusão (Overlap):
+            # Identificamos as reservas que COLIDEM com o horário desejado.
+            # Regra: (InicioReserva < FimDesejado) E (FimReserva > InicioDesejado)
+            # Considera Confirmadas, Pendentes e Manutenção
+            reservas_conflitantes = Reserva.objects.ativas().intersectando(inicio, fim).values_list('recurso_id', flat=True)
+
+            # 3. Subtração de Conjuntos:
+            # Lista Final = (Todas as Salas) - (Salas Ocupadas)
+            disponiveis = recursos.exclude(id__in=reservas_conflitantes)
         
-        serializer = self.get_serializer(disponiveis, many=True)
-        return Response(serializer.data)
+            serializer = self.get_serializer(disponiveis, many=True)
+            return serializer.data
+
+        # A resposta inteira também fica no cache compartilhado (reservas/cache.py), até a próxima
+        # alteração na agenda. O endereço entra na chave: as fotos vêm com URL absoluta.
+        dados = cache.obter(
+            'busca', [request.build_absolute_uri('/'), inicio, fim, capacidade], buscar, ['agenda', 'recursos']
+        )
+        return Response(dados)
+
+    @action(detail=False, methods=['get'])
+    def sugerir_horarios(self, request):
+        """
+        Sugestão de horários: os primeiros intervalos livres, em todas as salas, para uma reunião
+        de 'duracao' minutos. Evita que o usuário "chute" horários um a um em buscar_disponiveis.
+
+        Parâmetros de URL:
+        - duracao: minutos (obrigatório).
+        - capacidade: número mínimo de pessoas (padrão: 0).
+        - inicio / fim: período da busca (padrão: de agora até 7 dias depois).
+        - quantidade: quantas sugestões (padrão: 10, máximo: 50).
+        - expediente: 0 para considerar também horários fora do funcionamento (padrão: 1).
+        Veja reservas/agenda.py.
+        """
+        parametros = request.query_params
+        try:
+            duracao = int(parametros.get('duracao', ''))
+            capacidade = int(parametros.get('capacidade') or 0)
+            quantidade = int(parametros.get('quantidade') or 10)
+        except ValueError:
+            return Response({"erro": "Informe 'duracao' (minutos), e números inteiros em 'capacidade' e 'quantidade'."}, status=400)
+        if not 0 < duracao <= 24 * 60:
+            return Response({"erro": "A duração deve ser de 1 a 1440 minutos."}, status=400)
+        if not 0 < quantidade <= 50:
+            return Response({"erro": "A quantidade deve ser de 1 a 50."}, status=400)
+
+        inicio = _parse_data_hora(parametros.get('inicio')) if parametros.get('inicio') else timezone.now()
+        fim = _parse_data_hora(parametros.get('fim')) if parametros.get('fim') else inicio + datetime.timedelta(days=7)
+        if not inicio or not fim:
+            return Response({"erro": "Datas inválidas (use ISO 8601)."}, status=400)
+        if inicio >= fim or fim - inicio > agenda.PERIODO_MAXIMO_SUGESTOES:
+            return Response({"erro": f"Período inválido (máximo de {agenda.PERIODO_MAXIMO_SUGESTOES.days} dias)."}, status=400)
+
+        sugestoes = agenda.sugerir_horarios(
+            inicio, fim, datetime.timedelta(minutes=duracao), capacidade, quantidade,
+            expediente=parametros.get('expediente') not in ('0', 'false'),
+        )
+        return Response([
+            {
+                'recurso': sugestao['recurso'].id,
+                'recurso_nome': sugestao['recurso'].nome,
+                'inicio': sugestao['inicio'],
+                'fim': sugestao['fim'],
+                'livre_ate': sugestao['livre_ate'],
+            }
+            for sugestao in sugestoes
+        ])
+
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAdminUser])
+    def ocupacao(self, request):
+        """
+        Taxas de ocupação (%) por recurso, por hora do dia, dia da semana e semana (Admins).
+        Parâmetros de URL:
+        - inicio / fim: período analisado (obrigatórios; data ou data/hora).
+        - recursos: IDs separados por vírgula (opcional; padrão: todos os recursos ativos).
+        Veja reservas/ocupacao.py.
+        """
+        inicio = _parse_data_hora(request.query_params.get('inicio'))
+        fim = _parse_data_hora(request.query_params.get('fim'))
+        if not inicio or not fim:
+            return Response({"erro": "Parâmetros 'inicio' e 'fim' são obrigatórios (ISO 8601)."}, status=400)
+        if inicio >= fim or fim - inicio > ocupacao.PERIODO_MAXIMO:
+            return Response({"erro": f"Período inválido (máximo de {ocupacao.PERIODO_MAXIMO.days} dias)."}, status=400)
+
+        recurso_ids = None
+        if request.query_params.get('recursos'):
+            try:
+                recurso_ids = [int(i) for i in request.query_params['recursos'].split(',') if i.strip()]
+            except ValueError:
+                return Response({"erro": "O parâmetro 'recursos' deve ser uma lista de IDs."}, status=400)
+
+        return Response(ocupacao.taxas_de_ocupacao(inicio, fim, recurso_ids))
 
 
 class ReservaViewSet(viewsets.ModelViewSet):
@@ -80,10 +221,16 @@ class ReservaViewSet(viewsets.ModelViewSet):
     API Central para Gerenciamento de Reservas.
     Contém a lógica de orquestração entre Banco de Dados, E-mail e WebSockets.
     """
-    queryset = Reserva.objects.all()
+    # Recurso e Usuário já vêm no mesmo SELECT: evita consultas extras na validação do save()
+    # e ao serializar 'recurso_nome'.
+    queryset = Reserva.objects.select_related('recurso', 'usuario')
     serializer_class = ReservaSerializer
-    authentication_classes = [authentication.TokenAuthentication]
+    authentication_classes = [TokenAuthenticationEmCache]
     permission_classes = [permissions.IsAuthenticated]
+    limites = {
+        'create': 'reservas', 'lote': 'reservas',
+        'relatorio_pdf': 'relatorios', 'relatorio_excel': 'relatorios',
+    }
 
     def perform_create(self, serializer):
         """
@@ -93,140 +240,283 @@ class ReservaViewSet(viewsets.ModelViewSet):
         3. Envia notificações assíncronas (E-mail e WebSocket).
         """
         user = self.request.user
+        novo_status = self._status_inicial()
+
+        # Salva a instância no banco
+        reserva = serializer.save(usuario=user, status=novo_status)
+        self._notificar_criacao(user, [reserva])
+
+    def _status_inicial(self):
+        """Status de uma nova reserva, conforme quem pede."""
+        user = self.request.user
         eh_manutencao = self.request.data.get('eh_manutencao', False)
-        novo_status = 'P' # Status padrão
 
         # Regra de Hierarquia
         if user.is_staff:
             if eh_manutencao:
-                novo_status = 'M' # Bloqueio técnico
-            else:
-                novo_status = 'C' # Aprovação automática
-        
-        # Salva a instância no banco
-        reserva = serializer.save(usuario=user, status=novo_status)
-        
-        # Notificação por E-mail (SMTP)
+                return 'M' # Bloqueio técnico
+            return 'C' # Aprovação automática
+        return 'P' # Status padrão
+
+    def _notificar_criacao(self, user, reservas):
+        """
+        Um único e-mail e uma única mensagem de WebSocket por pedido, mesmo que ele
+        tenha criado várias reservas (ex: uma série recorrente).
+        """
+        primeira = reservas[0]
+
+        # Notificação por E-mail
         # Envia apenas se não for um bloqueio de manutenção
-        if novo_status != 'M' and user.email:
-            assunto = 'Confirmação de Reserva'
-            mensagem = f"""
+        if primeira.status != 'M' and user.email:
+            if len(reservas) == 1:
+                assunto = 'Confirmação de Reserva'
+                mensagem = f"""
             Olá, {user.username}!
             Sua reserva foi recebida.
-            Recurso: {reserva.recurso.nome}
-            Início: {reserva.data_hora_inicio}
-            Status: {reserva.get_status_display()}
+            Recurso: {primeira.recurso.nome}
+            Início: {primeira.data_hora_inicio}
+            Status: {primeira.get_status_display()}
             """
-            try:
-                # fail_silently=True impede que erro de rede derrube a requisição
-                send_mail(subject=assunto, message=mensagem, from_email=None, recipient_list=[user.email], fail_silently=True)
-            except Exception as e:
-                print(f"Erro ao enviar e-mail: {e}")
+            else:
+                assunto = f'Confirmação de {len(reservas)} Reservas'
+                horarios = '\n'.join(f'            - {timezone.localtime(r.data_hora_inicio):%d/%m/%Y %H:%M}' for r in reservas)
+                mensagem = f"""
+            Olá, {user.username}!
+            Suas {len(reservas)} reservas foram recebidas.
+            Recurso: {primeira.recurso.nome}
+            Status: {primeira.get_status_display()}
+            Inícios:
+{horarios}
+            """
+            # Fila de saída (reservas/emails.py): a resposta não espera o servidor SMTP
+            emails.enfileirar(assunto, mensagem, [user.email])
 
         # Notificação em Tempo Real (WebSockets/Django Channels)
-        # Envia mensagem para o grupo 'admin_reservas' onde o painel administrativo está conectado
-        try:
-            channel_layer = get_channel_layer()
-            mensagem_ws = f"Nova reserva: {reserva.recurso.nome} por {user.username} ({reserva.get_status_display()})"
-            
-            async_to_sync(channel_layer.group_send)(
-                "admin_reservas", 
-                {
-                    "type": "enviar_notificacao", # Método no Consumer
-                    "message": mensagem_ws
-                }
+        # Envia mensagem para o grupo 'admin_reservas' onde o painel administrativo está conectado.
+        # publicar() não espera o channel layer: o envio acontece após o commit, em segundo plano.
+        if len(reservas) == 1:
+            mensagem_ws = f"Nova reserva: {primeira.recurso.nome} por {user.username} ({primeira.get_status_display()})"
+        else:
+            mensagem_ws = f"{len(reservas)} novas reservas: {primeira.recurso.nome} por {user.username} ({primeira.get_status_display()})"
+        eventos.publicar("admin_reservas", {
+            "type": "enviar_notificacao",  # Método no Consumer
+            "message": mensagem_ws,
+        })
+
+    @action(detail=False, methods=['post'])
+    def lote(self, request):
+        """
+        Criação de várias reservas do mesmo recurso em um único pedido (série recorrente ou lista),
+        em vez de um POST por ocorrência. Veja ReservaLoteSerializer e Reserva.criar_em_lote.
+
+        Resposta: 201 com as reservas criadas e os conflitos (por ocorrência) ignorados;
+        400 com a lista de conflitos se nada pôde ser gravado.
+        """
+        pedido = ReservaLoteSerializer(data=request.data)
+        pedido.is_valid(raise_exception=True)
+        dados = pedido.validated_data
+
+        status_inicial = self._status_inicial()
+        reservas = [
+            Reserva(
+                recurso=dados['recurso'], usuario=request.user, motivo=dados['motivo'], status=status_inicial,
+                data_hora_inicio=inicio, data_hora_fim=fim,
             )
-        except Exception as e:
-            print(f"Erro ao enviar WebSocket: {e}")
+            for inicio, fim in dados['horarios']
+        ]
+        criadas, conflitos = Reserva.criar_em_lote(reservas, ignorar_conflitos=dados['ignorar_conflitos'])
+
+        conflitos = [
+            {'data_hora_inicio': reserva.data_hora_inicio, 'data_hora_fim': reserva.data_hora_fim, 'erro': erro}
+            for reserva, erro in conflitos
+        ]
+        if not criadas:
+            return Response({"erro": "Nenhuma reserva foi criada.", "conflitos": conflitos}, status=400)
+
+        self._notificar_criacao(request.user, criadas)
+        return Response({
+            'criadas': self.get_serializer(criadas, many=True).data,
+            'conflitos': conflitos,
+        }, status=201)
+
+    @action(detail=False, methods=['post'], permission_classes=[permissions.IsAdminUser])
+    def decidir(self, request):
+        """
+        Aprova ou rejeita várias reservas pendentes de uma vez (Admins):
+        POST {ids: [...], acao: 'aprovar'|'rejeitar'}. Veja Reserva.decidir_em_lote.
+        Reservas que não estão pendentes são ignoradas e listadas em 'ignoradas'.
+        """
+        pedido = DecisaoLoteSerializer(data=request.data)
+        pedido.is_valid(raise_exception=True)
+        ids = set(pedido.validated_data['ids'])
+
+        resultado = Reserva.decidir_em_lote(
+            Reserva.objects.filter(pk__in=ids), aprovar=pedido.validated_data['acao'] == 'aprovar'
+        )
+        notificacoes.notificar_decisoes(resultado)
+
+        decididas = {r.pk for chave in ('aprovadas', 'rejeitadas') for r in resultado[chave]}
+        return Response({
+            'aprovadas': [r.pk for r in resultado['aprovadas']],
+            'rejeitadas': [r.pk for r in resultado['rejeitadas']],
+            'rejeitadas_por_conflito': [
+                {'id': reserva.pk, 'conflito_com': vencedora.pk} for reserva, vencedora in resultado['perdedoras']
+            ],
+            'ignoradas': sorted(ids - decididas - {r.pk for r, _ in resultado['perdedoras']}),
+        })
+
+    @action(detail=False, methods=['get'])
+    def calendario(self, request):
+        """
+        Feed do Calendário (FullCalendar).
+
+        Retorna apenas as reservas ativas que INTERSECTAM a janela visível,
+        paginadas por cursor e no formato de Evento esperado pelo FullCalendar.
+        Assim, o custo de abrir a semana atual não cresce com o histórico.
+
+        Parâmetros de URL:
+        - start: Início da janela (ISO 8601). Obrigatório.
+        - end: Fim da janela (ISO 8601). Obrigatório.
+        - recurso: ID do recurso (opcional).
+        """
+        inicio = _parse_data_hora(request.query_params.get('start'))
+        fim = _parse_data_hora(request.query_params.get('end'))
+
+        if not inicio or not fim:
+            return Response({"erro": "Parâmetros 'start' e 'end' são obrigatórios (ISO 8601)."}, status=400)
+        if inicio >= fim:
+            return Response({"erro": "'start' deve ser anterior a 'end'."}, status=400)
+
+        # Mesma regra de Overlap do Model: (InicioReserva < FimJanela) E (FimReserva > InicioJanela)
+        reservas = Reserva.objects.ativas().intersectando(inicio, fim)
+
+        recurso = request.query_params.get('recurso')
+        if recurso:
+            if not recurso.isdigit():
+                return Response({"erro": "'recurso' deve ser um ID numérico."}, status=400)
+            reservas = reservas.filter(recurso_id=recurso)
+
+        # Carrega somente as colunas usadas pelo evento (inclusive o nome do recurso via JOIN)
+        reservas = reservas.select_related('recurso').only(
+            'id', 'motivo', 'status', 'data_hora_inicio', 'data_hora_fim', 'recurso', 'recurso__nome'
+        )
+
+        def montar_pagina():
+            paginator = CalendarioCursorPagination()
+            pagina = paginator.paginate_queryset(reservas, request, view=self)
+            serializer = ReservaCalendarioSerializer(pagina, many=True)
+            return paginator.get_paginated_response(serializer.data).data
+
+        # Cache compartilhado (reservas/cache.py) por dia da janela: uma reserva nova só descarta
+        # as semanas que ela toca. A URL completa (com o cursor) identifica a página.
+        dados = cache.obter(
+            'calendario', [request.build_absolute_uri()], montar_pagina,
+            [*cache.etiquetas_periodo(inicio, fim), 'recursos'],
+        )
+        return Response(dados)
 
     @action(detail=False, methods=['get'])
     def meus_agendamentos(self, request):
-        """Filtra e retorna apenas as reservas pertencentes ao usuário logado."""
-        minhas_reservas = Reserva.objects.filter(usuario=request.user)
-        serializer = self.get_serializer(minhas_reservas, many=True)
-        return Response(serializer.data)
+        """
+        Filtra e retorna apenas as reservas pertencentes ao usuário logado.
+        Fica no cache compartilhado até a próxima alteração de uma reserva do usuário ou de uma sala.
+        """
+        def listar():
+            minhas_reservas = self.get_queryset().filter(usuario=request.user)
+            return self.get_serializer(minhas_reservas, many=True).data
+
+        dados = cache.obter(
+            'meus_agendamentos', [request.user.pk], listar, [cache.etiqueta_usuario(request.user.pk), 'recursos']
+        )
+        return Response(dados)
+
+    def _reservas_do_relatorio(self, request):
+        """Reservas dos relatórios síncronos e os filtros opcionais (validados) vindos da URL."""
+        filtros = FiltrosRelatorioSerializer(data=request.query_params)
+        filtros.is_valid(raise_exception=True)
+        return relatorios.reservas_do_relatorio(request.user, filtros.validated_data), filtros.validated_data
 
     @action(detail=False, methods=['get'])
     def relatorio_pdf(self, request):
-        """Gera um PDF dinâmico com a biblioteca ReportLab."""
-        response = HttpResponse(content_type='application/pdf')
-        response['Content-Disposition'] = 'attachment; filename="reservas_relatorio.pdf"'
+        """
+        Gera um PDF dinâmico com a biblioteca ReportLab (tabelas do Platypus).
+        Além dos filtros, aceita ?agrupar=recurso|dia para subtotais por grupo.
+        """
+        reservas, filtros = self._reservas_do_relatorio(request)
 
-        p = canvas.Canvas(response, pagesize=A4)
-        p.setFont("Helvetica-Bold", 16)
-        p.drawString(100, 800, "Relatório Geral de Reservas")
-        
-        # Desenha cabeçalho
-        p.setFont("Helvetica-Bold", 10)
-        y = 750
-        p.drawString(50, y, "ID")
-        p.drawString(80, y, "Recurso")
-        p.drawString(200, y, "Usuário")
-        p.drawString(300, y, "Início")
-        p.drawString(450, y, "Status")
-        p.line(50, y-5, 550, y-5)
-        y -= 25
-
-        # Filtra dados com base na permissão
-        if request.user.is_staff:
-            reservas = Reserva.objects.all().order_by('-data_hora_inicio')
-        else:
-            reservas = Reserva.objects.filter(usuario=request.user).order_by('-data_hora_inicio')
-
-        p.setFont("Helvetica", 9)
-        for reserva in reservas:
-            if y < 50: # Paginação manual
-                p.showPage()
-                y = 800
-                p.setFont("Helvetica", 9)
-
-            p.drawString(50, y, str(reserva.id))
-            p.drawString(80, y, reserva.recurso.nome[:20])
-            p.drawString(200, y, reserva.usuario.username)
-            data_fmt = reserva.data_hora_inicio.strftime("%d/%m/%Y %H:%M")
-            p.drawString(300, y, data_fmt)
-            p.drawString(450, y, reserva.get_status_display())
-            y -= 15
-
-        p.showPage()
-        p.save()
+        response = HttpResponse(content_type=relatorios.CONTENT_TYPE_PDF)
+        response['Content-Disposition'] = 'attachment; filename="reservas_relatorio.pdf"'
+        relatorios.gerar_pdf(reservas, response, agrupar=filtros.get('agrupar'))
         return response
 
     @action(detail=False, methods=['get'])
     def relatorio_excel(self, request):
-        """Gera uma planilha Excel (.xlsx) usando OpenPyXL."""
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = 'attachment; filename="reservas_relatorio.xlsx"'
+        """
+        Gera uma planilha Excel (.xlsx), enviada em streaming enquanto as reservas são lidas
+        (o primeiro bloco sai antes da primeira consulta); veja reservas/relatorios.py. Aceita os mesmos filtros de FiltrosRelatorioSerializer.
+        """
+        reservas, _ = self._reservas_do_relatorio(request)
+        return relatorios.resposta_excel(request._request, reservas)
 
-        workbook = openpyxl.Workbook()
-        worksheet = workbook.active
-        worksheet.title = 'Reservas'
 
-        columns = ['ID', 'Recurso', 'Usuário', 'Início', 'Fim', 'Motivo', 'Status']
-        worksheet.append(columns)
+class RelatorioJobViewSet(mixins.CreateModelMixin, mixins.RetrieveModelMixin,
+                          mixins.ListModelMixin, viewsets.GenericViewSet):
+    """
+    Relatórios em segundo plano.
 
-        if request.user.is_staff:
-            reservas = Reserva.objects.all().order_by('-data_hora_inicio')
-        else:
-            reservas = Reserva.objects.filter(usuario=request.user).order_by('-data_hora_inicio')
-
-        for reserva in reservas:
-            # Remove timezone para compatibilidade com Excel
-            inicio = reserva.data_hora_inicio.replace(tzinfo=None) if reserva.data_hora_inicio else ''
-            fim = reserva.data_hora_fim.replace(tzinfo=None) if reserva.data_hora_fim else ''
-
-            worksheet.append([
-                reserva.id,
-                reserva.recurso.nome,
-                reserva.usuario.username,
-                inicio,
-                fim,
-                reserva.motivo,
-                reserva.get_status_display()
-            ])
-
-        workbook.save(response)
-        return response
+    Fluxo:
+    1. POST {formato: 'pdf'|'xlsx', filtros: {...}} -> 202 com o pedido (status 'P').
+    2. Acompanhar: GET /relatorios/<id>/ ou, pelo WebSocket, enviar {"acompanhar_relatorio": "<id>"}.
+    3. Quando status = 'C': GET /relatorios/<id>/download/.
+
+    Se um relatório idêntico (mesmo escopo, filtros e versão dos dados) já foi gerado,
+    o arquivo é reaproveitado e o pedido já nasce concluído.
+    """
+    serializer_class = RelatorioJobSerializer
+    authentication_classes = [TokenAuthenticationEmCache]
+    permission_classes = [permissions.IsAuthenticated]
+    limites = {'create': 'relatorios'}
+
+    def get_queryset(self):
+        return RelatorioJob.objects.filter(usuario=self.request.user)
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        formato = serializer.validated_data['formato']
+        filtros = serializer.validated_data['filtros']
+        chave = relatorios.chave_relatorio(request.user, formato, filtros)
+
+        # 1. Mesmo relatório já em andamento para este usuário: não gera de novo
+        job = self.get_queryset().filter(chave=chave, status__in=['P', 'E']).first()
+
+        # 2. Arquivo pronto no cache (de qualquer usuário com o mesmo escopo): reaproveita
+        if job is None:
+            pronto = RelatorioJob.objects.filter(chave=chave, status='C').exclude(arquivo='').first()
+            if pronto and pronto.arquivo.storage.exists(pronto.arquivo.name):
+                job = serializer.save(
+                    usuario=request.user, chave=chave, status='C',
+                    arquivo=pronto.arquivo.name, concluido_em=timezone.now()
+                )
+
+        # 3. Caso contrário, entra na fila do pool de tarefas
+        if job is None:
+            job = serializer.save(usuario=request.user, chave=chave)
+            executar_em_segundo_plano(relatorios.processar_relatorio, job.pk)
+
+        return Response(self.get_serializer(job).data, status=202)
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        job = self.get_object()
+        if job.status != 'C':
+            return Response({"erro": "O relatório ainda não está pronto."}, status=409)
+
+        content_type = relatorios.CONTENT_TYPE_PDF if job.formato == 'pdf' else relatorios.CONTENT_TYPE_EXCEL
+        return FileResponse(
+            job.arquivo.open('rb'), as_attachment=True,
+            filename=f'reservas_relatorio.{job.formato}', content_type=content_type
+        )
 
 
 class RegisterView(generics.CreateAPIView):
@@ -251,20 +541,51 @@ class UserProfileView(generics.RetrieveUpdateAPIView):
 
 
 
+class MetricasEventosView(APIView):
+    """
+    Situação da fila de eventos de WebSocket deste processo (Admins): profundidade, capacidade
+    e contadores de publicados, descartados (fila cheia), combinados e falhas. Veja reservas/eventos.py.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(eventos.metricas())
+
+
+class RotacionarTokenView(APIView):
+    """
+    Troca o Token do usuário logado por um novo (POST). A chave usada nesta requisição deixa de
+    valer imediatamente; a resposta traz a nova e a sua validade.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        token = ValidadeToken.rotacionar(request.user)
+        return Response({'token': token.key, 'expira_em': token.validade.expira_em})
+
+
 class CustomAuthToken(ObtainAuthToken):
     """
     Personalização do Endpoint de Login.
     Retorna não apenas o Token, mas também metadados do usuário (Nome, Email, Permissões)
     para evitar requisições extras do Frontend.
     """
+    # O login não depende de um Token anterior (que pode ter expirado)
+    authentication_classes = []
+    # O ObtainAuthToken não tem limites: aqui, tentativas de senha por IP (veja reservas/limites.py)
+    throttle_classes = [LimitePorCliente, LimitePorEndpoint]
+    limite = 'login'
+
     def post(self, request, *args, **kwargs):
         serializer = self.serializer_class(data=request.data, context={'request': request})
         serializer.is_valid(raise_exception=True)
         user = serializer.validated_data['user']
-        token, created = Token.objects.get_or_create(user=user)
+        # Reaproveita o token enquanto ele vale; expirado, emite outro (veja ValidadeToken)
+        token = ValidadeToken.emitir(user)
         
         return Response({
             'token': token.key,
+            'expira_em': token.validade.expira_em,
             'user_id': user.pk,
             'username': user.username, 
             'email': user.email,
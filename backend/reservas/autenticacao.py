@@ -0,0 +1,307 @@
+"""
+Autenticação do WebSocket pelo Token do DRF, com cache de token -> usuário.
+
+O navegador não envia cabeçalhos no handshake do WebSocket: o cliente Angular passa o Token na
+URL (/ws/notificacoes/?token=<chave>); clientes fora do navegador podem usar o cabeçalho
+"Authorization: Token <chave>", como na API. O token é validado UMA vez, no handshake.
+
+Depois de um deploy, milhares de clientes reconectam ao mesmo tempo. Para isso não virar uma
+consulta ao banco por handshake:
+- o usuário de cada token fica em um cache do processo (LRU com TTL, TOKENS_CACHE_*), inclusive
+  as chaves inválidas;
+- as chaves que faltam no cache são buscadas em lote: os handshakes que chegam juntos esperam
+  a MESMA consulta (key IN (...)), e cada chave é buscada uma vez só, mesmo que repetida.
+
+Cada entrada guarda a versão do seu token no cache compartilhado (CACHES 'default'), lida ANTES
+da consulta ao banco, e só vale enquanto essa versão não mudar (uma leitura por uso, sem ir ao
+banco). Excluir/trocar um token ou alterar o usuário (ex: is_active, is_staff) troca a versão dos
+tokens afetados, na hora e de novo após o commit (sinais em models.py): com Redis, a revogação vale
+para todos os processos, inclusive quando feita por um comando (manage.py revogar_tokens). Só com o
+cache em memória local (um por processo) os demais processos esperam a entrada expirar (TTL).
+
+O mesmo cache atende a API REST (TokenAuthenticationEmCache): o frontend envia o Token em toda
+chamada, e o TokenAuthentication do DRF faz um SELECT (Token + User) por requisição.
+
+Tokens expiram (models.ValidadeToken): a entrada do cache nunca dura além da validade do token, e
+a renovação deslizante acontece quando o token é carregado do banco (buscar_usuarios).
+"""
+import asyncio
+import copy
+import logging
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from channels.auth import AuthMiddlewareStack
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from .models import ValidadeToken
+
+logger = logging.getLogger(__name__)
+
+# Maior lote de chaves por consulta (abaixo do limite de parâmetros do SQLite)
+LOTE_MAXIMO = 500
+
+
+def _ttl():
+    return getattr(settings, 'TOKENS_CACHE_TTL', 60)
+
+
+def _chave_versao(chave):
+    return f"token_versao:{chave}"
+
+
+def versoes_tokens(chaves):
+    """
+    Versão atual de cada token no cache compartilhado ({chave: versão}; None = nunca alterado),
+    ou None se o cache estiver indisponível.
+    """
+    try:
+        atuais = caches['default'].get_many([_chave_versao(chave) for chave in chaves])
+    except Exception:
+        logger.exception("Cache indisponível: versões dos tokens não lidas")
+        return None
+    return {chave: atuais.get(_chave_versao(chave)) for chave in chaves}
+
+
+def invalidar_tokens(chaves):
+    """
+    Troca a versão dos tokens: as entradas guardadas antes deixam de valer em todos os processos.
+    A versão dura o dobro do TTL: some do cache depois que a última entrada antiga já expirou.
+    """
+    if not chaves:
+        return
+    try:
+        caches['default'].set_many({_chave_versao(chave): uuid.uuid4().hex for chave in set(chaves)}, timeout=2 * _ttl())
+    except Exception:
+        logger.exception("Falha ao invalidar %s tokens no cache", len(set(chaves)))
+
+
+def invalidar_tokens_apos_commit(chaves):
+    """Invalida agora e de novo após o commit: outro processo pode ter relido o estado antigo no meio."""
+    chaves = list(chaves)
+    invalidar_tokens(chaves)
+    transaction.on_commit(lambda: invalidar_tokens(chaves))
+
+
+class CacheTokens:
+    """
+    LRU com TTL: chave do token -> usuário (ou None, para chaves inválidas). Seguro entre threads.
+    Cada entrada guarda a versão do token no cache compartilhado e só vale enquanto ela não mudar.
+    """
+
+    def __init__(self, tamanho=None, ttl=None):
+        self.tamanho = tamanho or getattr(settings, 'TOKENS_CACHE_TAMANHO', 10_000)
+        self.ttl = ttl if ttl is not None else _ttl()
+        self._itens = OrderedDict()             # chave -> (usuário, expira_em, versão)
+        self._por_usuario = {}                  # usuario_id -> chaves guardadas
+        self._trava = threading.Lock()
+
+    def consultar(self, chave):
+        """
+        (True, usuário ou None) se a chave está no cache, não expirou e a versão do token não mudou;
+        (False, None) caso contrário. Com a chave presente, lê a versão no cache compartilhado.
+        """
+        with self._trava:
+            item = self._itens.get(chave)
+            if item is None:
+                return False, None
+            usuario, expira_em, versao = item
+            if expira_em <= time.monotonic():
+                self._remover(chave)
+                return False, None
+            self._itens.move_to_end(chave)
+
+        atual = versoes_tokens([chave])
+        if atual is None or atual[chave] != versao:
+            with self._trava:
+                if self._itens.get(chave) is item:
+                    self._remover(chave)
+            return False, None
+        return True, usuario
+
+    def guardar(self, chave, usuario, valido_ate=None, versao=None):
+        """
+        'valido_ate': expiração do token (datetime); a entrada não passa dela.
+        'versao': versão do token lida antes de consultar o banco (versoes_tokens).
+        """
+        agora = time.monotonic()
+        expira_em = agora + self.ttl
+        if valido_ate is not None:
+            expira_em = min(expira_em, agora + (valido_ate - timezone.now()).total_seconds())
+        with self._trava:
+            self._remover(chave)
+            self._itens[chave] = (usuario, expira_em, versao)
+            if usuario is not None:
+                self._por_usuario.setdefault(usuario.pk, set()).add(chave)
+            while len(self._itens) > self.tamanho:
+                self._remover(next(iter(self._itens)))
+
+    def _remover(self, chave):
+        # Chamado com a trava: tira a chave da LRU e do índice por usuário
+        item = self._itens.pop(chave, None)
+        if item is not None and item[0] is not None:
+            chaves = self._por_usuario.get(item[0].pk)
+            if chaves is not None:
+                chaves.discard(chave)
+                if not chaves:
+                    del self._por_usuario[item[0].pk]
+
+    def descartar(self, chave=None, usuario_id=None):
+        """Remove uma chave, ou todas as chaves de um usuário (pelo índice, sem percorrer o cache)."""
+        with self._trava:
+            if chave is not None:
+                self._remover(chave)
+            if usuario_id is not None:
+                for outra in list(self._por_usuario.get(usuario_id, ())):
+                    self._remover(outra)
+
+    def limpar(self):
+        with self._trava:
+            self._itens.clear()
+            self._por_usuario.clear()
+
+
+cache_tokens = CacheTokens()
+
+
+def buscar_usuarios(chaves):
+    """
+    Uma consulta para várias chaves; guarda no cache o resultado de todas (inválidas ou expiradas = None).
+    Tokens que já passaram da metade da validade são renovados, todos em um único UPDATE.
+
+    As versões são lidas antes da consulta: uma alteração que acontecer depois troca a versão e a
+    entrada guardada aqui deixa de valer. Sem o cache compartilhado, nada é guardado.
+    """
+    versoes = versoes_tokens(chaves)
+    agora = timezone.now()
+    tokens = list(
+        Token.objects.filter(key__in=chaves, user__is_active=True, validade__expira_em__gt=agora)
+        .select_related('user', 'validade')
+    )
+    renovar = [token.key for token in tokens if token.validade.expira_em - agora < ValidadeToken.duracao() / 2]
+    renovado_ate = ValidadeToken.renovar(renovar) if renovar else None
+
+    usuarios = {token.key: token.user for token in tokens}
+    if versoes is not None:
+        for token in tokens:
+            validade = renovado_ate if token.key in renovar else token.validade.expira_em
+            cache_tokens.guardar(token.key, token.user, validade, versoes[token.key])
+        for chave in chaves:
+            if chave not in usuarios:
+                cache_tokens.guardar(chave, None, versao=versoes[chave])
+    return usuarios
+
+
+class _CarregadorEmLote:
+    """Junta as chaves que faltam no cache, dentro de um event loop, em consultas únicas."""
+
+    def __init__(self):
+        self.pendentes = {}
+
+    async def usuario(self, chave):
+        futuro = self.pendentes.get(chave)
+        if futuro is None:
+            futuro = self.pendentes[chave] = asyncio.get_running_loop().create_future()
+            if len(self.pendentes) == 1:
+                asyncio.get_running_loop().create_task(self.carregar())
+        return await asyncio.shield(futuro)
+
+    async def carregar(self):
+        # Deixa os demais handshakes desta rodada do event loop entrarem no mesmo lote
+        await asyncio.sleep(0)
+        lote, self.pendentes = self.pendentes, {}
+        chaves = list(lote)
+        try:
+            usuarios = {}
+            for inicio in range(0, len(chaves), LOTE_MAXIMO):
+                usuarios.update(await database_sync_to_async(buscar_usuarios)(chaves[inicio:inicio + LOTE_MAXIMO]))
+        except Exception as erro:
+            for futuro in lote.values():
+                futuro.set_exception(erro)
+            return
+        for chave, futuro in lote.items():
+            futuro.set_result(usuarios.get(chave))
+
+
+# Um carregador por event loop (o Daphne tem um por processo)
+_carregadores = weakref.WeakKeyDictionary()
+
+
+async def usuario_do_token(chave):
+    """Dono (ativo) do token, ou None: do cache ou, se faltar, da próxima consulta em lote."""
+    # A consulta lê a versão no cache compartilhado (Redis): fora do event loop
+    achou, usuario = await sync_to_async(cache_tokens.consultar, thread_sensitive=False)(chave)
+    if achou:
+        return usuario
+    loop = asyncio.get_running_loop()
+    carregador = _carregadores.get(loop)
+    if carregador is None:
+        carregador = _carregadores[loop] = _CarregadorEmLote()
+    return await carregador.usuario(chave)
+
+
+def chave_do_token(scope):
+    """Chave do Token enviada no handshake (?token=... ou Authorization: Token ...), ou None."""
+    token = parse_qs(scope.get('query_string', b'').decode('latin-1')).get('token')
+    if token:
+        return token[0]
+    for nome, valor in scope.get('headers', []):
+        if nome == b'authorization':
+            partes = valor.decode('latin-1').split()
+            if len(partes) == 2 and partes[0].lower() == 'token':
+                return partes[1]
+    return None
+
+
+class TokenAuthMiddleware(BaseMiddleware):
+    """
+    Preenche scope['user'] com o dono do Token do handshake. Sem token, mantém o que já havia
+    (sessão, via AuthMiddlewareStack). Token inválido: scope['user'] anônimo e
+    scope['token_recusado'] = True, para o consumer recusar a conexão.
+    """
+
+    async def __call__(self, scope, receive, send):
+        chave = chave_do_token(scope)
+        if chave is not None:
+            usuario = await usuario_do_token(chave)
+            scope = dict(scope, user=usuario or AnonymousUser(), token_recusado=usuario is None)
+        return await super().__call__(scope, receive, send)
+
+
+def TokenAuthMiddlewareStack(inner):
+    return AuthMiddlewareStack(TokenAuthMiddleware(inner))
+
+
+class TokenAuthenticationEmCache(TokenAuthentication):
+    """
+    TokenAuthentication do DRF ("Authorization: Token <chave>") com o usuário vindo do cache_tokens:
+    só a primeira requisição de cada token (e a primeira depois do TTL) consulta o banco.
+    Token excluído ou usuário alterado (ex: is_active, is_staff) deixam de valer na hora, em todos os
+    processos que compartilham o cache (sinais em models.py).
+    """
+
+    def authenticate_credentials(self, key):
+        achou, usuario = cache_tokens.consultar(key)
+        if not achou:
+            usuario = buscar_usuarios([key]).get(key)
+        if usuario is None:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        # Cópia por requisição: a View pode alterar request.user (ex: edição do perfil) sem mexer na
+        # instância compartilhada do cache
+        usuario = copy.copy(usuario)
+        return usuario, Token(key=key, user=usuario)
@@ -0,0 +1,221 @@
+"""
+Cache compartilhado das leituras mais frequentes (busca de salas livres, feed do calendário,
+"meus agendamentos" e o Dashboard), sobre o CACHES 'default' do Django (veja settings.py:
+memória local, arquivos ou Redis).
+
+- Validade por chave: cada tipo de resposta tem o seu TTL (CACHE_TTL['<nome>']).
+- Invalidação por etiquetas (tags): cada resposta depende de algumas etiquetas ('recursos',
+  'agenda', 'usuario_<id>', 'recurso_<id>', 'dia_AAAA-MM-DD'). Cada etiqueta tem no cache uma versão aleatória, que
+  entra na chave da resposta; invalidar uma etiqueta é trocar a sua versão (uma escrita só), e
+  as respostas antigas ficam inalcançáveis até expirarem. Os sinais de Reserva/Recurso (models.py)
+  invalidam as etiquetas afetadas na hora e de novo após o commit: uma leitura feita entre os
+  dois momentos pode ter guardado o estado anterior.
+- Proteção contra estouro (single-flight): quando uma resposta expira, só um pedido a recalcula.
+  Os demais pedidos do mesmo processo esperam o resultado dele; os de outros processos esperam a
+  resposta aparecer no cache (trava com cache.add). Passados CACHE_ESPERA segundos, calculam
+  eles mesmos: antes trabalho repetido que um pedido parado.
+
+Falhas do cache (ex: Redis fora do ar) não derrubam a leitura: a resposta é calculada direto no banco.
+"""
+import datetime
+import hashlib
+import json
+import logging
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+_AUSENTE = object()
+# Duração máxima da trava entre processos (segundos), caso quem a pegou morra no meio do cálculo
+TRAVA_TTL = 30
+# Acima disto, uma resposta por período depende da etiqueta 'agenda' em vez de uma por dia
+PERIODO_MAXIMO_ETIQUETAS = datetime.timedelta(days=62)
+
+_voos = {}           # chave -> _Voo em andamento neste processo
+_trava = threading.Lock()
+
+
+def _backend():
+    return caches['default']
+
+
+def ttl(nome):
+    tempos = getattr(settings, 'CACHE_TTL', {})
+    return tempos.get(nome, getattr(settings, 'CACHE_TTL_PADRAO', 60))
+
+
+# Etiquetas
+
+def etiqueta_usuario(usuario_id):
+    return f"usuario_{usuario_id}"
+
+
+def etiqueta_dia(dia):
+    return f"dia_{dia.isoformat()}"
+
+
+def etiqueta_recurso(recurso_id):
+    return f"recurso_{recurso_id}"
+
+
+def etiquetas_periodo(inicio, fim):
+    """Etiquetas dos dias de [inicio, fim); períodos longos dependem da agenda inteira."""
+    from .eventos import dias  # eventos.py importa os models
+    if fim - inicio > PERIODO_MAXIMO_ETIQUETAS:
+        return ['agenda']
+    return [etiqueta_dia(dia) for dia in dias(inicio, fim)]
+
+
+def _versoes(etiquetas):
+    backend = _backend()
+    chaves = {etiqueta: f"etiqueta:{etiqueta}" for etiqueta in etiquetas}
+    atuais = backend.get_many(list(chaves.values()))
+    versoes = {}
+    for etiqueta, chave in chaves.items():
+        versao = atuais.get(chave)
+        if versao is None:
+            # Etiqueta nunca vista (ou despejada do cache): nasce com uma versão nova, que não
+            # coincide com nenhuma resposta guardada antes
+            versao = uuid.uuid4().hex
+            if not backend.add(chave, versao, timeout=None):
+                versao = backend.get(chave) or versao
+        versoes[etiqueta] = versao
+    return versoes
+
+
+def assinatura(etiquetas):
+    """
+    Versões atuais das 'etiquetas' em um texto, que muda sempre que uma delas é invalidada
+    (para quem guarda respostas fora deste cache, ex: os arquivos dos relatórios).
+    None se o cache estiver indisponível: nada deve ser reaproveitado.
+    """
+    try:
+        return json.dumps(sorted(_versoes(etiquetas).items()))
+    except Exception:
+        logger.exception("Cache indisponível: versões de %s não lidas", sorted(etiquetas))
+        return None
+
+
+def invalidar(*etiquetas):
+    """Troca a versão das etiquetas: as respostas que dependem delas deixam de ser servidas."""
+    if not etiquetas:
+        return
+    try:
+        _backend().set_many({f"etiqueta:{etiqueta}": uuid.uuid4().hex for etiqueta in set(etiquetas)}, timeout=None)
+    except Exception:
+        logger.exception("Falha ao invalidar as etiquetas %s do cache", sorted(set(etiquetas)))
+
+
+def invalidar_apos_commit(*etiquetas):
+    """Invalida agora (para esta transação) e de novo após o commit (para as demais)."""
+    invalidar(*etiquetas)
+    transaction.on_commit(lambda: invalidar(*etiquetas))
+
+
+def etiquetas_reservas(alteracoes):
+    """
+    Etiquetas afetadas por alterações de reservas, no formato de eventos.publicar_reservas:
+    (reserva, estado anterior ou None, removida).
+    """
+    from .eventos import dias  # eventos.py importa os models
+    etiquetas = {'agenda'}
+    for reserva, anterior, _ in alteracoes:
+        etiquetas.add(etiqueta_usuario(reserva.usuario_id))
+        etiquetas.add(etiqueta_recurso(reserva.recurso_id))
+        etiquetas.update(etiqueta_dia(dia) for dia in dias(reserva.data_hora_inicio, reserva.data_hora_fim))
+        if anterior is not None:
+            recurso_id, _, inicio, fim = anterior
+            etiquetas.add(etiqueta_recurso(recurso_id))
+            etiquetas.update(etiqueta_dia(dia) for dia in dias(inicio, fim))
+    return etiquetas
+
+
+# Leitura com single-flight
+
+class _Voo:
+    """Cálculo em andamento de uma chave; os outros pedidos do processo esperam por ele."""
+
+    def __init__(self):
+        self.pronto = threading.Event()
+        self.valor = _AUSENTE
+
+
+def _chave(nome, partes, versoes):
+    bruto = json.dumps([partes, sorted(versoes.items())], default=str, sort_keys=True)
+    return f"{nome}:{hashlib.sha256(bruto.encode()).hexdigest()[:40]}"
+
+
+def obter(nome, partes, calcular, etiquetas=()):
+    """
+    Resposta 'nome' para 'partes' (o que a distingue: parâmetros, usuário, endereço...),
+    do cache ou de calcular(), guardada por ttl(nome) e dependente de 'etiquetas'.
+    """
+    try:
+        chave = _chave(nome, partes, _versoes(etiquetas))
+        valor = _backend().get(chave, _AUSENTE)
+    except Exception:
+        logger.exception("Cache indisponível: '%s' calculado sem cache", nome)
+        return calcular()
+    if valor is not _AUSENTE:
+        return valor
+
+    with _trava:
+        voo = _voos.get(chave)
+        lider = voo is None
+        if lider:
+            voo = _voos[chave] = _Voo()
+
+    if not lider:
+        voo.pronto.wait(getattr(settings, 'CACHE_ESPERA', 5))
+        if voo.valor is not _AUSENTE:
+            return voo.valor
+        return calcular()  # o líder falhou ou demorou demais
+
+    try:
+        voo.valor = _calcular_entre_processos(chave, calcular, ttl(nome))
+        return voo.valor
+    finally:
+        with _trava:
+            _voos.pop(chave, None)
+        voo.pronto.set()
+
+
+def _calcular_entre_processos(chave, calcular, validade):
+    backend = _backend()
+    trava = f"{chave}:trava"
+    try:
+        travou = backend.add(trava, 1, timeout=TRAVA_TTL)
+    except Exception:
+        travou = False
+
+    if not travou:
+        # Outro processo está calculando: espera a resposta dele aparecer no cache
+        limite = time.monotonic() + getattr(settings, 'CACHE_ESPERA', 5)
+        while time.monotonic() < limite:
+            time.sleep(0.05)
+            try:
+                valor = backend.get(chave, _AUSENTE)
+            except Exception:
+                break
+            if valor is not _AUSENTE:
+                return valor
+
+    try:
+        valor = calcular()
+        try:
+            backend.set(chave, valor, timeout=validade)
+        except Exception:
+            logger.exception("Falha ao guardar '%s' no cache", chave)
+        return valor
+    finally:
+        if travou:
+            try:
+                backend.delete(trava)
+            except Exception:
+                pass
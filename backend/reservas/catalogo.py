@@ -0,0 +1,72 @@
+"""
+Cache HTTP do catálogo de Recursos (GET /reservas/api/recursos/).
+
+O catálogo é baixado a cada abertura das telas de recursos, busca e reserva, mas as salas mudam
+raramente. Cada processo guarda o JSON já renderizado (bytes) e o seu ETag forte (hash do conteúdo):
+- sem If-None-Match (ou com um ETag antigo), a resposta sai dos bytes guardados, sem serializer;
+- com o ETag atual, a resposta é 304, sem corpo.
+Em nenhum dos casos o banco é consultado enquanto a versão é considerada válida.
+
+Validade: qualquer save/delete de Recurso descarta o cache deste processo na hora (sinal em
+models.py) e incrementa o ContadorVersao 'recursos' na mesma transação. Os demais processos conferem
+esse contador no máximo a cada CATALOGO_VERIFICACAO segundos (uma consulta a uma única linha).
+"""
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+
+from .models import ContadorVersao
+
+_itens = {}          # endereço base (o JSON traz URLs absolutas das fotos) -> (ETag, bytes)
+_versao = None
+_verificado_em = 0.0
+_geracao = 0
+_trava = threading.Lock()
+
+
+def _versao_atual():
+    """Versão do catálogo, relida do banco só depois de CATALOGO_VERIFICACAO segundos."""
+    global _versao, _verificado_em, _itens
+    intervalo = getattr(settings, 'CATALOGO_VERIFICACAO', 5)
+    agora = time.monotonic()
+    with _trava:
+        if _versao is not None and agora - _verificado_em < intervalo:
+            return _versao, _geracao
+    versao = ContadorVersao.atual('recursos')
+    with _trava:
+        if versao != _versao:
+            _itens = {}
+            _versao = versao
+        _verificado_em = agora
+        return _versao, _geracao
+
+
+def obter(base, renderizar):
+    """
+    (ETag, bytes) do catálogo para o endereço 'base'. 'renderizar()' devolve os bytes do JSON
+    e só é chamada quando o cache deste processo não tem a versão atual.
+    """
+    versao, geracao = _versao_atual()
+    with _trava:
+        item = _itens.get(base)
+    if item is not None:
+        return item
+
+    conteudo = renderizar()
+    item = (f'"{hashlib.sha256(conteudo).hexdigest()[:32]}"', conteudo)
+    with _trava:
+        # Se houve uma escrita durante a renderização, serve esta resposta mas não a guarda
+        if geracao == _geracao and versao == _versao:
+            _itens[base] = item
+    return item
+
+
+def invalidar():
+    """Descarta o catálogo deste processo (chamado a cada escrita em Recurso)."""
+    global _itens, _geracao, _versao
+    with _trava:
+        _itens = {}
+        _geracao += 1
+        _versao = None
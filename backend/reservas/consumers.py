@@ -1,5 +1,70 @@
+import datetime
 import json
+import uuid
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from . import eventos
+from .models import EventoAgenda
+
+# Limites de inscrição por conexão: tópicos no total e dias de uma janela da agenda
+MAXIMO_TOPICOS = 100
+MAXIMO_DIAS_JANELA = 62
+# Quantos deltas recentes cada conexão lembra para não entregar duas vezes o que chega por vários tópicos
+MEMORIA_EVENTOS = 1000
+# Mais que isso perdido durante a desconexão: o cliente recarrega a agenda em vez de retomar
+MAXIMO_RETOMADA = 1000
+
+
+def _instante(valor):
+    """Data ou data/hora ISO 8601 -> datetime com fuso (uma data vira a meia-noite local)."""
+    valor = str(valor)
+    instante = parse_datetime(valor)
+    if instante is None:
+        dia = parse_date(valor)
+        if dia is None:
+            raise ValueError(f"Data inválida: {valor!r}.")
+        instante = datetime.datetime.combine(dia, datetime.time.min)
+    return instante if timezone.is_aware(instante) else timezone.make_aware(instante)
+
+
+def _lista_de_ids(pedido, campo):
+    ids = pedido.get(campo, [])
+    if not isinstance(ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+        raise ValueError(f"'{campo}' deve ser uma lista de IDs.")
+    return ids
+
+
+def topicos_pedidos(pedido, usuario):
+    """
+    Grupos de um pedido de inscrição: {"recursos": [1, 2], "minhas": true, "inicio": ..., "fim": ...},
+    todos opcionais, mais {"usuarios": [...]} (reservas de outros usuários, só para Admins).
+    Exige uma conexão autenticada. Levanta ValueError se o pedido for inválido ou não permitido.
+    """
+    if usuario is None or not usuario.is_authenticated:
+        raise ValueError("A agenda exige login.")
+    if not isinstance(pedido, dict):
+        raise ValueError("Pedido de inscrição inválido.")
+    grupos = set()
+
+    grupos.update(eventos.grupo_recurso(recurso) for recurso in _lista_de_ids(pedido, 'recursos'))
+
+    if pedido.get('minhas'):
+        grupos.add(eventos.grupo_usuario(usuario.pk))
+    usuarios = _lista_de_ids(pedido, 'usuarios')
+    if usuarios and not usuario.is_staff:
+        raise ValueError("Apenas administradores acompanham reservas de outros usuários.")
+    grupos.update(eventos.grupo_usuario(outro) for outro in usuarios)
+
+    if 'inicio' in pedido or 'fim' in pedido:
+        inicio, fim = _instante(pedido.get('inicio')), _instante(pedido.get('fim'))
+        if inicio >= fim or fim - inicio > datetime.timedelta(days=MAXIMO_DIAS_JANELA):
+            raise ValueError(f"Janela inválida (máximo de {MAXIMO_DIAS_JANELA} dias).")
+        grupos.update(eventos.grupo_dia(dia) for dia in eventos.dias(inicio, fim))
+    return grupos
+
 
 class NotificacaoConsumer(AsyncWebsocketConsumer):
     """
@@ -15,18 +80,31 @@ class NotificacaoConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         """
         Evento disparado quando um cliente (Frontend) tenta abrir uma conexão WebSocket.
+        O usuário vem do Token enviado no handshake (reservas/autenticacao.py) ou da sessão.
         """
-        # Define um nome de grupo estático.
-        self.group_name = "admin_reservas"
+        # Token informado mas inválido: recusa o handshake
+        if self.scope.get('token_recusado'):
+            await self.close(code=4401)
+            return
+
+        # Grupo das notificações do painel administrativo: só para Admins
+        usuario = self.scope.get('user')
+        self.group_name = "admin_reservas" if getattr(usuario, 'is_staff', False) else None
+        # Grupos de relatórios em segundo plano que esta conexão acompanha (veja receive)
+        self.grupos_relatorio = set()
+        # Tópicos da agenda inscritos (recurso, usuário, dia) e os últimos deltas entregues
+        self.topicos = set()
+        self.eventos_entregues = {}
 
         # Adiciona o canal atual (self.channel_name) ao grupo.
         # self.channel_name é um ID único gerado automaticamente para cada aba/usuário conectado.
         # O 'await' é crucial aqui: como WebSockets lidam com milhares de conexões,
         # a operação é assíncrona para não travar o servidor esperando o banco de dados (Redis/Memória).
-        await self.channel_layer.group_add(
-            self.group_name,
-            self.channel_name
-        )
+        if self.group_name:
+            await self.channel_layer.group_add(
+                self.group_name,
+                self.channel_name
+            )
 
         # Aceita a conexão, completando o handshake HTTP -> WebSocket.
         await self.accept()
@@ -36,10 +114,110 @@ class NotificacaoConsumer(AsyncWebsocketConsumer):
         Evento disparado quando o cliente fecha a aba ou a internet cai.
         É vital limpar o grupo para não tentar enviar mensagens para fantasmas.
         """
-        await self.channel_layer.group_discard(
-            self.group_name,
-            self.channel_name
+        if not hasattr(self, 'topicos'):
+            return  # handshake recusado em connect()
+        if self.group_name:
+            await self.channel_layer.group_discard(
+                self.group_name,
+                self.channel_name
+            )
+        for grupo in self.grupos_relatorio | self.topicos:
+            await self.channel_layer.group_discard(grupo, self.channel_name)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        """
+        Mensagens enviadas PELO cliente:
+        - {"acompanhar_relatorio": "<id>"}: inscreve esta conexão no grupo do relatório em segundo
+          plano para ser avisada quando ele ficar pronto. O ID é um UUID: só quem criou o pedido o conhece.
+        - {"inscrever": {...}} / {"cancelar_inscricao": {...}}: tópicos da agenda (veja topicos_pedidos).
+          A resposta traz todos os tópicos inscritos e a sequência atual do log de eventos:
+          {"tipo": "inscricoes", "topicos": [...], "cursor": N}.
+        - {"retomar": N}: depois de reconectar (e se inscrever de novo), pede os deltas dos tópicos
+          inscritos com sequência maior que N, a última que o cliente recebeu (veja retomar).
+        Uma mesma mensagem pode trazer várias chaves; 'retomar' é tratada por último.
+        """
+        try:
+            mensagem = json.loads(text_data or '{}')
+        except ValueError:
+            return
+        if not isinstance(mensagem, dict):
+            return
+
+        if 'acompanhar_relatorio' in mensagem:
+            try:
+                relatorio = uuid.UUID(str(mensagem['acompanhar_relatorio']))
+            except ValueError:
+                return
+            grupo = f"relatorio_{relatorio}"
+            self.grupos_relatorio.add(grupo)
+            await self.channel_layer.group_add(grupo, self.channel_name)
+
+        for chave, inscrever in (('inscrever', True), ('cancelar_inscricao', False)):
+            if chave in mensagem:
+                await self.alterar_inscricoes(mensagem[chave], inscrever)
+
+        if 'retomar' in mensagem:
+            cursor = mensagem['retomar']
+            if isinstance(cursor, int) and not isinstance(cursor, bool) and cursor >= 0:
+                await self.retomar(cursor)
+            else:
+                await self.send(text_data=json.dumps({'tipo': 'erro', 'erro': "'retomar' deve ser uma sequência."}))
+
+    async def alterar_inscricoes(self, pedido, inscrever):
+        try:
+            grupos = topicos_pedidos(pedido, self.scope.get('user'))
+        except ValueError as e:
+            await self.send(text_data=json.dumps({'tipo': 'erro', 'erro': str(e)}))
+            return
+
+        if inscrever:
+            novos = grupos - self.topicos
+            if len(self.topicos) + len(novos) > MAXIMO_TOPICOS:
+                await self.send(text_data=json.dumps({
+                    'tipo': 'erro', 'erro': f"Limite de {MAXIMO_TOPICOS} tópicos por conexão."
+                }))
+                return
+            for grupo in novos:
+                await self.channel_layer.group_add(grupo, self.channel_name)
+            self.topicos |= novos
+        else:
+            for grupo in grupos & self.topicos:
+                await self.channel_layer.group_discard(grupo, self.channel_name)
+            self.topicos -= grupos
+
+        cursor = await database_sync_to_async(EventoAgenda.ultima_sequencia)()
+        await self.send(text_data=json.dumps({'tipo': 'inscricoes', 'topicos': sorted(self.topicos), 'cursor': cursor}))
+
+    async def retomar(self, cursor):
+        """
+        Deltas perdidos durante a desconexão, lidos do log EventoAgenda:
+        {"tipo": "retomada", "completa": true|false, "cursor": N, "alteracoes": [...]}.
+        Com "completa": false (parte do período já expirou do log, ou mudou coisa demais),
+        o cliente deve recarregar a agenda. As inscrições são feitas antes da leitura: o que chegar
+        ao mesmo tempo pelos tópicos não se perde e, se repetido, não é entregue duas vezes.
+        """
+        linhas, completa = await database_sync_to_async(EventoAgenda.desde)(self.topicos, cursor, MAXIMO_RETOMADA)
+        alteracoes = self.nao_entregues(
+            {'evento': linha.evento, 'seq': linha.pk, 'acao': linha.acao, 'reserva': linha.dados} for linha in linhas
         )
+        await self.send(text_data=json.dumps({
+            'tipo': 'retomada',
+            'completa': completa,
+            'cursor': max([cursor] + [linha.pk for linha in linhas]),
+            'alteracoes': alteracoes,
+        }))
+
+    def nao_entregues(self, deltas):
+        """Deltas ainda não entregues por esta conexão, sem o identificador interno 'evento'."""
+        alteracoes = []
+        for delta in deltas:
+            if delta['evento'] in self.eventos_entregues:
+                continue
+            self.eventos_entregues[delta['evento']] = None
+            alteracoes.append({'seq': delta['seq'], 'acao': delta['acao'], 'reserva': delta['reserva']})
+        while len(self.eventos_entregues) > MEMORIA_EVENTOS:
+            del self.eventos_entregues[next(iter(self.eventos_entregues))]
+        return alteracoes
 
     # Manipuladores de Eventos (Event Handlers)
 
@@ -59,4 +237,36 @@ class NotificacaoConsumer(AsyncWebsocketConsumer):
         # É aqui que o popup aparece na tela do Admin.
         await self.send(text_data=json.dumps({
             'message': mensagem
-        }))
\ No newline at end of file
+        }))
+
+    async def relatorio_atualizado(self, event):
+        """
+        Chamado pelo pool de tarefas quando um relatório em segundo plano termina (ou falha).
+        O cliente então baixa o arquivo em /reservas/api/relatorios/<id>/download/.
+        """
+        await self.send(text_data=json.dumps({
+            'tipo': 'relatorio',
+            'relatorio': event['relatorio'],
+            'status': event['status'],
+        }))
+
+    async def reservas_alteradas(self, event):
+        """
+        Deltas da agenda de um tópico inscrito (veja eventos.publicar_reservas):
+        {"tipo": "reservas", "alteracoes": [{"seq": N, "acao": "criada|atualizada|cancelada", "reserva": {...}}]}.
+        A 'reserva' tem o formato do feed do calendário; 'seq' é a sequência no log (para retomar).
+        Um delta que chega por mais de um tópico é entregue só uma vez.
+        """
+        alteracoes = self.nao_entregues(event['alteracoes'])
+        if alteracoes:
+            await self.send(text_data=json.dumps({'tipo': 'reservas', 'alteracoes': alteracoes}))
+
+    async def agenda_desatualizada(self, event):
+        """
+        Deltas de um tópico inscrito se perderam (o log da agenda falhou; veja
+        eventos._avisar_agenda_desatualizada): mesma resposta de uma retomada incompleta,
+        para o cliente recarregar a agenda.
+        """
+        await self.send(text_data=json.dumps({
+            'tipo': 'retomada', 'completa': False, 'cursor': event['cursor'], 'alteracoes': [],
+        }))
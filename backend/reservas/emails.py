@@ -0,0 +1,149 @@
+"""
+Fila de saída de e-mails (EmailPendente) e o remetente que a esvazia em segundo plano.
+
+A requisição apenas grava a mensagem e responde; o SMTP (lento e sujeito a falhas) fica fora do
+caminho da resposta. O remetente:
+- reserva lotes de mensagens vencidas (UPDATE com um ID de envio), para que dois processos
+  nunca enviem a mesma mensagem;
+- envia cada lote por UMA conexão SMTP, aberta uma vez e reaproveitada por todo o envio;
+- em caso de falha, agenda nova tentativa com espera exponencial (1, 2, 4, 8... minutos);
+- esgotadas as tentativas, marca a mensagem como 'F' (dead letter), listada no Admin para reenvio.
+
+O envio é disparado após o commit de quem enfileirou, na fila 'emails' de reservas/tarefas.py
+(pool próprio, separado do que renderiza relatórios). Ao terminar, o envio se agenda para a próxima
+mensagem que aguarda uma nova tentativa; como esse agendamento se perde quando o processo reinicia,
+o serviço 'emails' do docker-compose roda 'manage.py enviar_emails --continuo' como garantia.
+Funciona com qualquer EMAIL_BACKEND (inclusive locmem nos testes e console no desenvolvimento).
+"""
+import datetime
+import logging
+import uuid
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db.models import F
+from django.utils import timezone
+
+from .models import EmailPendente
+from .tarefas import agendar, executar_em_segundo_plano
+
+logger = logging.getLogger(__name__)
+
+# Tempo que um envio tem para concluir um lote reservado; depois disso, outro processo pode retomá-lo
+PRAZO_ENVIO = datetime.timedelta(minutes=10)
+ESPERA_MAXIMA = datetime.timedelta(hours=1)
+
+
+def _configuracao():
+    """(mensagens por lote, tentativas antes do dead letter, espera da 1ª nova tentativa em segundos)."""
+    return (
+        getattr(settings, 'EMAIL_FILA_LOTE', 50),
+        getattr(settings, 'EMAIL_FILA_TENTATIVAS', 5),
+        getattr(settings, 'EMAIL_FILA_ESPERA', 60),
+    )
+
+
+def enfileirar(assunto, mensagem, destinatarios, remetente=''):
+    """Grava um e-mail na fila de saída; o envio acontece após o commit, em segundo plano."""
+    return enfileirar_varios([(assunto, mensagem, remetente, destinatarios)])
+
+
+def enfileirar_varios(mensagens):
+    """Várias mensagens, no formato de send_mass_mail: (assunto, mensagem, remetente, destinatários)."""
+    pendentes = EmailPendente.objects.bulk_create([
+        EmailPendente(assunto=assunto, mensagem=mensagem, remetente=remetente or '', destinatarios=list(destinatarios))
+        for assunto, mensagem, remetente, destinatarios in mensagens
+        if destinatarios
+    ])
+    if pendentes:
+        executar_em_segundo_plano(enviar_pendentes, fila='emails')
+    return pendentes
+
+
+def espera(tentativas):
+    """Intervalo até a próxima tentativa, dobrando a cada falha (limitado a ESPERA_MAXIMA)."""
+    _, _, base = _configuracao()
+    return min(datetime.timedelta(seconds=base * 2 ** (tentativas - 1)), ESPERA_MAXIMA)
+
+
+def _reservar_lote(tamanho):
+    agora = timezone.now()
+    vencidas = EmailPendente.objects.filter(status='P', proxima_tentativa__lte=agora)
+    ids = list(vencidas.order_by('proxima_tentativa').values_list('pk', flat=True)[:tamanho])
+    if not ids:
+        return None
+    envio = uuid.uuid4()
+    vencidas.filter(pk__in=ids).update(envio=envio, proxima_tentativa=agora + PRAZO_ENVIO)
+    return list(EmailPendente.objects.filter(envio=envio).order_by('pk'))
+
+
+def _registrar_falha(pendente, erro, tentativas_maximas):
+    tentativas = pendente.tentativas + 1
+    EmailPendente.objects.filter(pk=pendente.pk).update(
+        tentativas=F('tentativas') + 1,
+        status='F' if tentativas >= tentativas_maximas else 'P',
+        proxima_tentativa=timezone.now() + espera(tentativas),
+        ultimo_erro=f"{type(erro).__name__}: {erro}",
+        envio=None,
+    )
+    logger.warning("Falha ao enviar o e-mail %s (tentativa %s): %s", pendente.pk, tentativas, erro)
+
+
+def _agendar_proxima_tentativa():
+    """Agenda um novo envio para quando vencer a próxima mensagem que aguarda nova tentativa."""
+    proxima = (
+        EmailPendente.objects.filter(status='P').order_by('proxima_tentativa')
+        .values_list('proxima_tentativa', flat=True).first()
+    )
+    if proxima is not None:
+        agendar(enviar_pendentes, max((proxima - timezone.now()).total_seconds(), 0), fila='emails')
+
+
+def enviar_pendentes():
+    """
+    Envia todas as mensagens vencidas, lote a lote, pela mesma conexão SMTP, e agenda o próximo
+    envio para a primeira que ainda aguarda. Retorna (enviadas, falhas).
+    """
+    tamanho, tentativas_maximas, _ = _configuracao()
+    enviadas = falhas = 0
+    conexao = get_connection(fail_silently=False)
+    try:
+        while (lote := _reservar_lote(tamanho)) is not None:
+            try:
+                conexao.open()
+            except Exception as erro:
+                # Servidor fora do ar: o lote inteiro volta para a fila, com espera
+                for pendente in lote:
+                    _registrar_falha(pendente, erro, tentativas_maximas)
+                return enviadas, falhas + len(lote)
+
+            sucesso = []
+            for pendente in lote:
+                mensagem = EmailMessage(
+                    pendente.assunto, pendente.mensagem, pendente.remetente or None,
+                    pendente.destinatarios, connection=conexao,
+                )
+                try:
+                    conexao.send_messages([mensagem])
+                except Exception as erro:
+                    _registrar_falha(pendente, erro, tentativas_maximas)
+                    falhas += 1
+                else:
+                    sucesso.append(pendente.pk)
+
+            EmailPendente.objects.filter(pk__in=sucesso).update(
+                status='E', enviado_em=timezone.now(), envio=None, ultimo_erro=''
+            )
+            enviadas += len(sucesso)
+    finally:
+        conexao.close()
+        _agendar_proxima_tentativa()
+    return enviadas, falhas
+
+
+def reenviar(mensagens):
+    """Devolve à fila (com as tentativas zeradas) mensagens do dead letter, e dispara o envio."""
+    quantidade = mensagens.update(status='P', tentativas=0, proxima_tentativa=timezone.now(), envio=None)
+    if quantidade:
+        executar_em_segundo_plano(enviar_pendentes, fila='emails')
+    return quantidade
@@ -0,0 +1,305 @@
+"""
+Publicação dos eventos de WebSocket sem travar a requisição.
+
+Antes, a View chamava async_to_sync(group_send) e ficava esperando o channel layer aceitar a
+mensagem: com o Redis lento ou fora do ar, a criação da reserva esperava junto. Agora:
+- publicar() só registra o evento para DEPOIS do commit (quem recebe a notificação já encontra
+  a reserva no banco; se a transação for desfeita, nada é enviado);
+- no commit, o evento entra em uma fila limitada (EVENTOS_FILA_MAXIMA). Fila cheia = o evento é
+  descartado e contado, nunca bloqueia;
+- uma thread do processo esvazia a fila: espera EVENTOS_JANELA segundos juntando a rajada,
+  combina os eventos repetidos (coalescer) e os envia, cada envio limitado a EVENTOS_TIMEOUT.
+
+metricas() expõe a profundidade da fila e os contadores (publicados, descartados, combinados,
+falhas); veja /reservas/api/eventos/metricas/.
+Com TAREFAS_SINCRONAS = True (testes), o evento é enviado logo após o commit, na própria thread.
+
+Alterações de reservas (publicar_reservas) vão para tópicos em vez de para todo mundo: o recurso,
+o dono da reserva e cada dia que ela ocupa (veja NotificacaoConsumer.receive). Cada tópico recebe
+um único evento com a lista de deltas {acao, reserva}, no formato do feed do calendário, para o
+FullCalendar aplicar a mudança sem recarregar a semana. A serialização das reservas e a gravação
+no log (EventoAgenda) acontecem após o commit, fora da transação (e da trava) da reserva. Se a
+gravação falhar, a reserva continua gravada: a falha é registrada e os tópicos recebem
+'agenda_desatualizada', para os clientes recarregarem em vez de perder os deltas.
+"""
+import asyncio
+import copy
+import datetime
+import logging
+import queue
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import STATUS_ATIVOS, EventoAgenda
+from .serializers import ReservaCalendarioSerializer
+
+logger = logging.getLogger(__name__)
+
+_fila = None
+_trabalhador = None
+_trava = threading.Lock()
+_contadores = {'publicados': 0, 'descartados': 0, 'combinados': 0, 'falhas': 0}
+
+
+def _configuracao():
+    """(capacidade da fila, janela de agrupamento em segundos, tempo máximo por envio em segundos)."""
+    return (
+        getattr(settings, 'EVENTOS_FILA_MAXIMA', 1000),
+        getattr(settings, 'EVENTOS_JANELA', 0.05),
+        getattr(settings, 'EVENTOS_TIMEOUT', 2),
+    )
+
+
+def _contar(nome, quantidade=1):
+    with _trava:
+        _contadores[nome] += quantidade
+
+
+def _obter_fila():
+    # Fila e thread criadas sob demanda, como o pool de reservas/tarefas.py
+    global _fila, _trabalhador
+    with _trava:
+        if _fila is None:
+            _fila = queue.Queue(maxsize=_configuracao()[0])
+        if _trabalhador is None or not _trabalhador.is_alive():
+            _trabalhador = threading.Thread(target=_esvaziar, name='eventos', daemon=True)
+            _trabalhador.start()
+        return _fila
+
+
+def publicar(grupo, mensagem):
+    """
+    Envia 'mensagem' (com a chave 'type' do handler no NotificacaoConsumer) ao grupo 'grupo',
+    após o commit da transação atual. Não bloqueia nem levanta exceções.
+    """
+    def enfileirar():
+        if getattr(settings, 'TAREFAS_SINCRONAS', False):
+            try:
+                _enviar([(grupo, mensagem)])
+            except Exception:
+                _contar('falhas')
+                logger.exception("Falha ao publicar o evento para '%s'", grupo)
+            return
+        try:
+            _obter_fila().put_nowait((grupo, mensagem))
+        except queue.Full:
+            _contar('descartados')
+            logger.warning("Fila de eventos cheia: evento para '%s' descartado", grupo)
+
+    transaction.on_commit(enfileirar)
+
+
+def _juntar_textos(anterior, mensagem):
+    return {**anterior, 'message': f"{anterior['message']}\n{mensagem['message']}"}
+
+
+def _juntar_alteracoes(anterior, mensagem):
+    return {**anterior, 'alteracoes': anterior['alteracoes'] + mensagem['alteracoes']}
+
+
+# Como combinar dois eventos do mesmo tipo para o mesmo grupo dentro de uma janela.
+# Tipos fora daqui: vale o mais recente (ex: o status final de um relatório).
+COMBINAR = {
+    'enviar_notificacao': _juntar_textos,
+    'reservas_alteradas': _juntar_alteracoes,
+}
+
+
+def coalescer(eventos):
+    """Um evento por (grupo, tipo), na ordem em que cada par apareceu pela primeira vez."""
+    combinados = {}
+    for grupo, mensagem in eventos:
+        chave = (grupo, mensagem['type'])
+        anterior = combinados.get(chave)
+        if anterior is None:
+            combinados[chave] = mensagem
+        else:
+            combinar = COMBINAR.get(mensagem['type'])
+            combinados[chave] = combinar(anterior, mensagem) if combinar else mensagem
+    return [(grupo, mensagem) for (grupo, _), mensagem in combinados.items()]
+
+
+def _enviar(eventos):
+    _, _, limite = _configuracao()
+    camada = get_channel_layer()
+
+    async def enviar(grupo, mensagem):
+        try:
+            await asyncio.wait_for(camada.group_send(grupo, mensagem), timeout=limite)
+            return True
+        except Exception as erro:
+            logger.warning("Falha ao publicar o evento para '%s': %r", grupo, erro)
+            return False
+
+    async def enviar_todos():
+        return await asyncio.gather(*(enviar(grupo, mensagem) for grupo, mensagem in eventos))
+
+    resultados = async_to_sync(enviar_todos)()
+    _contar('publicados', sum(resultados))
+    _contar('falhas', len(resultados) - sum(resultados))
+
+
+def _esvaziar():
+    _, janela, _ = _configuracao()
+    while True:
+        eventos = [_fila.get()]
+        # Junta a rajada: o que chegar durante a janela vai no mesmo envio
+        time.sleep(janela)
+        while True:
+            try:
+                eventos.append(_fila.get_nowait())
+            except queue.Empty:
+                break
+
+        combinados = coalescer(eventos)
+        _contar('combinados', len(eventos) - len(combinados))
+        try:
+            _enviar(combinados)
+        except Exception:
+            _contar('falhas', len(combinados))
+            logger.exception("Falha ao publicar %s evento(s)", len(combinados))
+        finally:
+            for _ in eventos:
+                _fila.task_done()
+
+
+def aguardar():
+    """Bloqueia até a fila ser totalmente enviada (comandos, testes)."""
+    if _fila is not None:
+        _fila.join()
+
+
+# Tópicos da agenda
+
+def grupo_recurso(recurso_id):
+    return f"recurso_{recurso_id}"
+
+
+def grupo_usuario(usuario_id):
+    return f"usuario_{usuario_id}"
+
+
+def grupo_dia(dia):
+    return f"agenda_{dia.isoformat()}"
+
+
+def dias(inicio, fim):
+    """Datas locais tocadas pelo intervalo [inicio, fim)."""
+    dia = timezone.localtime(inicio).date()
+    ultimo = timezone.localtime(fim - datetime.timedelta(microseconds=1)).date()
+    while dia <= ultimo:
+        yield dia
+        dia += datetime.timedelta(days=1)
+
+
+def _topicos(usuario_id, recurso_id, inicio, fim):
+    return {grupo_recurso(recurso_id), grupo_usuario(usuario_id), *(grupo_dia(dia) for dia in dias(inicio, fim))}
+
+
+def publicar_reservas(alteracoes):
+    """
+    Publica (após o commit) as alterações de reservas nos tópicos afetados.
+    'alteracoes': (reserva, estado anterior, removida), em que o estado anterior é o
+    Reserva.estado_estatisticas() de antes da mudança (None para uma reserva nova).
+
+    Ações: 'criada'; 'atualizada' (continua na agenda, talvez em outro horário ou sala: os tópicos
+    antigos também a recebem, para o cliente movê-la ou tirá-la da sua visão); 'cancelada' (saiu
+    da agenda: cancelada, rejeitada ou excluída). O mesmo delta, enviado a vários tópicos, leva um
+    único 'evento', para a conexão inscrita em mais de um deles entregá-lo uma vez só.
+    Cada (delta, tópico) também vai para o log EventoAgenda; 'seq' é o ID da linha, usado pelo
+    cliente para retomar de onde parou após uma reconexão.
+
+    Aqui só se decidem ação e tópicos; serializar, gravar o log e publicar ficam para depois do
+    commit (_gravar_e_publicar), quando a trava da agenda já foi liberada. Só as exclusões são
+    serializadas aqui, enquanto o Recurso ainda existe.
+    """
+    pendentes = []
+    for reserva, anterior, removida in alteracoes:
+        ativa = not removida and reserva.status in STATUS_ATIVOS
+        estava_ativa = anterior is not None and anterior[1] in STATUS_ATIVOS
+        if not ativa and not estava_ativa and not removida:
+            continue  # fora da agenda antes e depois: nada a desenhar
+
+        if ativa:
+            acao = 'atualizada' if anterior is not None else 'criada'
+        else:
+            acao = 'cancelada'
+        grupos = _topicos(reserva.usuario_id, reserva.recurso_id, reserva.data_hora_inicio, reserva.data_hora_fim)
+        if anterior is not None:
+            recurso_id, _, inicio, fim = anterior
+            grupos |= _topicos(reserva.usuario_id, recurso_id, inicio, fim)
+
+        if removida:
+            # Excluída (talvez junto com o Recurso): depois do commit não há mais de onde ler o título
+            dados = dict(ReservaCalendarioSerializer(reserva).data)
+        else:
+            # Cópia: guarda o estado desta alteração, mesmo que a reserva mude de novo antes do commit
+            dados = copy.copy(reserva)
+        pendentes.append((reserva.pk, dados, acao, sorted(grupos)))
+
+    if pendentes:
+        # robust: uma falha aqui é registrada (veja _gravar_e_publicar) e não vira um 500 para
+        # quem já teve a reserva gravada
+        transaction.on_commit(lambda: _gravar_e_publicar(pendentes), robust=True)
+
+
+def _gravar_e_publicar(pendentes):
+    try:
+        linhas = []
+        for reserva_id, dados, acao, grupos in pendentes:
+            if not isinstance(dados, dict):
+                dados = dict(ReservaCalendarioSerializer(dados).data)
+            evento = uuid.uuid4().hex
+            linhas.extend(
+                EventoAgenda(evento=evento, grupo=grupo, reserva_id=reserva_id, acao=acao, dados=dados)
+                for grupo in grupos
+            )
+        # O ID de cada linha é a sequência enviada ao cliente (veja EventoAgenda.gravar)
+        gravadas = EventoAgenda.gravar(linhas)
+    except Exception:
+        _contar('falhas')
+        logger.exception("Falha ao gravar %d alteração(ões) no log da agenda", len(pendentes))
+        _avisar_agenda_desatualizada(sorted({grupo for *_, grupos in pendentes for grupo in grupos}))
+        return
+
+    por_grupo = defaultdict(list)
+    for linha in gravadas:
+        por_grupo[linha.grupo].append(
+            {'evento': linha.evento, 'seq': linha.pk, 'acao': linha.acao, 'reserva': linha.dados}
+        )
+    for grupo, deltas in por_grupo.items():
+        publicar(grupo, {'type': 'reservas_alteradas', 'alteracoes': deltas})
+
+
+def _avisar_agenda_desatualizada(grupos):
+    """
+    Os deltas não entraram no log: sem aviso, quem está nos tópicos e quem retomar pelo cursor
+    nunca os veria. Os conectados recebem "retomada" incompleta (recarregam a agenda) e o
+    horizonte passa da última sequência, para quem retomar depois também recarregar.
+    """
+    cursor = 0
+    try:
+        cursor = EventoAgenda.ultima_sequencia()
+        EventoAgenda.avancar_horizonte(cursor + 1)
+    except Exception:
+        logger.exception("Falha ao avançar o horizonte do log da agenda")
+    for grupo in grupos:
+        publicar(grupo, {'type': 'agenda_desatualizada', 'cursor': cursor})
+
+
+def metricas():
+    capacidade = _configuracao()[0]
+    with _trava:
+        return {
+            'profundidade': _fila.qsize() if _fila is not None else 0,
+            'capacidade': _fila.maxsize if _fila is not None else capacidade,
+            **_contadores,
+        }
@@ -0,0 +1,211 @@
+"""
+Limites de taxa e controle de admissão da API.
+
+Na semana de matrícula, poucos clientes repetindo a busca de salas saturam o único processo
+Daphne (SQLite). Em vez de enfileirar pedidos até estourarem o tempo, o excesso é recusado na hora
+com 429 e Retry-After (segundos até poder tentar de novo).
+
+1. Janela fixa por cliente, contada no cache compartilhado (CACHES 'default'): no máximo N pedidos
+   a cada janela de T segundos; veja LIMITES_TAXA.
+   - LimitePorCliente: todo pedido da API, por usuário autenticado ('usuario') ou, sem login,
+     por IP ('ip');
+   - LimitePorEndpoint: contadores próprios, por usuário/IP, das rotas marcadas com 'limite'
+     (ou 'limites' por action, nos ViewSets): busca, criação de reservas e login.
+   Cada janela é uma chave do cache, contada com cache.add + cache.incr: no Redis, o incremento é
+   atômico entre todos os processos (no cache em memória, só dentro do processo). Na virada da
+   janela, um cliente pode chegar a 2N pedidos em pouco tempo: é a troca por não precisar de trava.
+   Se o cache falhar, o pedido passa.
+
+2. LimiteConcorrenciaMiddleware: no máximo CONCORRENCIA['escritas'] escritas e
+   CONCORRENCIA['relatorios'] relatórios síncronos em andamento POR PROCESSO. Roda no event loop,
+   antes de o pedido esperar pela thread das Views: o que passaria do limite volta 429 na hora.
+   Com vários processos, o total de escritas simultâneas no SQLite é o limite vezes os processos.
+"""
+import logging
+import math
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+from rest_framework import exceptions
+from rest_framework.throttling import BaseThrottle
+
+logger = logging.getLogger(__name__)
+
+
+def consumir(escopo, identidade):
+    """
+    Conta um pedido na janela atual de (escopo, identidade). Devolve 0 se o pedido pode seguir,
+    ou os segundos até a próxima janela.
+    """
+    pedidos, janela = settings.LIMITES_TAXA[escopo]
+    agora = time.time()
+    numero = int(agora // janela)
+    chave = f"limite:{escopo}:{identidade}:{numero}"
+    backend = caches['default']
+    try:
+        # A chave some do cache logo depois do fim da sua janela
+        backend.add(chave, 0, timeout=math.ceil(janela) + 1)
+        usados = backend.incr(chave)
+    except ValueError:
+        # Expirou entre o add e o incr (fim da janela): o pedido abre a próxima
+        return 0
+    except Exception:
+        logger.exception("Cache indisponível: limite '%s' não aplicado", escopo)
+        return 0
+    return 0 if usados <= pedidos else (numero + 1) * janela - agora
+
+
+def _usuario(request):
+    """Usuário autenticado ou None. Token inválido conta como anônimo: a View decide se recusa."""
+    try:
+        usuario = request.user
+    except exceptions.APIException:
+        return None
+    return usuario if usuario and usuario.is_authenticated else None
+
+
+class _LimiteJanela(BaseThrottle):
+    """Conta o pedido na janela fixa do escopo (consumir); o escopo vem de cada subclasse."""
+
+    def escopo(self, request, view):
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        escopo = self.escopo(request, view)
+        if escopo is None:
+            return True
+        usuario = _usuario(request)
+        identidade = f"usuario_{usuario.pk}" if usuario else f"ip_{self.get_ident(request)}"
+        self.espera = consumir(escopo, identidade)
+        return not self.espera
+
+    def wait(self):
+        return math.ceil(self.espera)
+
+
+class LimitePorCliente(_LimiteJanela):
+    """Janela geral de cada usuário autenticado ('usuario') ou de cada IP sem login ('ip')."""
+
+    def escopo(self, request, view):
+        return 'usuario' if _usuario(request) else 'ip'
+
+
+class LimitePorEndpoint(_LimiteJanela):
+    """
+    Janela por rota: a View declara 'limite = <escopo>' ou, em um ViewSet,
+    'limites = {<action>: <escopo>}'. Rotas sem escopo não são limitadas aqui.
+    """
+
+    def escopo(self, request, view):
+        limites = getattr(view, 'limites', None)
+        if limites is not None:
+            return limites.get(getattr(view, 'action', None))
+        return getattr(view, 'limite', None)
+
+
+# Controle de admissão
+
+class _Vagas:
+    def __init__(self, maximo):
+        self.maximo = maximo
+        self.ocupadas = 0
+        self.trava = threading.Lock()
+
+    def ocupar(self):
+        with self.trava:
+            if self.ocupadas >= self.maximo:
+                return False
+            self.ocupadas += 1
+            return True
+
+    def liberar(self):
+        with self.trava:
+            self.ocupadas -= 1
+
+
+def classificar(request):
+    """'relatorios', 'escritas' ou None (sem limite de concorrência)."""
+    if not request.path.startswith('/reservas/api/'):
+        return None
+    if request.path.rstrip('/').rsplit('/', 1)[-1] in ('relatorio_pdf', 'relatorio_excel'):
+        return 'relatorios'
+    if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+        return 'escritas'
+    return None
+
+
+class LimiteConcorrenciaMiddleware:
+    """Recusa (429) escritas e relatórios além do limite de pedidos simultâneos deste processo."""
+    async_capable = True
+    sync_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.vagas = {grupo: _Vagas(maximo) for grupo, maximo in settings.CONCORRENCIA.items()}
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def _recusar(self, grupo):
+        resposta = JsonResponse(
+            {"erro": "Servidor ocupado. Tente novamente em instantes."}, status=429
+        )
+        resposta['Retry-After'] = str(getattr(settings, 'CONCORRENCIA_RETRY_AFTER', 1))
+        logger.warning("Limite de concorrência de '%s' atingido", grupo)
+        return resposta
+
+    def _liberar_no_fim(self, resposta, vagas):
+        # Relatório em streaming: a vaga só é liberada quando o conteúdo termina de ser enviado
+        if not resposta.streaming:
+            vagas.liberar()
+            return resposta
+        conteudo = resposta.streaming_content
+
+        def enviar():
+            try:
+                yield from conteudo
+            finally:
+                vagas.liberar()
+
+        async def enviar_assincrono():
+            try:
+                async for parte in conteudo:
+                    yield parte
+            finally:
+                vagas.liberar()
+
+        resposta.streaming_content = enviar_assincrono() if resposta.is_async else enviar()
+        return resposta
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        grupo = classificar(request)
+        vagas = self.vagas.get(grupo)
+        if vagas is None:
+            return self.get_response(request)
+        if not vagas.ocupar():
+            return self._recusar(grupo)
+        try:
+            resposta = self.get_response(request)
+        except BaseException:
+            vagas.liberar()
+            raise
+        return self._liberar_no_fim(resposta, vagas)
+
+    async def __acall__(self, request):
+        grupo = classificar(request)
+        vagas = self.vagas.get(grupo)
+        if vagas is None:
+            return await self.get_response(request)
+        if not vagas.ocupar():
+            return self._recusar(grupo)
+        try:
+            resposta = await self.get_response(request)
+        except BaseException:
+            vagas.liberar()
+            raise
+        return self._liberar_no_fim(resposta, vagas)
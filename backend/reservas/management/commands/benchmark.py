@@ -0,0 +1,446 @@
+import asyncio
+import datetime
+import io
+import multiprocessing
+import random
+import statistics
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import InMemoryChannelLayer, channel_layers, get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from reservas import agenda, ocupacao, relatorios
+from reservas.autenticacao import TokenAuthenticationEmCache, cache_tokens
+from reservas.consumers import NotificacaoConsumer
+from reservas.models import OcupacaoDia, Recurso, Reserva, ValidadeToken
+
+
+class Command(BaseCommand):
+    help = 'Mede o desempenho das consultas críticas em um banco de dados descartável (não toca no banco real)'
+
+    # Cenário -> método que o executa
+    CENARIOS = {
+        'conflitos': 'benchmark_conflitos',
+        'relatorio_pdf': 'benchmark_relatorio_pdf',
+        'ocupacao': 'benchmark_ocupacao',
+        'disponibilidade': 'benchmark_disponibilidade',
+        'fanout': 'benchmark_fanout',
+        'autenticacao': 'benchmark_autenticacao',
+    }
+
+    # Tamanhos medidos quando --tamanhos não é informado
+    TAMANHOS_PADRAO = {
+        'conflitos': [10_000, 100_000, 1_000_000],
+        'relatorio_pdf': [1_000, 10_000, 100_000],
+        # Um semestre (~18 semanas) de reservas de 1h a cada 2h, em 200 salas, tem ~300 mil reservas
+        'ocupacao': [100_000, 300_000],
+        'disponibilidade': [10_000, 100_000, 1_000_000],
+        # No fanout, os tamanhos são conexões WebSocket abertas
+        'fanout': [1_000, 10_000],
+        # Na autenticação, os tamanhos são tokens ativos (usuários distintos fazendo requisições)
+        'autenticacao': [1_000, 10_000, 50_000],
+    }
+    # Tempo máximo (p95) das taxas de ocupação de um semestre em 200 salas (painéis do Chart.js)
+    META_OCUPACAO_MS = 200
+
+    # O InMemoryChannelLayer limpa os canais expirados a cada envio (custo O(conexões) por mensagem):
+    # 10 mil conexões em um processo levariam minutos por rodada, então o padrão local é menor
+    TAMANHOS_FANOUT_EM_MEMORIA = [100, 1_000]
+
+    def add_arguments(self, parser):
+        parser.add_argument('cenario', choices=sorted(self.CENARIOS))
+        parser.add_argument(
+            '--tamanhos', nargs='+', type=int,
+            help='Quantidades de reservas no histórico (ou de conexões, no fanout) a medir (padrão depende do cenário).'
+        )
+        parser.add_argument('--amostras', type=int, default=200, help='Consultas medidas por tamanho.')
+        parser.add_argument('--recursos', type=int, default=200, help='Quantidade de salas geradas.')
+        parser.add_argument(
+            '--processos', type=int,
+            help='Fanout: processos que dividem as conexões (como workers Daphne). '
+                 'Padrão: 4 com REDIS_URL, 1 sem ele (mais de 1 exige REDIS_URL).'
+        )
+        parser.add_argument(
+            '--sem-indices', action='store_true',
+            help='Remove os índices de Reserva antes de medir (linha de base para comparação).'
+        )
+
+    def handle(self, *args, **options):
+        # Cria um banco de testes isolado (o mesmo mecanismo do 'manage.py test')
+        nome_original = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        random.seed(42)
+        options['tamanhos'] = options['tamanhos'] or self.TAMANHOS_PADRAO[options['cenario']]
+        try:
+            if options['sem_indices']:
+                with connection.schema_editor() as editor:
+                    for indice in Reserva._meta.indexes:
+                        editor.remove_index(Reserva, indice)
+            getattr(self, self.CENARIOS[options['cenario']])(**options)
+        finally:
+            connection.creation.destroy_test_db(nome_original, verbosity=0)
+
+    # Geração de dados
+
+    def preparar_base(self, quantidade_recursos):
+        self.usuario = User.objects.create_user('benchmark')
+        self.recursos = list(Recurso.objects.bulk_create(
+            Recurso(nome=f'Sala {i:04d}', capacidade_maxima=10 + i % 90) for i in range(quantidade_recursos)
+        ))
+        self.agora = timezone.now().replace(minute=0, second=0, microsecond=0)
+        self.total_gerado = 0
+
+    def popular_historico(self, total, lote=10_000):
+        """
+        Completa o histórico até 'total' reservas, sem chamar save() (sem full_clean).
+        Cada sala recebe slots de 1h, um a cada 2h, voltando no tempo a partir de agora.
+        ~15% das reservas ficam canceladas/rejeitadas, como em uma base real.
+        """
+        quantidade_recursos = len(self.recursos)
+        while self.total_gerado < total:
+            fim_lote = min(total, self.total_gerado + lote)
+            reservas = []
+            for i in range(self.total_gerado, fim_lote):
+                slot = i // quantidade_recursos + 1
+                inicio = self.agora - datetime.timedelta(hours=2 * slot)
+                reservas.append(Reserva(
+                    recurso=self.recursos[i % quantidade_recursos],
+                    usuario=self.usuario,
+                    data_hora_inicio=inicio,
+                    data_hora_fim=inicio + datetime.timedelta(hours=1),
+                    motivo='Histórico',
+                    status=random.choices('CPMXR', weights=[70, 10, 5, 10, 5])[0],
+                ))
+            Reserva.objects.bulk_create(reservas, batch_size=lote)
+            self.total_gerado = fim_lote
+
+    # Medição
+
+    def medir(self, consulta, amostras):
+        """Executa 'consulta()' N vezes e devolve (média, p95) em milissegundos."""
+        tempos = []
+        for _ in range(amostras):
+            inicio = time.perf_counter()
+            consulta()
+            tempos.append((time.perf_counter() - inicio) * 1000)
+        tempos.sort()
+        return statistics.mean(tempos), tempos[int(len(tempos) * 0.95) - 1]
+
+    def escrever_tabela(self, titulo, linhas):
+        self.stdout.write(self.style.SUCCESS(titulo))
+        self.stdout.write(f"{'Reservas':>12} | {'Média (ms)':>11} | {'p95 (ms)':>9}")
+        for total, media, p95 in linhas:
+            self.stdout.write(f'{total:>12,} | {media:>11.3f} | {p95:>9.3f}')
+
+    # Cenários
+
+    def benchmark_conflitos(self, tamanhos, amostras, recursos, **kwargs):
+        """
+        Latência da verificação de conflito de Reserva.clean() (a consulta executada em toda escrita)
+        conforme o histórico cresce. Com os índices compostos, deve permanecer praticamente constante.
+        """
+        self.preparar_base(recursos)
+
+        def verificar_conflito():
+            recurso = random.choice(self.recursos)
+            inicio = self.agora + datetime.timedelta(hours=random.randint(-48, 24 * 14))
+            fim = inicio + datetime.timedelta(hours=random.randint(1, 4))
+            Reserva.objects.filter(recurso=recurso).ativas().intersectando(inicio, fim).exists()
+
+        linhas = []
+        for total in sorted(tamanhos):
+            self.stdout.write(f'Gerando histórico com {total:,} reservas...')
+            self.popular_historico(total)
+            media, p95 = self.medir(verificar_conflito, amostras)
+            linhas.append((total, media, p95))
+
+        plano = (
+            Reserva.objects.filter(recurso=self.recursos[0]).ativas()
+            .intersectando(self.agora, self.agora + datetime.timedelta(hours=1)).order_by().explain()
+        )
+        self.stdout.write(f'Plano de execução: {plano}')
+        self.escrever_tabela('Verificação de conflito (Reserva.clean)', linhas)
+
+    def benchmark_relatorio_pdf(self, tamanhos, recursos, **kwargs):
+        """
+        Vazão (linhas/s) do relatório PDF (relatorios.gerar_pdf), sem e com agrupamento,
+        incluindo a leitura das reservas do banco.
+        """
+        self.preparar_base(recursos)
+        admin = User(is_staff=True)
+
+        self.stdout.write(self.style.SUCCESS('Relatório PDF (relatorios.gerar_pdf)'))
+        self.stdout.write(f"{'Reservas':>12} | {'Agrupar':>8} | {'Tempo (s)':>9} | {'Linhas/s':>9} | {'Tamanho (KB)':>12}")
+        for total in sorted(tamanhos):
+            self.popular_historico(total)
+            for agrupar in (None, 'recurso', 'dia'):
+                destino = io.BytesIO()
+                inicio = time.perf_counter()
+                relatorios.gerar_pdf(relatorios.reservas_do_relatorio(admin, {}), destino, agrupar=agrupar)
+                tempo = time.perf_counter() - inicio
+                self.stdout.write(
+                    f"{total:>12,} | {agrupar or '-':>8} | {tempo:>9.2f} | {total / tempo:>9,.0f} | "
+                    f"{len(destino.getvalue()) / 1024:>12,.0f}"
+                )
+
+    def benchmark_ocupacao(self, tamanhos, amostras, recursos, **kwargs):
+        """
+        Latência das taxas de ocupação (ocupacao.taxas_de_ocupacao) de todas as salas
+        em um semestre (126 dias), com o histórico crescendo.
+        """
+        self.preparar_base(recursos)
+        fim = self.agora
+        inicio = fim - datetime.timedelta(days=126)
+
+        linhas = []
+        for total in sorted(tamanhos):
+            self.stdout.write(f'Gerando histórico com {total:,} reservas...')
+            self.popular_historico(total)
+            # bulk_create não dispara sinais: os contadores de ocupação são montados de uma vez
+            OcupacaoDia.reconstruir()
+            # Período fora das horas cheias, como vem do calendário do frontend
+            media, p95 = self.medir(
+                lambda: ocupacao.taxas_de_ocupacao(inicio + datetime.timedelta(minutes=30), fim), min(amostras, 20)
+            )
+            linhas.append((total, media, p95))
+
+        self.escrever_tabela(f'Taxas de ocupação ({recursos} salas, 126 dias)', linhas)
+        lentos = [total for total, _, p95 in linhas if p95 > self.META_OCUPACAO_MS]
+        if lentos:
+            raise CommandError(
+                f'Taxas de ocupação acima de {self.META_OCUPACAO_MS} ms (p95) com '
+                f"{', '.join(f'{total:,}' for total in lentos)} reservas."
+            )
+
+    def benchmark_disponibilidade(self, tamanhos, amostras, recursos, **kwargs):
+        """
+        Busca de salas livres (buscar_disponiveis): consulta no banco (exclude + subquery)
+        contra o índice em memória (agenda.py), com 30 dias de agenda futura e o histórico crescendo.
+        Mede também as 10 primeiras sugestões de 3h em uma semana (agenda.sugerir_horarios).
+        """
+        self.preparar_base(recursos)
+        futuras = []
+        for dia in range(30):
+            for recurso in self.recursos:
+                for hora in range(8, 21, 2):
+                    if random.random() < 0.5:
+                        inicio = self.agora + datetime.timedelta(days=dia, hours=hora)
+                        futuras.append(Reserva(
+                            recurso=recurso, usuario=self.usuario, motivo='Aula', status='C',
+                            data_hora_inicio=inicio, data_hora_fim=inicio + datetime.timedelta(hours=2),
+                        ))
+        Reserva.objects.bulk_create(futuras, batch_size=10_000)
+
+        def janela():
+            inicio = self.agora + datetime.timedelta(days=random.randint(0, 29), hours=random.randint(7, 20))
+            return inicio, inicio + datetime.timedelta(hours=random.randint(1, 3)), random.choice([0, 20, 50])
+
+        def pelo_banco():
+            inicio, fim, capacidade = janela()
+            ocupadas = Reserva.objects.ativas().intersectando(inicio, fim).values_list('recurso_id', flat=True)
+            list(Recurso.objects.filter(ativo=True, capacidade_maxima__gte=capacidade).exclude(id__in=ocupadas))
+
+        def pelo_indice():
+            inicio, fim, capacidade = janela()
+            agenda.obter_indice().recursos_livres(inicio, fim, capacidade)
+
+        def sugestoes():
+            inicio, _, capacidade = janela()
+            agenda.sugerir_horarios(inicio, inicio + datetime.timedelta(days=7), datetime.timedelta(hours=3), capacidade)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Busca de salas livres ({recursos} salas, {len(futuras):,} reservas futuras)'
+        ))
+        self.stdout.write(
+            f"{'Reservas':>12} | {'Banco média':>11} | {'Banco p95':>9} | "
+            f"{'Índice média':>12} | {'Índice p95':>10} | {'Sugestões média':>15} | {'Carga (ms)':>10}"
+        )
+        for total in sorted(tamanhos):
+            self.popular_historico(total)
+            # bulk_create não dispara sinais: descarta o índice montado na rodada anterior
+            agenda.invalidar()
+            inicio = time.perf_counter()
+            agenda.obter_indice()
+            carga = (time.perf_counter() - inicio) * 1000
+
+            banco = self.medir(pelo_banco, amostras)
+            indice = self.medir(pelo_indice, amostras)
+            sugestao = self.medir(sugestoes, amostras)
+            self.stdout.write(
+                f'{total:>12,} | {banco[0]:>11.3f} | {banco[1]:>9.3f} | '
+                f'{indice[0]:>12.3f} | {indice[1]:>10.3f} | {sugestao[0]:>15.3f} | {carga:>10.1f}'
+            )
+
+    def benchmark_fanout(self, tamanhos, amostras, processos, **kwargs):
+        """
+        Latência de fan-out das notificações: do group_send em 'admin_reservas' (o que a API faz
+        a cada reserva) até a mensagem chegar à ÚLTIMA das N conexões de NotificacaoConsumer,
+        divididas entre --processos processos, cada um com o seu event loop (como workers Daphne).
+
+        Com o InMemoryChannelLayer (sem REDIS_URL) só há um processo possível: as conexões ficam
+        no mesmo processo que envia. Com o Redis, cada processo é um fork que se conecta a ele.
+        """
+        em_memoria = isinstance(get_channel_layer(), InMemoryChannelLayer)
+        processos = processos or (1 if em_memoria else 4)
+        if em_memoria and processos > 1:
+            raise CommandError(
+                'O InMemoryChannelLayer não atravessa processos: defina REDIS_URL ou use --processos 1.'
+            )
+        if em_memoria and tamanhos == self.TAMANHOS_PADRAO['fanout']:
+            tamanhos = self.TAMANHOS_FANOUT_EM_MEMORIA
+        rodadas = min(amostras, 10)
+        camada = type(get_channel_layer()).__name__
+        self.stdout.write(self.style.SUCCESS(f'Fan-out de notificações ({camada}, {processos} processo(s))'))
+        self.stdout.write(f"{'Conexões':>12} | {'Média (ms)':>11} | {'p95 (ms)':>9} | {'Conexão (s)':>11}")
+        for total in sorted(tamanhos):
+            inicio = time.perf_counter()
+            if em_memoria:
+                latencias = async_to_sync(_fanout_no_processo)(total, rodadas)
+            else:
+                latencias = self.fanout_entre_processos(total, rodadas, processos)
+            latencias.sort()
+            self.stdout.write(
+                f'{total:>12,} | {statistics.mean(latencias):>11.3f} | '
+                f'{latencias[int(len(latencias) * 0.95) - 1]:>9.3f} | {time.perf_counter() - inicio:>11.1f}'
+            )
+
+    def benchmark_autenticacao(self, tamanhos, amostras, **kwargs):
+        """
+        Custo da autenticação por Token em cada requisição da API: TokenAuthentication do DRF
+        (SELECT Token + User toda vez) contra TokenAuthenticationEmCache (reservas/autenticacao.py).
+        Antes da medida, todos os N tokens ativos fazem uma requisição; depois, as requisições sorteiam
+        tokens entre eles. Com N acima de TOKENS_CACHE_TAMANHO, parte delas não acha o token no cache
+        (LRU) e vai ao banco, o que aparece em 'Consultas/req'.
+        Req/s é o teto de uma thread gastando só com a autenticação (1000 / média).
+        """
+        fabrica = APIRequestFactory()
+        usuarios, chaves = [], []
+        self.stdout.write(self.style.SUCCESS(f'Autenticação por Token na API ({amostras * 10:,} requisições por medida)'))
+        self.stdout.write(
+            f"{'Tokens':>12} | {'Autenticação':<14} | {'Média (ms)':>11} | {'p95 (ms)':>9} | "
+            f"{'Consultas/req':>13} | {'Req/s':>9}"
+        )
+        for total in sorted(tamanhos):
+            novos = User.objects.bulk_create(
+                User(username=f'token{i}') for i in range(len(usuarios), total)
+            )
+            usuarios += novos
+            tokens = Token.objects.bulk_create(
+                (Token(key=Token.generate_key(), user=usuario) for usuario in novos), batch_size=5_000
+            )
+            # bulk_create não dispara o sinal que cria a validade de cada token
+            ValidadeToken.objects.bulk_create(
+                (ValidadeToken(token=token, expira_em=timezone.now() + ValidadeToken.duracao()) for token in tokens),
+                batch_size=5_000,
+            )
+            chaves += [token.key for token in tokens]
+
+            def pedido(chave):
+                return Request(fabrica.get('/reservas/api/recursos/', HTTP_AUTHORIZATION=f'Token {chave}'))
+
+            pedidos = [pedido(random.choice(chaves)) for _ in range(amostras * 10)]
+            for nome, autenticador in (('DRF', TokenAuthentication()), ('Em cache', TokenAuthenticationEmCache())):
+                cache_tokens.limpar()
+                if isinstance(autenticador, TokenAuthenticationEmCache):
+                    # Aquecimento: cada usuário ativo já fez alguma requisição a este processo
+                    for chave in random.sample(chaves, len(chaves)):
+                        autenticador.authenticate(pedido(chave))
+
+                consultas = 0
+
+                def contar(executar, sql, parametros, varios, contexto):
+                    nonlocal consultas
+                    consultas += 1
+                    return executar(sql, parametros, varios, contexto)
+
+                fila = iter(pedidos)
+                with connection.execute_wrapper(contar):
+                    media, p95 = self.medir(lambda: autenticador.authenticate(next(fila)), len(pedidos))
+                self.stdout.write(
+                    f'{total:>12,} | {nome:<14} | {media:>11.4f} | {p95:>9.4f} | '
+                    f'{consultas / len(pedidos):>13.3f} | {1000 / media:>9,.0f}'
+                )
+
+    def fanout_entre_processos(self, total, rodadas, processos):
+        contexto = multiprocessing.get_context('fork')
+        prontos, resultados = contexto.Queue(), contexto.Queue()
+        filhos = [
+            contexto.Process(target=_processo_fanout, args=(total // processos, rodadas, prontos, resultados))
+            for _ in range(processos)
+        ]
+        for filho in filhos:
+            filho.start()
+        try:
+            for _ in filhos:
+                prontos.get(timeout=300)
+            latencias = []
+            for rodada in range(rodadas):
+                async_to_sync(get_channel_layer().group_send)('admin_reservas', _mensagem_fanout(rodada))
+                # Latência da rodada: a chegada mais tardia entre todos os processos
+                latencias.append(max(resultados.get(timeout=60) for _ in filhos))
+            return latencias
+        finally:
+            for filho in filhos:
+                filho.join(timeout=30)
+
+
+# Fan-out: funções de módulo (e não métodos) para poderem rodar nos processos filhos
+
+def _mensagem_fanout(rodada):
+    return {'type': 'enviar_notificacao', 'message': f'fanout {rodada} {time.time()!r}'}
+
+
+async def _conectar(quantidade):
+    comunicadores = []
+    for _ in range(quantidade):
+        comunicador = WebsocketCommunicator(NotificacaoConsumer.as_asgi(), '/ws/notificacoes/')
+        conectado, _ = await comunicador.connect()
+        if not conectado:
+            raise CommandError('Falha ao abrir a conexão WebSocket.')
+        comunicadores.append(comunicador)
+    return comunicadores
+
+
+async def _ultima_chegada(comunicadores):
+    """Espera a mensagem em todas as conexões; devolve a latência (ms) da última a recebê-la."""
+    async def receber(comunicador):
+        mensagem = await comunicador.receive_json_from(timeout=60)
+        return time.time(), float(mensagem['message'].split()[2])
+
+    chegadas = await asyncio.gather(*(receber(c) for c in comunicadores))
+    return max(chegada - enviada for chegada, enviada in chegadas) * 1000
+
+
+async def _fanout_no_processo(total, rodadas):
+    comunicadores = await _conectar(total)
+    latencias = []
+    for rodada in range(rodadas):
+        await get_channel_layer().group_send('admin_reservas', _mensagem_fanout(rodada))
+        latencias.append(await _ultima_chegada(comunicadores))
+    for comunicador in comunicadores:
+        await comunicador.disconnect()
+    return latencias
+
+
+def _processo_fanout(quantidade, rodadas, prontos, resultados):
+    # O fork herda as conexões do processo pai, presas ao event loop dele: cada filho abre as suas
+    channel_layers.backends.clear()
+
+    async def escutar():
+        comunicadores = await _conectar(quantidade)
+        prontos.put(True)
+        for _ in range(rodadas):
+            resultados.put(await _ultima_chegada(comunicadores))
+        for comunicador in comunicadores:
+            await comunicador.disconnect()
+
+    asyncio.run(escutar())
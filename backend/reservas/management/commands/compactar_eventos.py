@@ -0,0 +1,28 @@
+import datetime
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from reservas.models import EventoAgenda
+
+
+class Command(BaseCommand):
+    help = 'Compacta o log de eventos da agenda (retomada do WebSocket) e apaga o que passou da retenção'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--continuo', action='store_true',
+            help='Não termina: repete a cada --intervalo segundos (processo de worker/supervisor).'
+        )
+        parser.add_argument('--intervalo', type=int, default=300, help='Segundos entre execuções (com --continuo).')
+
+    def handle(self, *args, **options):
+        retencao = datetime.timedelta(hours=getattr(settings, 'EVENTOS_RETENCAO_HORAS', 24))
+        while True:
+            compactadas = EventoAgenda.compactar()
+            expiradas = EventoAgenda.expirar(retencao)
+            if compactadas or expiradas or not options['continuo']:
+                self.stdout.write(f'Eventos compactados: {compactadas}, expirados: {expiradas}.')
+            if not options['continuo']:
+                break
+            time.sleep(options['intervalo'])
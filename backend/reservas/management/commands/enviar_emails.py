@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+from reservas import emails
+
+
+class Command(BaseCommand):
+    help = 'Envia os e-mails vencidos da fila de saída (inclusive novas tentativas após falhas)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--continuo', action='store_true',
+            help='Não termina: verifica a fila a cada --intervalo segundos (processo de worker/supervisor).'
+        )
+        parser.add_argument('--intervalo', type=int, default=30, help='Segundos entre verificações (com --continuo).')
+
+    def handle(self, *args, **options):
+        while True:
+            enviadas, falhas = emails.enviar_pendentes()
+            if enviadas or falhas or not options['continuo']:
+                self.stdout.write(f'E-mails enviados: {enviadas}, falhas: {falhas}.')
+            if not options['continuo']:
+                break
+            time.sleep(options['intervalo'])
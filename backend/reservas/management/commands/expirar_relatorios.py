@@ -0,0 +1,27 @@
+import datetime
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from reservas.models import RelatorioJob
+
+
+class Command(BaseCommand):
+    help = 'Apaga os relatórios em segundo plano (pedidos e arquivos) que passaram da retenção'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--continuo', action='store_true',
+            help='Não termina: repete a cada --intervalo segundos (processo de worker/supervisor).'
+        )
+        parser.add_argument('--intervalo', type=int, default=3600, help='Segundos entre execuções (com --continuo).')
+
+    def handle(self, *args, **options):
+        retencao = datetime.timedelta(hours=getattr(settings, 'RELATORIOS_RETENCAO_HORAS', 24))
+        while True:
+            pedidos, arquivos = RelatorioJob.expirar(retencao)
+            if pedidos or arquivos or not options['continuo']:
+                self.stdout.write(f'Relatórios expirados: {pedidos} pedido(s), {arquivos} arquivo(s).')
+            if not options['continuo']:
+                break
+            time.sleep(options['intervalo'])
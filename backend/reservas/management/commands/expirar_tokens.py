@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+from reservas.models import ValidadeToken
+
+
+class Command(BaseCommand):
+    help = 'Apaga, em lotes, os Tokens de login expirados (veja ValidadeToken)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lote', type=int, default=1000, help='Tokens apagados por transação.')
+        parser.add_argument(
+            '--continuo', action='store_true',
+            help='Não termina: repete a cada --intervalo segundos (processo de worker/supervisor).'
+        )
+        parser.add_argument('--intervalo', type=int, default=3600, help='Segundos entre execuções (com --continuo).')
+
+    def handle(self, *args, **options):
+        while True:
+            apagados = ValidadeToken.purgar(lote=options['lote'])
+            if apagados or not options['continuo']:
+                self.stdout.write(f'Tokens expirados apagados: {apagados}.')
+            if not options['continuo']:
+                break
+            time.sleep(options['intervalo'])
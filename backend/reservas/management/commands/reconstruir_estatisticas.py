@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from reservas.models import EstatisticaReserva
+
+
+class Command(BaseCommand):
+    help = 'Recalcula do zero as estatísticas do Dashboard (contadores por recurso, status e dia)'
+
+    def handle(self, *args, **kwargs):
+        contadores = EstatisticaReserva.reconstruir()
+        self.stdout.write(self.style.SUCCESS(f'Estatísticas reconstruídas: {contadores} contadores gravados.'))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand, CommandError
+from reservas.models import ValidadeToken
+
+
+class Command(BaseCommand):
+    help = 'Revoga (apaga) os Tokens de login de usuários e/ou de todos os membros de grupos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--usuarios', nargs='+', default=[], help='Nomes de usuário.')
+        parser.add_argument('--grupos', nargs='+', default=[], help='Nomes de grupos (todos os membros).')
+        parser.add_argument('--lote', type=int, default=1000, help='Tokens apagados por transação.')
+
+    def handle(self, *args, **options):
+        if not options['usuarios'] and not options['grupos']:
+            raise CommandError('Informe --usuarios e/ou --grupos.')
+        revogados = ValidadeToken.revogar(options['usuarios'], options['grupos'], lote=options['lote'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Tokens revogados: {revogados}. Com o cache compartilhado (Redis), os demais processos já '
+            f'deixaram de aceitá-los; com o cache em memória, em até TOKENS_CACHE_TTL segundos.'
+        ))
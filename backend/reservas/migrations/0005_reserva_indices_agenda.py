@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:25
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservas', '0004_recurso_foto'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(fields=['recurso', 'status', 'data_hora_fim', 'data_hora_inicio'], name='reserva_recurso_agenda_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(fields=['status', 'data_hora_fim', 'data_hora_inicio'], name='reserva_agenda_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reserva',
+            index=models.Index(fields=['usuario', 'data_hora_inicio'], name='reserva_usuario_inicio_idx'),
+        ),
+    ]
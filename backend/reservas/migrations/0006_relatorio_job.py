@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:56
+
+import django.db.models.deletion
+import uuid
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservas', '0005_reserva_indices_agenda'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContadorVersao',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nome', models.CharField(max_length=50, unique=True)),
+                ('valor', models.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Contador de Versão',
+                'verbose_name_plural': 'Contadores de Versão',
+            },
+        ),
+        migrations.CreateModel(
+            name='RelatorioJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('formato', models.CharField(choices=[('pdf', 'PDF'), ('xlsx', 'Excel')], max_length=4)),
+                ('filtros', models.JSONField(blank=True, default=dict)),
+                ('chave', models.CharField(db_index=True, max_length=64)),
+                ('status', models.CharField(choices=[('P', 'Na fila'), ('E', 'Em execução'), ('C', 'Concluído'), ('F', 'Falhou')], default='P', max_length=1)),
+                ('arquivo', models.FileField(blank=True, upload_to='relatorios/')),
+                ('erro', models.TextField(blank=True)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+                ('concluido_em', models.DateTimeField(blank=True, null=True)),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='relatorios', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Relatório',
+                'verbose_name_plural': 'Relatórios',
+                'ordering': ['-criado_em'],
+            },
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:12
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+def preencher_estatisticas(apps, schema_editor):
+    """Calcula os contadores das reservas que já existem (o mesmo que 'manage.py reconstruir_estatisticas')."""
+    from reservas.models import EstatisticaReserva as EstatisticaAtual
+
+    Reserva = apps.get_model('reservas', 'Reserva')
+    EstatisticaReserva = apps.get_model('reservas', 'EstatisticaReserva')
+
+    totais = defaultdict(lambda: [0, 0])
+    estados = Reserva.objects.values_list('recurso_id', 'status', 'data_hora_inicio', 'data_hora_fim').order_by()
+    for estado in estados.iterator(chunk_size=2000):
+        for chave, (quantidade, minutos) in EstatisticaAtual.contribuicao(*estado).items():
+            totais[chave][0] += quantidade
+            totais[chave][1] += minutos
+
+    EstatisticaReserva.objects.bulk_create(
+        (EstatisticaReserva(tipo=tipo, chave=chave, quantidade=quantidade, minutos=minutos)
+         for (tipo, chave), (quantidade, minutos) in totais.items()),
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservas', '0006_relatorio_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstatisticaReserva',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('total', 'Total'), ('recurso', 'Por recurso'), ('status', 'Por status'), ('dia', 'Por dia')], max_length=10)),
+                ('chave', models.CharField(blank=True, max_length=20)),
+                ('quantidade', models.BigIntegerField(default=0)),
+                ('minutos', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Estatística de Reservas',
+                'verbose_name_plural': 'Estatísticas de Reservas',
+                'indexes': [models.Index(fields=['tipo', 'quantidade'], name='estatistica_ranking_idx')],
+                'constraints': [models.UniqueConstraint(fields=('tipo', 'chave'), name='estatistica_tipo_chave_unica')],
+            },
+        ),
+        migrations.RunPython(preencher_estatisticas, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:37
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservas', '0007_estatisticas_reserva'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailPendente',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('assunto', models.CharField(max_length=255)),
+                ('mensagem', models.TextField()),
+                ('remetente', models.CharField(blank=True, max_length=254)),
+                ('destinatarios', models.JSONField(default=list)),
+                ('status', models.CharField(choices=[('P', 'Pendente'), ('E', 'Enviado'), ('F', 'Falhou')], default='P', max_length=1)),
+                ('tentativas', models.PositiveSmallIntegerField(default=0)),
+                ('proxima_tentativa', models.DateTimeField(default=django.utils.timezone.now)),
+                ('envio', models.UUIDField(blank=True, null=True)),
+                ('ultimo_erro', models.TextField(blank=True)),
+                ('criado_em', models.DateTimeField(auto_now_add=True)),
+                ('enviado_em', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'E-mail (fila de envio)',
+                'verbose_name_plural': 'E-mails (fila de envio)',
+                'ordering': ['-criado_em'],
+                'indexes': [models.Index(fields=['status', 'proxima_tentativa'], name='email_fila_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservas', '0008_fila_emails'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventoAgenda',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('evento', models.CharField(max_length=32)),
+                ('grupo', models.CharField(max_length=64)),
+                ('reserva_id', models.PositiveIntegerField()),
+                ('acao', models.CharField(max_length=10)),
+                ('dados', models.JSONField()),
+                ('criado_em', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Evento da Agenda',
+                'verbose_name_plural': 'Eventos da Agenda',
+                'indexes': [models.Index(fields=['grupo', 'id'], name='evento_agenda_seq_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:32
+
+import datetime
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def validar_tokens_existentes(apps, schema_editor):
+    """Tokens emitidos antes da expiração ganham a validade inteira a partir de agora."""
+    Token = apps.get_model('authtoken', 'Token')
+    ValidadeToken = apps.get_model('reservas', 'ValidadeToken')
+    expira_em = timezone.now() + datetime.timedelta(hours=getattr(settings, 'TOKENS_VALIDADE_HORAS', 24 * 7))
+    ValidadeToken.objects.bulk_create(
+        (ValidadeToken(token_id=chave, expira_em=expira_em) for chave in Token.objects.values_list('key', flat=True)),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authtoken', '0004_alter_tokenproxy_options'),
+        ('reservas', '0009_log_eventos_agenda'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ValidadeToken',
+            fields=[
+                ('token', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='validade', serialize=False, to='authtoken.token')),
+                ('expira_em', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Validade de Token',
+                'verbose_name_plural': 'Validades de Tokens',
+            },
+        ),
+        migrations.RunPython(validar_tokens_existentes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:56
+
+import datetime
+from collections import defaultdict
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def preencher_ocupacao(apps, schema_editor):
+    """Ocupação por hora das reservas que já existem (o mesmo que 'manage.py reconstruir_estatisticas')."""
+    from reservas.models import OcupacaoDia as OcupacaoAtual
+
+    Reserva = apps.get_model('reservas', 'Reserva')
+    OcupacaoDia = apps.get_model('reservas', 'OcupacaoDia')
+
+    totais = defaultdict(lambda: defaultdict(int))
+    estados = Reserva.objects.values_list('recurso_id', 'status', 'data_hora_inicio', 'data_hora_fim').order_by()
+    for estado in estados.iterator(chunk_size=2000):
+        for (recurso_id, dia, hora), segundos in OcupacaoAtual.contribuicao(*estado).items():
+            totais[(recurso_id, dia)][OcupacaoAtual.coluna(hora)] += segundos
+
+    OcupacaoDia.objects.bulk_create(
+        (OcupacaoDia(recurso_id=recurso_id, dia=dia, dia_semana=dia.weekday(),
+                     semana=dia - datetime.timedelta(days=dia.weekday()), **colunas)
+         for (recurso_id, dia), colunas in totais.items()),
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reservas', '0010_validade_tokens'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OcupacaoDia',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dia', models.DateField()),
+                ('dia_semana', models.PositiveSmallIntegerField()),
+                ('semana', models.DateField()),
+                ('h00', models.IntegerField(default=0)),
+                ('h01', models.IntegerField(default=0)),
+                ('h02', models.IntegerField(default=0)),
+                ('h03', models.IntegerField(default=0)),
+                ('h04', models.IntegerField(default=0)),
+                ('h05', models.IntegerField(default=0)),
+                ('h06', models.IntegerField(default=0)),
+                ('h07', models.IntegerField(default=0)),
+                ('h08', models.IntegerField(default=0)),
+                ('h09', models.IntegerField(default=0)),
+                ('h10', models.IntegerField(default=0)),
+                ('h11', models.IntegerField(default=0)),
+                ('h12', models.IntegerField(default=0)),
+                ('h13', models.IntegerField(default=0)),
+                ('h14', models.IntegerField(default=0)),
+                ('h15', models.IntegerField(default=0)),
+                ('h16', models.IntegerField(default=0)),
+                ('h17', models.IntegerField(default=0)),
+                ('h18', models.IntegerField(default=0)),
+                ('h19', models.IntegerField(default=0)),
+                ('h20', models.IntegerField(default=0)),
+                ('h21', models.IntegerField(default=0)),
+                ('h22', models.IntegerField(default=0)),
+                ('h23', models.IntegerField(default=0)),
+                ('recurso', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='reservas.recurso')),
+            ],
+            options={
+                'verbose_name': 'Ocupação por Dia',
+                'verbose_name_plural': 'Ocupações por Dia',
+                'indexes': [models.Index(fields=['dia'], name='ocupacao_dia_idx')],
+                'constraints': [models.UniqueConstraint(fields=('recurso', 'dia'), name='ocupacao_recurso_dia_unica')],
+            },
+        ),
+        migrations.RunPython(preencher_ocupacao, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,12 @@
-from django.db import models
+import bisect
+import datetime
+import itertools
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_save
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.utils import timezone
@@ -7,7 +15,7 @@ import uuid
 from django.dispatch import receiver
 from django.urls import reverse
 from django_rest_passwordreset.signals import reset_password_token_created
-from django.core.mail import send_mail
+from rest_framework.authtoken.models import Token
 
 class Recurso(models.Model):
     """
@@ -27,6 +35,22 @@ class Recurso(models.Model):
         return self.nome
 
 
+# Status que ocupam a agenda do recurso: Confirmada, Pendente e Manutenção.
+# Reservas canceladas ('X') ou rejeitadas ('R') não bloqueiam a agenda.
+STATUS_ATIVOS = ['C', 'P', 'M']
+
+
+class ReservaQuerySet(models.QuerySet):
+    """Consultas reutilizáveis sobre a agenda (mantém a regra de Overlap em um só lugar)."""
+
+    def ativas(self):
+        return self.filter(status__in=STATUS_ATIVOS)
+
+    def intersectando(self, inicio, fim):
+        # Existe interseção se: (InicioExistente < FimNovo) E (FimExistente > InicioNovo)
+        return self.filter(data_hora_inicio__lt=fim, data_hora_fim__gt=inicio)
+
+
 class Reserva(models.Model):
     """
     Entidade central do sistema.
@@ -50,16 +74,49 @@ class Reserva(models.Model):
     ]
     status = models.CharField(max_length=1, choices=STATUS_CHOICES, default='P')
 
+    objects = ReservaQuerySet.as_manager()
+
     class Meta:
         ordering = ['data_hora_inicio']
         verbose_name_plural = "Reservas"
+        indexes = [
+            # Verificação de conflito (clean): recurso = X, status IN ativos, fim > início desejado.
+            # O banco faz uma busca por status ativo e percorre apenas as reservas que terminam
+            # depois do horário pedido, ignorando todo o histórico passado.
+            models.Index(
+                fields=['recurso', 'status', 'data_hora_fim', 'data_hora_inicio'],
+                name='reserva_recurso_agenda_idx',
+            ),
+            # Busca de disponibilidade e feed do calendário: mesma ideia, para TODOS os recursos.
+            models.Index(fields=['status', 'data_hora_fim', 'data_hora_inicio'], name='reserva_agenda_idx'),
+            # "Meus Agendamentos" e relatórios por usuário, já na ordem de exibição.
+            models.Index(fields=['usuario', 'data_hora_inicio'], name='reserva_usuario_inicio_idx'),
+        ]
 
     def clean(self):
         """
         Lógica de Validação Customizada (Regras de Negócio).
         Este método é chamado automaticamente antes de salvar (.save()) via ModelForm ou Serializer.
         """
-        
+        self.validar_horario()
+
+        # Se encontrou conflito, levanta erro e impede o salvamento.
+        conflito = self.buscar_conflito()
+        if conflito:
+            raise ValidationError(self.mensagem_conflito(conflito))
+
+    @staticmethod
+    def mensagem_conflito(conflito):
+        """Mensagem exibida ao usuário quando o horário pedido colide com a reserva 'conflito'."""
+        if conflito.status == 'M':
+            return f"Este recurso está bloqueado para manutenção das {conflito.data_hora_inicio.strftime('%H:%M')} às {conflito.data_hora_fim.strftime('%H:%M')}."
+        return f"Conflito! Reservado por {conflito.usuario.username} das {conflito.data_hora_inicio.strftime('%H:%M')} às {conflito.data_hora_fim.strftime('%H:%M')}."
+
+    def validar_horario(self):
+        """
+        Regras que dependem apenas dos próprios dados (não consultam o banco).
+        Usadas pelo Serializer como pré-validação barata antes do save().
+        """
         # 1. Regra de Coerência Temporal: O fim não pode ser antes do início.
         if self.data_hora_inicio >= self.data_hora_fim:
             raise ValidationError("A data/hora de início deve ser anterior à data/hora de fim.")
@@ -70,13 +127,14 @@ class Reserva(models.Model):
             if not self.pk: 
                 raise ValidationError("Não é possível criar uma reserva para um horário no passado.")
 
-        # 3. Regra de Conflito de Horário (Overlap)
-        # Verifica se já existe alguma reserva ATIVA ('C', 'P' ou 'M') para o mesmo recurso.
-        # Reservas canceladas ('X') ou rejeitadas ('R') não bloqueiam a agenda.
-        conflitos = Reserva.objects.filter(
-            recurso=self.recurso,
-            status__in=['C', 'P', 'M']
-        )
+    def buscar_conflito(self):
+        """
+        3. Regra de Conflito de Horário (Overlap)
+        Retorna a primeira reserva ATIVA ('C', 'P' ou 'M') do mesmo recurso que colide com este horário,
+        ou None. Uma única consulta: o usuário dono do conflito já vem junto (select_related),
+        pois é usado na mensagem de erro.
+        """
+        conflitos = Reserva.objects.filter(recurso_id=self.recurso_id).ativas()
         
         # Se for uma edição, exclui a própria reserva da busca para não conflitar consigo mesma.
         if self.pk:
@@ -84,25 +142,253 @@ class Reserva(models.Model):
 
         # A lógica matemática do conflito:
         # Existe interseção se: (InicioNovo < FimExistente) E (FimNovo > InicioExistente)
-        conflitos = conflitos.filter(
-            data_hora_inicio__lt=self.data_hora_fim, 
-            data_hora_fim__gt=self.data_hora_inicio  
-        )
-        
-        # Se encontrou conflito, levanta erro e impede o salvamento.
-        if conflitos.exists():
-            conflito = conflitos.first()
-            if conflito.status == 'M':
-                msg = f"Este recurso está bloqueado para manutenção das {conflito.data_hora_inicio.strftime('%H:%M')} às {conflito.data_hora_fim.strftime('%H:%M')}."
-            else:
-                msg = f"Conflito! Reservado por {conflito.usuario.username} das {conflito.data_hora_inicio.strftime('%H:%M')} às {conflito.data_hora_fim.strftime('%H:%M')}."
-            
-            raise ValidationError(msg)
+        conflitos = conflitos.intersectando(self.data_hora_inicio, self.data_hora_fim)
+        return conflitos.select_related('usuario').first()
 
     def save(self, *args, **kwargs):
-        # Garante que as validações do clean() sejam executadas mesmo ao salvar via código/shell
-        self.full_clean()
-        super().save(*args, **kwargs)
+        # Garante que as validações do clean() sejam executadas mesmo ao salvar via código/shell.
+        # Verificação e gravação acontecem na MESMA transação, com a linha do Recurso travada
+        # (SELECT ... FOR UPDATE): duas requisições simultâneas para a mesma sala são enfileiradas,
+        # e a segunda só procura conflitos depois que a primeira já gravou. Sem reserva dupla.
+        # No SQLite (sem lock de linha), o mesmo efeito vem do 'transaction_mode' IMMEDIATE (settings.py).
+        with transaction.atomic():
+            if self.recurso_id:
+                list(Recurso.objects.select_for_update().filter(pk=self.recurso_id).values_list('pk', flat=True))
+
+            # Recurso/Usuário já carregados do banco (ex: pelo Serializer ou request.user) não precisam
+            # da consulta extra de existência que o full_clean() faz para cada ForeignKey.
+            ja_carregados = [
+                campo.name for campo in (self._meta.get_field('recurso'), self._meta.get_field('usuario'))
+                if campo.is_cached(self)
+            ]
+            self.full_clean(exclude=ja_carregados)
+            super().save(*args, **kwargs)
+
+    @classmethod
+    def criar_em_lote(cls, reservas, ignorar_conflitos=False):
+        """
+        Grava várias reservas (ex: toda terça do semestre) em UMA transação, com o mesmo
+        lock por Recurso do save(), mas sem o custo de um save() por ocorrência:
+        - UMA consulta traz as reservas ativas de todo o período do lote (em vez de uma por ocorrência);
+        - conflitos são achados por uma varredura das duas listas ordenadas pelo início;
+        - as aceitas entram com um único bulk_create.
+
+        Retorna (criadas, conflitos), sendo conflitos uma lista de (reserva, mensagem) na ordem do lote.
+        Se houver conflito e 'ignorar_conflitos' for falso, nada é gravado.
+
+        bulk_create não dispara sinais: versão da agenda, estatísticas, índice da busca e eventos
+        são atualizados aqui, como fariam os receptores de post_save.
+        """
+        reservas = sorted(reservas, key=lambda r: (r.recurso_id, r.data_hora_inicio))
+        if not reservas:
+            return [], []
+
+        with transaction.atomic():
+            recurso_ids = sorted({r.recurso_id for r in reservas})
+            list(Recurso.objects.select_for_update().filter(pk__in=recurso_ids).values_list('pk', flat=True))
+
+            existentes = defaultdict(list)
+            consulta = (
+                cls.objects.filter(recurso_id__in=recurso_ids).ativas()
+                .intersectando(min(r.data_hora_inicio for r in reservas), max(r.data_hora_fim for r in reservas))
+                .select_related('usuario').order_by('recurso_id', 'data_hora_inicio')
+            )
+            for existente in consulta:
+                existentes[existente.recurso_id].append(existente)
+
+            aceitas, conflitos = [], []
+            for recurso_id, ocorrencias in itertools.groupby(reservas, key=lambda r: r.recurso_id):
+                for reserva, erro in cls._varrer_conflitos(list(ocorrencias), existentes[recurso_id]):
+                    if erro:
+                        conflitos.append((reserva, erro))
+                    else:
+                        aceitas.append(reserva)
+
+            if conflitos and not ignorar_conflitos:
+                return [], conflitos
+
+            criadas = cls.objects.bulk_create(aceitas)
+            for reserva in criadas:
+                reserva._estado_salvo = reserva.estado_estatisticas()
+
+            if criadas:
+                ContadorVersao.incrementar('agenda')
+                EstatisticaReserva.registrar(adicionadas=[reserva._estado_salvo for reserva in criadas])
+                from . import agenda, cache, eventos  # importam os models
+                agenda.invalidar()
+                alteracoes = [(reserva, None, False) for reserva in criadas]
+                cache.invalidar_apos_commit(*cache.etiquetas_reservas(alteracoes))
+                eventos.publicar_reservas(alteracoes)
+        return criadas, conflitos
+
+    @classmethod
+    def _varrer_conflitos(cls, ocorrencias, existentes):
+        """
+        Sweep-line sobre as ocorrências de um recurso e as reservas já existentes dele, ambas
+        ordenadas pelo início. Produz (ocorrencia, mensagem de erro ou None), na mesma ordem.
+        """
+        proxima = 0
+        vigentes = []       # existentes que já começaram e podem alcançar a ocorrência atual
+        fim_aceitas = None  # maior fim entre as ocorrências já aceitas do próprio lote
+        for reserva in ocorrencias:
+            try:
+                reserva.validar_horario()
+            except ValidationError as e:
+                yield reserva, ' '.join(e.messages)
+                continue
+
+            while proxima < len(existentes) and existentes[proxima].data_hora_inicio < reserva.data_hora_fim:
+                vigentes.append(existentes[proxima])
+                proxima += 1
+            vigentes = [e for e in vigentes if e.data_hora_fim > reserva.data_hora_inicio]
+
+            if vigentes:
+                yield reserva, cls.mensagem_conflito(vigentes[0])
+            elif fim_aceitas and fim_aceitas > reserva.data_hora_inicio:
+                yield reserva, "Conflito com outra ocorrência do mesmo pedido."
+            else:
+                fim_aceitas = max(fim_aceitas or reserva.data_hora_fim, reserva.data_hora_fim)
+                yield reserva, None
+
+    @classmethod
+    def decidir_em_lote(cls, reservas, aprovar):
+        """
+        Aprova ('C') ou rejeita ('R') de uma vez as reservas PENDENTES de 'reservas' (um QuerySet),
+        em uma transação, com UPDATEs por conjunto em vez de um save() (e um full_clean()) por linha.
+
+        Na aprovação, a agenda é revalidada por conjunto: uma consulta traz as reservas ativas do
+        período e dos recursos envolvidos, e as pendentes são aprovadas por ordem de chegada (ID).
+        Perdem (e são rejeitadas automaticamente) as pendentes que colidem com uma reserva
+        confirmada/em manutenção ou com outra aprovada neste mesmo lote, selecionada ou não.
+
+        Retorna {'aprovadas': [...], 'rejeitadas': [...], 'perdedoras': [(reserva, vencedora)]}.
+        """
+        resultado = {'aprovadas': [], 'rejeitadas': [], 'perdedoras': []}
+        with transaction.atomic():
+            pendentes = list(
+                reservas.filter(status='P').select_for_update(of=('self',))
+                .select_related('recurso', 'usuario').order_by('pk')
+            )
+            if not pendentes:
+                return resultado
+            recurso_ids = sorted({r.recurso_id for r in pendentes})
+            list(Recurso.objects.select_for_update().filter(pk__in=recurso_ids).values_list('pk', flat=True))
+
+            if not aprovar:
+                resultado['rejeitadas'] = pendentes
+            else:
+                cls._revalidar_aprovacoes(pendentes, recurso_ids, resultado)
+
+            # Só muda quem ainda está pendente: em bancos com bloqueio por linha, uma reserva
+            # cancelada por outra conexão no meio do caminho não volta a ser confirmada
+            alteradas = set()
+            for novo_status, lista in (('C', resultado['aprovadas']), ('R', cls._rejeitadas(resultado))):
+                for inicio in range(0, len(lista), 500):
+                    lote = [r.pk for r in lista[inicio:inicio + 500]]
+                    if cls.objects.filter(pk__in=lote, status='P').update(status=novo_status) == len(lote):
+                        alteradas.update(lote)
+                    else:
+                        alteradas.update(
+                            cls.objects.filter(pk__in=lote, status=novo_status).values_list('pk', flat=True)
+                        )
+            resultado['aprovadas'] = [r for r in resultado['aprovadas'] if r.pk in alteradas]
+            resultado['rejeitadas'] = [r for r in resultado['rejeitadas'] if r.pk in alteradas]
+            resultado['perdedoras'] = [(r, v) for r, v in resultado['perdedoras'] if r.pk in alteradas]
+            rejeitadas = cls._rejeitadas(resultado)
+
+            # update() não dispara sinais: versão da agenda, estatísticas, índice da busca e eventos à mão
+            removidas, adicionadas, alteracoes = [], [], []
+            for novo_status, lista in (('C', resultado['aprovadas']), ('R', rejeitadas)):
+                for reserva in lista:
+                    removidas.append(reserva.estado_estatisticas())
+                    reserva.status = novo_status
+                    reserva._estado_salvo = reserva.estado_estatisticas()
+                    adicionadas.append(reserva._estado_salvo)
+                    alteracoes.append((reserva, removidas[-1], False))
+            ContadorVersao.incrementar('agenda')
+            EstatisticaReserva.registrar(removidas=removidas, adicionadas=adicionadas)
+            from . import agenda, cache, eventos  # importam os models
+            agenda.invalidar()
+            cache.invalidar_apos_commit(*cache.etiquetas_reservas(alteracoes))
+            eventos.publicar_reservas(alteracoes)
+        return resultado
+
+    @staticmethod
+    def _rejeitadas(resultado):
+        return resultado['rejeitadas'] + [perdedora for perdedora, _ in resultado['perdedoras']]
+
+    @classmethod
+    def _revalidar_aprovacoes(cls, pendentes, recurso_ids, resultado):
+        """
+        Decide quais pendentes podem ser aprovadas. 'ocupado' guarda, por recurso, os intervalos
+        que bloqueiam a agenda (confirmadas, manutenções e as aprovadas até aqui), ordenados pelo início
+        e sem sobreposição entre si, para que as colisões de um intervalo saiam de uma busca binária.
+
+        Confirmadas/manutenções que já se sobrepõem no banco (ex: manutenção lançada por cima de uma
+        aula) viram um único bloco, que vai do primeiro início ao maior fim e é atribuído à primeira
+        delas. As aprovadas deste lote nunca colidem com um bloco, então nunca são fundidas.
+        """
+        selecionadas = {r.pk for r in pendentes}
+        ocupado = defaultdict(lambda: ([], [], []))   # recurso_id -> (inícios, fins, reservas)
+        outras_pendentes = []
+        agenda = (
+            cls.objects.filter(recurso_id__in=recurso_ids).ativas()
+            .intersectando(min(r.data_hora_inicio for r in pendentes), max(r.data_hora_fim for r in pendentes))
+            .select_related('recurso', 'usuario').order_by('data_hora_inicio')
+        )
+        for reserva in agenda:
+            if reserva.status in ('C', 'M'):
+                inicios, fins, lista = ocupado[reserva.recurso_id]
+                if fins and reserva.data_hora_inicio < fins[-1]:
+                    fins[-1] = max(fins[-1], reserva.data_hora_fim)
+                    continue
+                inicios.append(reserva.data_hora_inicio)
+                fins.append(reserva.data_hora_fim)
+                lista.append(reserva)
+            elif reserva.pk not in selecionadas:
+                outras_pendentes.append(reserva)
+
+        def colisoes(reserva):
+            # Sem sobreposição, os fins também estão em ordem: volta a partir do antecessor
+            # enquanto os intervalos ainda alcançam o início da reserva
+            inicios, fins, lista = ocupado[reserva.recurso_id]
+            posicao = bisect.bisect_left(inicios, reserva.data_hora_fim) - 1
+            while posicao >= 0 and fins[posicao] > reserva.data_hora_inicio:
+                yield lista[posicao]
+                posicao -= 1
+
+        for reserva in pendentes:
+            vencedora = next(colisoes(reserva), None)
+            if vencedora:
+                resultado['perdedoras'].append((reserva, vencedora))
+                continue
+            resultado['aprovadas'].append(reserva)
+            inicios, fins, lista = ocupado[reserva.recurso_id]
+            posicao = bisect.bisect_left(inicios, reserva.data_hora_inicio)
+            inicios.insert(posicao, reserva.data_hora_inicio)
+            fins.insert(posicao, reserva.data_hora_fim)
+            lista.insert(posicao, reserva)
+
+        # Pendentes que não estavam no lote, mas colidem com uma das recém-aprovadas
+        aprovadas = {r.pk for r in resultado['aprovadas']}
+        for reserva in outras_pendentes:
+            vencedora = next((r for r in colisoes(reserva) if r.pk in aprovadas), None)
+            if vencedora:
+                resultado['perdedoras'].append((reserva, vencedora))
+
+    # Campos que alimentam as estatísticas (EstatisticaReserva)
+    CAMPOS_ESTATISTICA = ('recurso_id', 'status', 'data_hora_inicio', 'data_hora_fim')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        # Guarda como a reserva está no banco: ao salvar, as estatísticas recebem só a diferença
+        instancia = super().from_db(db, field_names, values)
+        if all(campo in field_names for campo in cls.CAMPOS_ESTATISTICA):
+            instancia._estado_salvo = instancia.estado_estatisticas()
+        return instancia
+
+    def estado_estatisticas(self):
+        return tuple(getattr(self, campo) for campo in self.CAMPOS_ESTATISTICA)
 
     def __str__(self):
         return f"Reserva de {self.recurso.nome} ({self.status})"
@@ -129,8 +415,641 @@ class CodigoConvite(models.Model):
         estado = "USADO" if self.usado else "VÁLIDO"
         return f"{self.codigo} ({estado})"
     
+class ContadorVersao(models.Model):
+    """
+    Contador de versão dos dados, incrementado a cada alteração confirmada (commit).
+    Permite saber se algo mudou sem reprocessar a tabela inteira:
+    ex: o índice da busca montado na versão 42 continua válido enquanto a versão for 42.
+    """
+    nome = models.CharField(max_length=50, unique=True)
+    valor = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Contador de Versão"
+        verbose_name_plural = "Contadores de Versão"
+
+    @classmethod
+    def atual(cls, nome):
+        return cls.objects.filter(nome=nome).values_list('valor', flat=True).first() or 0
+
+    @classmethod
+    def incrementar(cls, nome):
+        # UPDATE atômico (valor = valor + 1): seguro com várias requisições simultâneas
+        if not cls.objects.filter(nome=nome).update(valor=F('valor') + 1):
+            cls.objects.get_or_create(nome=nome)
+            cls.objects.filter(nome=nome).update(valor=F('valor') + 1)
+        # Respostas do cache compartilhado que dependem da etiqueta de mesmo nome também expiram
+        from . import cache
+        cache.invalidar(nome)
+
+    def __str__(self):
+        return f"{self.nome} (v{self.valor})"
+
+
+class EstatisticaReserva(models.Model):
+    """
+    Estatísticas das Reservas já agregadas, para o Dashboard não percorrer a tabela de reservas.
+    Cada linha é um contador, identificado por (tipo, chave):
+
+    - ('total', '')             -> todas as reservas
+    - ('recurso', '<id>')       -> reservas do recurso
+    - ('status', '<letra>')     -> reservas no status
+    - ('dia', 'AAAA-MM-DD')     -> reservas ativas que começam no dia; 'minutos' ocupados no dia
+
+    Os contadores são atualizados por diferença a cada escrita de Reserva (veja os sinais abaixo),
+    na mesma transação da escrita: ou a reserva e os contadores são gravados, ou nenhum dos dois.
+    Se algum dia divergirem (ex: alteração direta no banco), o comando
+    'manage.py reconstruir_estatisticas' recalcula tudo a partir das reservas.
+    """
+    TIPO_CHOICES = [
+        ('total', 'Total'),
+        ('recurso', 'Por recurso'),
+        ('status', 'Por status'),
+        ('dia', 'Por dia'),
+    ]
+
+    tipo = models.CharField(max_length=10, choices=TIPO_CHOICES)
+    chave = models.CharField(max_length=20, blank=True)
+    quantidade = models.BigIntegerField(default=0)
+    minutos = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Estatística de Reservas"
+        verbose_name_plural = "Estatísticas de Reservas"
+        constraints = [
+            models.UniqueConstraint(fields=['tipo', 'chave'], name='estatistica_tipo_chave_unica'),
+        ]
+        indexes = [
+            # Ranking do Dashboard (recursos mais reservados) lido direto do índice
+            models.Index(fields=['tipo', 'quantidade'], name='estatistica_ranking_idx'),
+        ]
+
+    @staticmethod
+    def contribuicao(recurso_id, status, inicio, fim):
+        """Quanto UMA reserva soma em cada contador: {(tipo, chave): (quantidade, minutos)}."""
+        contadores = {
+            ('total', ''): (1, 0),
+            ('recurso', str(recurso_id)): (1, 0),
+            ('status', status): (1, 0),
+        }
+        if status not in STATUS_ATIVOS:
+            return contadores
+
+        # Ocupação por dia (no fuso local): uma reserva que atravessa a meia-noite
+        # conta os minutos de cada dia no dia certo, mas só é contada no dia em que começa
+        dia = timezone.localtime(inicio).date()
+        quantidade = 1
+        while True:
+            inicio_dia = timezone.make_aware(datetime.datetime.combine(dia, datetime.time()))
+            fim_dia = timezone.make_aware(datetime.datetime.combine(dia + datetime.timedelta(days=1), datetime.time()))
+            minutos = int((min(fim, fim_dia) - max(inicio, inicio_dia)).total_seconds()) // 60
+            contadores[('dia', dia.isoformat())] = (quantidade, minutos)
+            if fim <= fim_dia:
+                return contadores
+            dia += datetime.timedelta(days=1)
+            quantidade = 0
+
+    @classmethod
+    def registrar(cls, removidas=(), adicionadas=()):
+        """
+        Aplica nos contadores a saída dos estados 'removidas' e a entrada dos 'adicionadas'
+        (tuplas de Reserva.estado_estatisticas()). Um único comando SQL (UPSERT), atômico por
+        linha: seguro com várias requisições simultâneas, sem ler os valores antes.
+        Chamado dentro da transação da reserva; junto com OcupacaoDia, tudo ou nada.
+        """
+        deltas = defaultdict(lambda: [0, 0])
+        for estados, sinal in ((removidas, -1), (adicionadas, 1)):
+            for estado in estados:
+                for chave, (quantidade, minutos) in cls.contribuicao(*estado).items():
+                    deltas[chave][0] += sinal * quantidade
+                    deltas[chave][1] += sinal * minutos
+
+        linhas = [(tipo, chave, quantidade, minutos) for (tipo, chave), (quantidade, minutos) in deltas.items()
+                  if quantidade or minutos]
+        tabela = connection.ops.quote_name(cls._meta.db_table)
+        valores = ', '.join(['(%s, %s, %s, %s)'] * len(linhas))
+        with transaction.atomic(), connection.cursor() as cursor:
+            OcupacaoDia.registrar(removidas, adicionadas)
+            if not linhas:
+                return
+            cursor.execute(
+                f"INSERT INTO {tabela} (tipo, chave, quantidade, minutos) VALUES {valores} "
+                f"ON CONFLICT (tipo, chave) DO UPDATE SET "
+                f"quantidade = {tabela}.quantidade + excluded.quantidade, minutos = {tabela}.minutos + excluded.minutos",
+                [valor for linha in linhas for valor in linha],
+            )
+
+    @classmethod
+    def reconstruir(cls):
+        """Recalcula todos os contadores a partir das reservas. Devolve quantos contadores foram gravados."""
+        totais = defaultdict(lambda: [0, 0])
+        with transaction.atomic():
+            estados = Reserva.objects.values_list(*Reserva.CAMPOS_ESTATISTICA).order_by().iterator(chunk_size=2000)
+            for estado in estados:
+                for chave, (quantidade, minutos) in cls.contribuicao(*estado).items():
+                    totais[chave][0] += quantidade
+                    totais[chave][1] += minutos
+
+            cls.objects.all().delete()
+            cls.objects.bulk_create(
+                (cls(tipo=tipo, chave=chave, quantidade=quantidade, minutos=minutos)
+                 for (tipo, chave), (quantidade, minutos) in totais.items()),
+                batch_size=500,
+            )
+            OcupacaoDia.reconstruir()
+        from . import cache
+        cache.invalidar_apos_commit('agenda')  # Dashboard em cache
+        return len(totais)
+
+    def __str__(self):
+        return f"{self.get_tipo_display()} {self.chave}: {self.quantidade}"
+
+
+class OcupacaoDia(models.Model):
+    """
+    Segundos ocupados por reservas ativas em cada hora (h00 ... h23) de um dia, por recurso,
+    no horário local. Base das taxas de ocupação (reservas/ocupacao.py): um semestre de 200 salas
+    tem no máximo 200 x 126 linhas, seja qual for o tamanho do histórico de reservas.
+
+    Mantido junto com EstatisticaReserva: registrar() recebe as mesmas diferenças de estado a cada
+    escrita de Reserva, e 'manage.py reconstruir_estatisticas' recalcula as duas tabelas.
+    'dia_semana' (segunda = 0) e 'semana' (a segunda-feira do dia) são gravados para os
+    agrupamentos saírem direto do GROUP BY.
+    """
+    recurso = models.ForeignKey(Recurso, on_delete=models.CASCADE, related_name='+')
+    dia = models.DateField()
+    dia_semana = models.PositiveSmallIntegerField()
+    semana = models.DateField()
+
+    class Meta:
+        verbose_name = "Ocupação por Dia"
+        verbose_name_plural = "Ocupações por Dia"
+        constraints = [
+            models.UniqueConstraint(fields=['recurso', 'dia'], name='ocupacao_recurso_dia_unica'),
+        ]
+        indexes = [
+            models.Index(fields=['dia'], name='ocupacao_dia_idx'),
+        ]
+
+    @staticmethod
+    def coluna(hora):
+        return f'h{hora:02d}'
+
+    @staticmethod
+    def contribuicao(recurso_id, status, inicio, fim):
+        """Segundos que UMA reserva ocupa em cada hora local: {(recurso_id, dia, hora): segundos}."""
+        if status not in STATUS_ATIVOS:
+            return {}
+        segundos = {}
+        instante = inicio
+        while instante < fim:
+            local = timezone.localtime(instante)
+            # Até a próxima hora cheia do relógio local (vale também para fusos com meia hora)
+            restante = 3600 - (local.minute * 60 + local.second) - local.microsecond / 1_000_000
+            proximo = min(fim, instante + datetime.timedelta(seconds=restante))
+            chave = (recurso_id, local.date(), local.hour)
+            segundos[chave] = segundos.get(chave, 0) + round((proximo - instante).total_seconds())
+            instante = proximo
+        return segundos
+
+    @classmethod
+    def _linha(cls, recurso_id, dia):
+        return cls(recurso_id=recurso_id, dia=dia, dia_semana=dia.weekday(),
+                   semana=dia - datetime.timedelta(days=dia.weekday()))
+
+    @classmethod
+    def registrar(cls, removidas=(), adicionadas=()):
+        """
+        Aplica a saída das 'removidas' e a entrada das 'adicionadas' (estados de Reserva).
+        Cada (recurso, dia) tocado é um UPDATE de soma (h08 = h08 + ...), atômico por linha;
+        as linhas que ainda não existem são criadas antes, zeradas.
+        """
+        deltas = defaultdict(lambda: defaultdict(int))
+        for estados, sinal in ((removidas, -1), (adicionadas, 1)):
+            for estado in estados:
+                for (recurso_id, dia, hora), segundos in cls.contribuicao(*estado).items():
+                    deltas[(recurso_id, dia)][cls.coluna(hora)] += sinal * segundos
+
+        deltas = {chave: {c: v for c, v in colunas.items() if v} for chave, colunas in deltas.items()}
+        deltas = {chave: colunas for chave, colunas in deltas.items() if colunas}
+        # Só quem ganha ocupação pode precisar de uma linha nova (na remoção, a linha já existe)
+        cls.objects.bulk_create(
+            [cls._linha(*chave) for chave, colunas in deltas.items() if any(v > 0 for v in colunas.values())],
+            ignore_conflicts=True,
+        )
+        for (recurso_id, dia), colunas in deltas.items():
+            cls.objects.filter(recurso_id=recurso_id, dia=dia).update(
+                **{coluna: F(coluna) + segundos for coluna, segundos in colunas.items()}
+            )
+
+    @classmethod
+    def reconstruir(cls):
+        """Recalcula todas as linhas a partir das reservas (chamado por EstatisticaReserva.reconstruir)."""
+        totais = defaultdict(lambda: defaultdict(int))
+        estados = Reserva.objects.ativas().values_list(*Reserva.CAMPOS_ESTATISTICA).order_by().iterator(chunk_size=2000)
+        for estado in estados:
+            for (recurso_id, dia, hora), segundos in cls.contribuicao(*estado).items():
+                totais[(recurso_id, dia)][cls.coluna(hora)] += segundos
+
+        cls.objects.all().delete()
+        linhas = []
+        for chave, colunas in totais.items():
+            linha = cls._linha(*chave)
+            for coluna, segundos in colunas.items():
+                setattr(linha, coluna, segundos)
+            linhas.append(linha)
+        cls.objects.bulk_create(linhas, batch_size=500)
+
+
+# Uma coluna por hora do dia (h00 ... h23), com os segundos ocupados nela
+for _hora in range(24):
+    OcupacaoDia.add_to_class(OcupacaoDia.coluna(_hora), models.IntegerField(default=0))
+del _hora
+
+
+class RelatorioJob(models.Model):
+    """
+    Pedido de geração de relatório em segundo plano (PDF ou Excel).
+    O arquivo gerado fica em MEDIA_ROOT/relatorios/ e é reaproveitado por outros pedidos
+    com a mesma 'chave' (mesmo escopo de usuário, filtros e versão dos dados).
+    """
+    STATUS_CHOICES = [
+        ('P', 'Na fila'),
+        ('E', 'Em execução'),
+        ('C', 'Concluído'),
+        ('F', 'Falhou'),
+    ]
+    FORMATO_CHOICES = [
+        ('pdf', 'PDF'),
+        ('xlsx', 'Excel'),
+    ]
+
+    # UUID: o ID também serve de "senha" para acompanhar o relatório pelo WebSocket
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    usuario = models.ForeignKey(User, on_delete=models.CASCADE, related_name='relatorios')
+    formato = models.CharField(max_length=4, choices=FORMATO_CHOICES)
+    filtros = models.JSONField(default=dict, blank=True)
+    chave = models.CharField(max_length=64, db_index=True)
+    status = models.CharField(max_length=1, choices=STATUS_CHOICES, default='P')
+    arquivo = models.FileField(upload_to='relatorios/', blank=True)
+    erro = models.TextField(blank=True)
+    criado_em = models.DateTimeField(auto_now_add=True)
+    concluido_em = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-criado_em']
+        verbose_name = "Relatório"
+        verbose_name_plural = "Relatórios"
+
+    @classmethod
+    def expirar(cls, retencao):
+        """
+        Apaga os pedidos mais velhos que 'retencao' (timedelta) e os arquivos de MEDIA_ROOT/relatorios/
+        que nenhum pedido restante usa (um arquivo pode ser reaproveitado por vários pedidos).
+        Arquivos recentes sem pedido ficam: podem ser de uma renderização ainda em andamento.
+        Retorna (pedidos apagados, arquivos apagados).
+        """
+        limite = timezone.now() - retencao
+        pedidos = cls.objects.filter(criado_em__lt=limite).delete()[0]
+
+        armazenamento = cls._meta.get_field('arquivo').storage
+        try:
+            _, nomes = armazenamento.listdir('relatorios')
+        except FileNotFoundError:
+            return pedidos, 0
+        em_uso = set(cls.objects.exclude(arquivo='').values_list('arquivo', flat=True))
+        arquivos = 0
+        for nome in nomes:
+            caminho = f'relatorios/{nome}'
+            if caminho not in em_uso and armazenamento.get_modified_time(caminho) < limite:
+                armazenamento.delete(caminho)
+                arquivos += 1
+        return pedidos, arquivos
+
+    def __str__(self):
+        return f"Relatório {self.get_formato_display()} de {self.usuario} ({self.get_status_display()})"
+
+
+
+class EmailPendente(models.Model):
+    """
+    Fila de saída de e-mails (outbox). A requisição só grava a mensagem aqui; o envio SMTP
+    acontece em segundo plano (reservas/emails.py), com novas tentativas espaçadas em caso de falha.
+    Mensagens que esgotam as tentativas ficam com status 'F' (dead letter), visíveis no Admin.
+    """
+    STATUS_CHOICES = [
+        ('P', 'Pendente'),
+        ('E', 'Enviado'),
+        ('F', 'Falhou'),
+    ]
+
+    assunto = models.CharField(max_length=255)
+    mensagem = models.TextField()
+    remetente = models.CharField(max_length=254, blank=True)
+    destinatarios = models.JSONField(default=list)
+    status = models.CharField(max_length=1, choices=STATUS_CHOICES, default='P')
+    tentativas = models.PositiveSmallIntegerField(default=0)
+    proxima_tentativa = models.DateTimeField(default=timezone.now)
+    # Envio que reservou a mensagem (evita que dois processos enviem a mesma)
+    envio = models.UUIDField(null=True, blank=True)
+    ultimo_erro = models.TextField(blank=True)
+    criado_em = models.DateTimeField(auto_now_add=True)
+    enviado_em = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-criado_em']
+        verbose_name = "E-mail (fila de envio)"
+        verbose_name_plural = "E-mails (fila de envio)"
+        indexes = [
+            # O remetente em segundo plano só procura as pendentes que já venceram
+            models.Index(fields=['status', 'proxima_tentativa'], name='email_fila_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.assunto} -> {', '.join(self.destinatarios)} ({self.get_status_display()})"
+
+
+class EventoAgenda(models.Model):
+    """
+    Log, só de acréscimo, das alterações de reservas enviadas aos tópicos do WebSocket
+    (eventos.publicar_reservas): uma linha por (alteração, tópico). O ID é o número de sequência:
+    o cliente guarda o último que recebeu e, ao reconectar, pede só o que veio depois (desde()).
+
+    Para isso, um ID menor nunca pode aparecer (commit) depois de um maior já lido: as linhas são
+    gravadas após o commit da alteração, uma gravação por vez (gravar()). No SQLite (um escritor
+    por vez) isso já valeria; em bancos com escritas simultâneas, é a trava de gravar() que garante.
+
+    Como cada delta traz a reserva inteira, só a última linha de cada (tópico, reserva) importa
+    para quem retoma: compactar() apaga as anteriores. expirar() apaga o que passou da retenção
+    e registra até onde apagou (o "horizonte"): quem pede algo anterior precisa recarregar tudo.
+    Veja 'manage.py compactar_eventos'.
+    """
+    evento = models.CharField(max_length=32)
+    grupo = models.CharField(max_length=64)
+    # Sem chave estrangeira: o log sobrevive à exclusão da reserva
+    reserva_id = models.PositiveIntegerField()
+    acao = models.CharField(max_length=10)
+    dados = models.JSONField()
+    criado_em = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = "Evento da Agenda"
+        verbose_name_plural = "Eventos da Agenda"
+        indexes = [
+            # Retomada: "eventos destes tópicos depois da sequência N"
+            models.Index(fields=['grupo', 'id'], name='evento_agenda_seq_idx'),
+        ]
+
+    @classmethod
+    def ultima_sequencia(cls):
+        return cls.objects.order_by('-id').values_list('id', flat=True).first() or 0
+
+    @classmethod
+    def gravar(cls, linhas):
+        """
+        Grava as linhas em uma transação própria, uma gravação por vez (o UPDATE do contador
+        'eventos_log' trava a linha até o commit): os IDs ficam visíveis na ordem em que foram dados.
+        """
+        with transaction.atomic():
+            if not ContadorVersao.objects.filter(nome='eventos_log').update(valor=F('valor') + 1):
+                ContadorVersao.objects.get_or_create(nome='eventos_log')
+                ContadorVersao.objects.filter(nome='eventos_log').update(valor=F('valor') + 1)
+            return cls.objects.bulk_create(linhas)
+
+    @classmethod
+    def desde(cls, grupos, sequencia, limite=1000):
+        """
+        Linhas dos tópicos 'grupos' com sequência maior que 'sequencia', em ordem.
+        Retorna (linhas, completo): completo=False se parte do que foi pedido já expirou ou se há
+        mais que 'limite' linhas; nesses casos o cliente deve recarregar a agenda inteira.
+        """
+        if sequencia < ContadorVersao.atual('eventos_horizonte'):
+            return [], False
+        linhas = list(cls.objects.filter(grupo__in=grupos, id__gt=sequencia).order_by('id')[:limite + 1])
+        return linhas[:limite], len(linhas) <= limite
+
+    @classmethod
+    def compactar(cls):
+        """Apaga as linhas substituídas por uma mais nova do mesmo (tópico, reserva)."""
+        ultimas = cls.objects.values('grupo', 'reserva_id').annotate(ultima=models.Max('id')).values('ultima')
+        return cls.objects.exclude(id__in=models.Subquery(ultimas)).delete()[0]
+
+    @classmethod
+    def expirar(cls, retencao):
+        """Apaga as linhas mais velhas que 'retencao' (timedelta) e avança o horizonte."""
+        antigas = cls.objects.filter(criado_em__lt=timezone.now() - retencao)
+        ultima = antigas.order_by('-id').values_list('id', flat=True).first()
+        if ultima is None:
+            return 0
+        with transaction.atomic():
+            cls.avancar_horizonte(ultima)
+            return cls.objects.filter(id__lte=ultima).delete()[0]
+
+    @classmethod
+    def avancar_horizonte(cls, sequencia):
+        """Quem retomar antes de 'sequencia' recarrega a agenda. O horizonte nunca recua."""
+        with transaction.atomic():
+            ContadorVersao.objects.get_or_create(nome='eventos_horizonte')
+            ContadorVersao.objects.filter(nome='eventos_horizonte', valor__lt=sequencia).update(valor=sequencia)
+
+    def __str__(self):
+        return f"#{self.pk} {self.grupo}: reserva {self.reserva_id} {self.acao}"
+
+
+class ValidadeToken(models.Model):
+    """
+    Validade do Token do DRF. A tabela authtoken_token é da biblioteca e não tem expiração:
+    cada Token ganha esta linha ao ser criado (sinal abaixo) e deixa de valer em 'expira_em'.
+
+    - Renovação deslizante: um token usado quando já passou da metade da validade volta a valer
+      TOKENS_VALIDADE_HORAS a partir dali. A verificação acontece quando o token é carregado do
+      banco (autenticacao.buscar_usuarios, no máximo uma vez por TTL do cache), então não há
+      escrita por requisição: no máximo uma por token a cada meia validade.
+    - Rotação (rotacionar): troca a chave do usuário; a antiga deixa de valer na hora.
+    - Limpeza (purgar) e revogação em massa (revogar) apagam em lotes, pelo índice de 'expira_em'
+      ou pelos usuários/grupos; veja 'manage.py expirar_tokens' e 'manage.py revogar_tokens'.
+    """
+    token = models.OneToOneField(Token, on_delete=models.CASCADE, primary_key=True, related_name='validade')
+    expira_em = models.DateTimeField(db_index=True)
+
+    class Meta:
+        verbose_name = "Validade de Token"
+        verbose_name_plural = "Validades de Tokens"
+
+    @staticmethod
+    def duracao():
+        return datetime.timedelta(hours=getattr(settings, 'TOKENS_VALIDADE_HORAS', 24 * 7))
+
+    @classmethod
+    def emitir(cls, usuario):
+        """Token válido do usuário: o atual, se ainda vale; senão, um novo (login)."""
+        token = (
+            Token.objects.filter(user=usuario, validade__expira_em__gt=timezone.now())
+            .select_related('validade').first()
+        )
+        return token or cls.rotacionar(usuario)
+
+    @classmethod
+    def rotacionar(cls, usuario):
+        """Substitui o token do usuário por um novo (a chave antiga deixa de valer)."""
+        with transaction.atomic():
+            Token.objects.filter(user=usuario).delete()
+            return Token.objects.create(user=usuario)
+
+    @classmethod
+    def renovar(cls, chaves):
+        """Um UPDATE para várias chaves: voltam a valer a validade inteira a partir de agora."""
+        expira_em = timezone.now() + cls.duracao()
+        cls.objects.filter(token_id__in=chaves).update(expira_em=expira_em)
+        return expira_em
+
+    @classmethod
+    def _apagar_em_lotes(cls, tokens, lote):
+        # Token.delete() por lote (em vez de um DELETE só): transações curtas e os sinais de cada
+        # token continuam disparando (troca da versão no cache compartilhado: vale para os demais processos)
+        total = 0
+        while True:
+            chaves = list(tokens.values_list('key', flat=True)[:lote])
+            if not chaves:
+                return total
+            total += Token.objects.filter(key__in=chaves).delete()[1].get(Token._meta.label, 0)
+
+    @classmethod
+    def purgar(cls, lote=1000):
+        """Apaga os tokens expirados (pelo índice de 'expira_em'). Devolve quantos foram apagados."""
+        return cls._apagar_em_lotes(Token.objects.filter(validade__expira_em__lte=timezone.now()), lote)
+
+    @classmethod
+    def revogar(cls, usuarios=(), grupos=(), lote=1000):
+        """Apaga os tokens dos usuários (nomes) e dos membros dos grupos (nomes) informados."""
+        filtro = models.Q(user__username__in=usuarios) | models.Q(user__groups__name__in=grupos)
+        return cls._apagar_em_lotes(Token.objects.filter(filtro).distinct(), lote)
+
+    def __str__(self):
+        return f"Token de {self.token.user} até {timezone.localtime(self.expira_em):%d/%m/%Y %H:%M}"
+
+
 # Sinais 
 
+@receiver([post_save, post_delete], sender=Reserva)
+@receiver([post_save, post_delete], sender=Recurso)
+def incrementar_versao_agenda(sender, **kwargs):
+    """
+    Qualquer mudança em Reserva/Recurso invalida os relatórios já gerados.
+    O incremento roda na transação da alteração: no SQLite ela já tem a trava de escrita, e a nova
+    versão fica visível junto com os dados (nunca antes nem depois deles).
+    """
+    ContadorVersao.incrementar('agenda')
+
+
+@receiver([post_save, post_delete], sender=Reserva)
+@receiver([post_save, post_delete], sender=Recurso)
+def invalidar_indice_agenda(sender, **kwargs):
+    """
+    Descarta na hora (sem esperar o commit) o índice em memória da busca de salas livres
+    deste processo. Os demais processos percebem a mudança pela versão da agenda.
+    """
+    from . import agenda  # agenda.py importa os models
+    agenda.invalidar()
+
+
+@receiver([post_save, post_delete], sender=Recurso)
+def invalidar_catalogo(sender, **kwargs):
+    """
+    Descarta na hora o catálogo em cache deste processo (reservas/catalogo.py) e incrementa a
+    versão 'recursos', conferida pelos demais processos.
+    """
+    from . import cache, catalogo  # catalogo.py importa os models
+    catalogo.invalidar()
+    # Nome, capacidade e status das salas aparecem na busca, no calendário e nas listagens
+    cache.invalidar_apos_commit('recursos', 'agenda')
+
+    # Na transação da alteração, como a versão da agenda: visível junto com a sala nova
+    ContadorVersao.incrementar('recursos')
+    # De novo após o commit: uma leitura feita antes dele pode ter guardado o catálogo antigo
+    transaction.on_commit(catalogo.invalidar)
+
+
+@receiver(pre_save, sender=Reserva)
+def guardar_estado_anterior(sender, instance, raw=False, **kwargs):
+    """
+    Reservas lidas do banco já trazem o estado salvo (Reserva.from_db). Só uma instância montada
+    à mão com o ID de uma reserva existente precisa buscá-lo, para não contar a reserva duas vezes.
+    """
+    if raw or instance.pk is None or hasattr(instance, '_estado_salvo'):
+        return
+    instance._estado_salvo = (
+        Reserva.objects.filter(pk=instance.pk).values_list(*Reserva.CAMPOS_ESTATISTICA).first()
+    )
+
+
+@receiver(post_save, sender=Reserva)
+def atualizar_estatisticas(sender, instance, raw=False, **kwargs):
+    """
+    Atualiza as estatísticas do Dashboard pela diferença entre o estado anterior e o novo, na
+    transação da reserva (que no SQLite já tem a trava de escrita): se os contadores falharem, a
+    reserva também não é gravada, em vez de ficar salva com o Dashboard divergente.
+    Em um banco com lock por linha, os contadores 'total' e 'status' serializariam as escritas
+    de salas diferentes até o commit.
+    """
+    if raw:
+        return
+    antes = getattr(instance, '_estado_salvo', None)
+    depois = instance.estado_estatisticas()
+    instance._estado_salvo = depois
+    instance._estado_anterior = antes  # usado por publicar_alteracao
+    if antes != depois:
+        EstatisticaReserva.registrar(removidas=[antes] if antes else [], adicionadas=[depois])
+
+
+@receiver(post_save, sender=Reserva)
+def invalidar_cache_reserva(sender, instance, raw=False, **kwargs):
+    """
+    Respostas em cache (reservas/cache.py) da agenda, dos dias tocados antes e depois e do dono.
+    A segunda invalidação (após o commit) acontece depois de as estatísticas do Dashboard
+    ficarem visíveis.
+    """
+    if raw:
+        return
+    from . import cache
+    cache.invalidar_apos_commit(*cache.etiquetas_reservas(
+        [(instance, getattr(instance, '_estado_anterior', None), False)]
+    ))
+
+
+@receiver(post_delete, sender=Reserva)
+def remover_das_estatisticas(sender, instance, **kwargs):
+    estado = getattr(instance, '_estado_salvo', None) or instance.estado_estatisticas()
+    EstatisticaReserva.registrar(removidas=[estado])
+
+
+@receiver(post_save, sender=Reserva)
+def publicar_alteracao(sender, instance, raw=False, **kwargs):
+    """Envia o delta da reserva aos tópicos de WebSocket inscritos (após o commit; veja eventos.py)."""
+    if raw:
+        return
+    from . import eventos  # eventos.py importa os models
+    eventos.publicar_reservas([(instance, getattr(instance, '_estado_anterior', None), False)])
+
+
+@receiver(post_delete, sender=Reserva)
+def publicar_remocao(sender, instance, **kwargs):
+    from . import eventos  # eventos.py importa os models
+    eventos.publicar_reservas([(instance, None, True)])
+
+
+@receiver(post_delete, sender=Reserva)
+def invalidar_cache_remocao(sender, instance, **kwargs):
+    from . import cache
+    cache.invalidar_apos_commit(*cache.etiquetas_reservas([(instance, None, True)]))
+
+
+@receiver(post_delete, sender=Recurso)
+def remover_estatisticas_do_recurso(sender, instance, **kwargs):
+    # As reservas do recurso (CASCADE) já foram descontadas; resta o contador zerado dele
+    EstatisticaReserva.objects.filter(tipo='recurso', chave=str(instance.pk)).delete()
+
+
 @receiver(reset_password_token_created)
 def password_reset_token_created(sender, instance, reset_password_token, *args, **kwargs):
     """
@@ -152,9 +1071,34 @@ def password_reset_token_created(sender, instance, reset_password_token, *args,
     Se você não pediu isso, ignore este e-mail.
     """
 
-    send_mail(
-        subject="Redefinição de Senha - Sistema de Reservas",
-        message=email_mensagem,
-        from_email=None, 
-        recipient_list=[reset_password_token.user.email]
-    )
\ No newline at end of file
+    # Vai para a fila de saída: a resposta do pedido de nova senha não espera o servidor SMTP
+    from . import emails  # emails.py importa os models
+    emails.enfileirar(
+        assunto="Redefinição de Senha - Sistema de Reservas",
+        mensagem=email_mensagem,
+        destinatarios=[reset_password_token.user.email],
+    )
+
+
+@receiver(post_save, sender=Token)
+def criar_validade_token(sender, instance, created=False, raw=False, **kwargs):
+    if created and not raw:
+        ValidadeToken.objects.create(token=instance, expira_em=timezone.now() + ValidadeToken.duracao())
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def descartar_token_do_cache(sender, instance, **kwargs):
+    """Token trocado ou excluído deixa de valer na hora para novas conexões, em todos os processos."""
+    from .autenticacao import cache_tokens, invalidar_tokens_apos_commit  # autenticacao.py importa o Token
+    cache_tokens.descartar(chave=instance.key)
+    invalidar_tokens_apos_commit([instance.key])
+
+
+@receiver(post_save, sender=User)
+def descartar_usuario_do_cache(sender, instance, created=False, **kwargs):
+    """Usuário desativado ou que perdeu o acesso de Admin: o cache não guarda a versão antiga."""
+    if not created:
+        from .autenticacao import cache_tokens, invalidar_tokens_apos_commit
+        cache_tokens.descartar(usuario_id=instance.pk)
+        invalidar_tokens_apos_commit(Token.objects.filter(user_id=instance.pk).values_list('key', flat=True))
@@ -0,0 +1,56 @@
+"""
+Notificações de decisões em lote (aprovação/rejeição de reservas pendentes).
+
+Em vez de um e-mail por reserva, cada usuário afetado recebe UM e-mail com todas as decisões
+que o envolvem; os e-mails vão para a fila de saída (reservas/emails.py) em um único INSERT.
+O painel administrativo recebe uma única mensagem de WebSocket com o resumo do lote.
+"""
+from collections import defaultdict
+
+from django.utils import timezone
+
+from . import emails, eventos
+
+
+def _linha(reserva):
+    inicio = timezone.localtime(reserva.data_hora_inicio)
+    return f"- {reserva.recurso.nome}, {inicio:%d/%m/%Y %H:%M}"
+
+
+def notificar_decisoes(resultado):
+    """'resultado' é o retorno de Reserva.decidir_em_lote."""
+    por_usuario = defaultdict(lambda: {'aprovadas': [], 'rejeitadas': []})
+    for reserva in resultado['aprovadas']:
+        por_usuario[reserva.usuario]['aprovadas'].append(_linha(reserva))
+    for reserva in resultado['rejeitadas']:
+        por_usuario[reserva.usuario]['rejeitadas'].append(_linha(reserva))
+    for reserva, vencedora in resultado['perdedoras']:
+        por_usuario[reserva.usuario]['rejeitadas'].append(
+            f"{_linha(reserva)} (horário já reservado por {vencedora.usuario.username})"
+        )
+
+    mensagens = []
+    for usuario, decisoes in por_usuario.items():
+        if not usuario.email:
+            continue
+        partes = [f"Olá, {usuario.username}!"]
+        if decisoes['aprovadas']:
+            partes += ["", "Reservas aprovadas:", *decisoes['aprovadas']]
+        if decisoes['rejeitadas']:
+            partes += ["", "Reservas rejeitadas:", *decisoes['rejeitadas']]
+        mensagens.append(
+            ('Atualização das suas reservas', '\n'.join(partes), '', [usuario.email])
+        )
+    emails.enfileirar_varios(mensagens)
+
+    total_rejeitadas = len(resultado['rejeitadas']) + len(resultado['perdedoras'])
+    eventos.publicar(
+        "admin_reservas",
+        {
+            "type": "enviar_notificacao",
+            "message": (
+                f"Lote processado: {len(resultado['aprovadas'])} aprovada(s), {total_rejeitadas} rejeitada(s) "
+                f"({len(resultado['perdedoras'])} por conflito)"
+            ),
+        }
+    )
@@ -0,0 +1,240 @@
+"""
+Taxas de ocupação dos Recursos: horas reservadas / horas disponíveis (horário de funcionamento),
+agrupadas por hora do dia, por dia da semana e por semana.
+
+As horas reservadas vêm dos contadores já agregados (models.OcupacaoDia: segundos ocupados em
+cada hora de cada dia, por recurso), e não das reservas: um semestre de 200 salas são no máximo
+~25 mil linhas, seja qual for o tamanho do histórico. As horas cheias do período saem de dois
+GROUP BY do ORM (por dia da semana e por semana); só as frações de hora nas pontas do período
+(ex: a partir das 9h30) são calculadas a partir das reservas, que ali são poucas.
+"""
+import datetime
+from collections import defaultdict
+
+from django.conf import settings
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import OcupacaoDia, Recurso, Reserva
+
+# Maior período aceito em uma consulta
+PERIODO_MAXIMO = datetime.timedelta(days=400)
+
+DIAS_SEMANA = ['Seg', 'Ter', 'Qua', 'Qui', 'Sex', 'Sáb', 'Dom']
+
+_HORA = 3600
+_DIA = 86400
+_EPOCA = datetime.date(1970, 1, 1)
+
+
+def expediente():
+    """Horário de funcionamento: (hora de abertura, hora de fechamento, dias da semana abertos)."""
+    return (
+        getattr(settings, 'EXPEDIENTE_INICIO', 7),
+        getattr(settings, 'EXPEDIENTE_FIM', 22),
+        list(getattr(settings, 'EXPEDIENTE_DIAS_SEMANA', [0, 1, 2, 3, 4, 5])),
+    )
+
+
+def _epoca(valor):
+    return int(valor.timestamp())
+
+
+def _deslocamentos(inicio, fim):
+    """
+    Diferença (em segundos) entre o horário local e o UTC ao longo do período:
+    [(a partir de qual instante UTC, deslocamento)]. Normalmente um único trecho; mais de um
+    se o período atravessar uma mudança de horário de verão.
+    """
+    fuso = timezone.get_current_timezone()
+    trechos = [(_epoca(inicio), int(inicio.astimezone(fuso).utcoffset().total_seconds()))]
+    instante = inicio
+    while instante < fim:
+        instante = min(instante + datetime.timedelta(days=1), fim)
+        deslocamento = int(instante.astimezone(fuso).utcoffset().total_seconds())
+        if deslocamento != trechos[-1][1]:
+            trechos.append((_epoca(instante), deslocamento))
+    return trechos
+
+
+def _para_local(epoca, trechos):
+    deslocamento = trechos[0][1]
+    for desde, valor in trechos:
+        if epoca >= desde:
+            deslocamento = valor
+    return epoca + deslocamento
+
+
+class _Somatorio:
+    """Segundos reservados por (agrupamento, recurso, grupo), só dentro do horário de funcionamento."""
+
+    def __init__(self):
+        self.abertura, self.fechamento, self.dias_abertos = expediente()
+        self.segundos = defaultdict(int)
+
+    def aberto(self, dia_semana, hora):
+        return dia_semana in self.dias_abertos and self.abertura <= hora < self.fechamento
+
+    def horas(self, recurso_id, dia, horas):
+        """Soma {hora: segundos} de um dia."""
+        dia_semana = dia.weekday()
+        semana = (dia - _EPOCA).days - dia_semana
+        for hora, segundos in horas.items():
+            if segundos and self.aberto(dia_semana, hora):
+                self.segundos[('hora', recurso_id, hora)] += segundos
+                self.segundos[('dia_semana', recurso_id, dia_semana)] += segundos
+                self.segundos[('semana', recurso_id, semana)] += segundos
+
+
+def _hora_cheia_seguinte(local):
+    truncada = local.replace(minute=0, second=0, microsecond=0)
+    return truncada if truncada == local else truncada + datetime.timedelta(hours=1)
+
+
+def _somar_dias_inteiros(somatorio, contadores, primeiro, ultimo):
+    """Dias [primeiro, ultimo) inteiros: dois GROUP BY, por dia da semana e por semana."""
+    colunas = [OcupacaoDia.coluna(hora) for hora in range(somatorio.abertura, somatorio.fechamento)]
+    if not colunas or primeiro >= ultimo:
+        return
+    dias = contadores.filter(dia__gte=primeiro, dia__lt=ultimo, dia_semana__in=somatorio.dias_abertos).order_by()
+
+    segundos = somatorio.segundos
+    horas = range(somatorio.abertura, somatorio.fechamento)
+    por_dia_semana = dias.values('recurso_id', 'dia_semana').annotate(**{c: Sum(c) for c in colunas})
+    for recurso_id, dia_semana, *totais in por_dia_semana.values_list('recurso_id', 'dia_semana', *colunas):
+        for hora, total in zip(horas, totais):
+            segundos[('hora', recurso_id, hora)] += total
+        segundos[('dia_semana', recurso_id, dia_semana)] += sum(totais)
+
+    expressao = sum((F(c) for c in colunas[1:]), F(colunas[0]))
+    por_semana = dias.values('recurso_id', 'semana').annotate(total=Sum(expressao))
+    for recurso_id, semana, total in por_semana.values_list('recurso_id', 'semana', 'total'):
+        segundos[('semana', recurso_id, (semana - _EPOCA).days)] += total
+
+
+def _somar_horas_do_dia(somatorio, contadores, dia, primeira, ultima):
+    """Horas [primeira, ultima) de um dia só (pontas do período)."""
+    colunas = {hora: OcupacaoDia.coluna(hora) for hora in range(primeira, ultima)}
+    for linha in contadores.filter(dia=dia).values('recurso_id', *colunas.values()):
+        somatorio.horas(linha['recurso_id'], dia, {hora: linha[coluna] for hora, coluna in colunas.items()})
+
+
+def _somar_fracao(somatorio, recurso_ids, inicio, fim):
+    """[inicio, fim) dentro de uma única hora: calculado a partir das reservas que a tocam."""
+    local = timezone.localtime(inicio)
+    if not somatorio.aberto(local.weekday(), local.hour):
+        return
+    reservas = Reserva.objects.ativas().intersectando(inicio, fim)
+    if recurso_ids is not None:
+        reservas = reservas.filter(recurso_id__in=recurso_ids)
+    for recurso_id, inicio_reserva, fim_reserva in reservas.values_list('recurso_id', 'data_hora_inicio', 'data_hora_fim'):
+        segundos = (min(fim, fim_reserva) - max(inicio, inicio_reserva)).total_seconds()
+        somatorio.horas(recurso_id, local.date(), {local.hour: round(segundos)})
+
+
+def _segundos_reservados(inicio, fim, recurso_ids):
+    """
+    Segundos reservados dentro do horário de funcionamento, por (agrupamento, recurso, grupo).
+    O período é dividido no relógio local em: fração da hora inicial, horas restantes do
+    primeiro dia, dias inteiros, primeiras horas do último dia e fração da hora final.
+    """
+    somatorio = _Somatorio()
+    contadores = OcupacaoDia.objects.all()
+    if recurso_ids is not None:
+        contadores = contadores.filter(recurso_id__in=recurso_ids)
+
+    local_inicio, local_fim = timezone.localtime(inicio), timezone.localtime(fim)
+    primeira = _hora_cheia_seguinte(local_inicio)
+    ultima = local_fim.replace(minute=0, second=0, microsecond=0)
+
+    if primeira >= ultima:
+        # Nenhuma hora cheia: no máximo duas frações (ex: 9h30 às 10h15)
+        fracoes = [(inicio, min(primeira, fim)), (primeira, fim)]
+    else:
+        fracoes = [(inicio, primeira), (ultima, fim)]
+        dia_inicial, dia_final = primeira.date(), ultima.date()
+        if dia_inicial == dia_final:
+            _somar_horas_do_dia(somatorio, contadores, dia_inicial, primeira.hour, ultima.hour)
+        else:
+            inteiros_desde = dia_inicial
+            if primeira.hour:
+                _somar_horas_do_dia(somatorio, contadores, dia_inicial, primeira.hour, 24)
+                inteiros_desde += datetime.timedelta(days=1)
+            _somar_dias_inteiros(somatorio, contadores, inteiros_desde, dia_final)
+            if ultima.hour:
+                _somar_horas_do_dia(somatorio, contadores, dia_final, 0, ultima.hour)
+
+    for fracao_inicio, fracao_fim in fracoes:
+        if fracao_inicio < fracao_fim:
+            _somar_fracao(somatorio, recurso_ids, fracao_inicio, fracao_fim)
+    return somatorio.segundos
+
+
+def _segundos_disponiveis(inicio_local, fim_local):
+    """
+    Segundos de funcionamento no período, por grupo (iguais para todos os recursos).
+    Percorre as horas do período uma vez (um semestre tem ~3 mil horas), sem tocar no banco.
+    """
+    abertura, fechamento, dias_abertos = expediente()
+    disponiveis = {'hora': {}, 'dia_semana': {}, 'semana': {}}
+
+    hora = inicio_local // _HORA * _HORA
+    while hora < fim_local:
+        dias = hora // _DIA
+        dia_semana = (dias + 3) % 7
+        hora_do_dia = hora % _DIA // _HORA
+        if abertura <= hora_do_dia < fechamento and dia_semana in dias_abertos:
+            segundos = min(fim_local, hora + _HORA) - max(inicio_local, hora)
+            for agrupamento, grupo in (('hora', hora_do_dia), ('dia_semana', dia_semana), ('semana', dias - dia_semana)):
+                disponiveis[agrupamento][grupo] = disponiveis[agrupamento].get(grupo, 0) + segundos
+        hora += _HORA
+    return disponiveis
+
+
+def _taxa(reservado, disponivel):
+    return round(100 * reservado / disponivel, 1) if disponivel else None
+
+
+def taxas_de_ocupacao(inicio, fim, recurso_ids=None):
+    """
+    Ocupação de cada recurso entre 'inicio' e 'fim' (datetimes com fuso).
+
+    Retorna os rótulos de cada agrupamento e, por recurso, as taxas (%) na mesma ordem dos rótulos,
+    prontas para o Chart.js. Só conta o que cai dentro do horário de funcionamento
+    (EXPEDIENTE_* no settings.py), e só reservas ativas (Confirmada, Pendente, Manutenção).
+    """
+    recursos = Recurso.objects.order_by('nome')
+    recursos = recursos.filter(pk__in=recurso_ids) if recurso_ids is not None else recursos.filter(ativo=True)
+    recursos = list(recursos.values('id', 'nome'))
+
+    trechos = _deslocamentos(inicio, fim)
+    reservados = _segundos_reservados(inicio, fim, [r['id'] for r in recursos] if recurso_ids is not None else None)
+    disponiveis = _segundos_disponiveis(_para_local(_epoca(inicio), trechos), _para_local(_epoca(fim), trechos))
+
+    grupos = {agrupamento: sorted(valores) for agrupamento, valores in disponiveis.items()}
+    total_disponivel = sum(disponiveis['semana'].values())
+
+    resultado = []
+    for recurso in recursos:
+        linha = {'id': recurso['id'], 'nome': recurso['nome']}
+        for agrupamento, chaves in grupos.items():
+            linha[agrupamento] = [
+                _taxa(reservados.get((agrupamento, recurso['id'], grupo), 0), disponiveis[agrupamento][grupo])
+                for grupo in chaves
+            ]
+        total_reservado = sum(reservados.get(('semana', recurso['id'], grupo), 0) for grupo in grupos['semana'])
+        linha['horas_reservadas'] = round(total_reservado / _HORA, 1)
+        linha['horas_disponiveis'] = round(total_disponivel / _HORA, 1)
+        linha['taxa'] = _taxa(total_reservado, total_disponivel)
+        resultado.append(linha)
+
+    return {
+        'inicio': inicio,
+        'fim': fim,
+        'rotulos': {
+            'hora': [f'{hora:02d}h' for hora in grupos['hora']],
+            'dia_semana': [DIAS_SEMANA[dia] for dia in grupos['dia_semana']],
+            'semana': [(_EPOCA + datetime.timedelta(days=dias)).isoformat() for dias in grupos['semana']],
+        },
+        'recursos': resultado,
+    }
@@ -0,0 +1,18 @@
+from rest_framework.pagination import CursorPagination
+
+
+class CalendarioCursorPagination(CursorPagination):
+    """
+    Paginação por cursor (keyset) para o feed do calendário.
+
+    Diferente da paginação por OFFSET (que obriga o banco a percorrer e descartar
+    todas as linhas anteriores), o cursor codifica o último 'data_hora_inicio' visto
+    e a próxima página começa exatamente dali. O custo de cada página é constante,
+    não importa o tamanho do histórico de reservas.
+    """
+    page_size = 500
+    page_size_query_param = 'page_size'
+    max_page_size = 2000
+
+    # 'id' desempata reservas que começam no mesmo horário (ordenação estável)
+    ordering = ('data_hora_inicio', 'id')
@@ -0,0 +1,605 @@
+"""
+Geração dos relatórios de Reservas (PDF e Excel).
+
+Separado das Views para que a mesma lógica de renderização possa ser usada
+tanto na requisição HTTP quanto fora dela (relatórios em segundo plano, comandos de manutenção).
+"""
+import datetime
+import hashlib
+import json
+import tempfile
+import uuid
+import zipfile
+from xml.sax.saxutils import escape
+
+from asgiref.sync import sync_to_async
+from django.core.files import File
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.utils import get_column_letter
+from openpyxl.utils.datetime import to_excel
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.platypus import BaseDocTemplate, Frame, PageTemplate, Paragraph, Table
+
+from . import cache, eventos
+from .models import RelatorioJob, Reserva
+from .serializers import FiltrosRelatorioSerializer
+
+CONTENT_TYPE_PDF = 'application/pdf'
+CONTENT_TYPE_EXCEL = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+COLUNAS_EXCEL = ['ID', 'Recurso', 'Usuário', 'Início', 'Fim', 'Motivo', 'Status']
+LARGURAS_EXCEL = [8, 30, 20, 17, 17, 40, 15]
+
+# Linhas buscadas do banco (e escritas na planilha) por vez: limita a memória usada,
+# não importa o tamanho do histórico
+TAMANHO_LOTE = 2000
+
+
+def reservas_do_relatorio(usuario, filtros):
+    """
+    Reservas exibidas nos relatórios, filtradas com base na permissão
+    (Admin vê todas, Aluno apenas as suas), das mais recentes para as mais antigas.
+    Recurso e Usuário vêm no mesmo SELECT (JOIN), sem uma consulta extra por linha.
+
+    'filtros' é o validated_data de um FiltrosRelatorioSerializer.
+    """
+    reservas = Reserva.objects.select_related('recurso', 'usuario')
+    if not usuario.is_staff:
+        reservas = reservas.filter(usuario=usuario)
+
+    if filtros.get('inicio'):
+        reservas = reservas.filter(data_hora_fim__gt=filtros['inicio'])
+    if filtros.get('fim'):
+        reservas = reservas.filter(data_hora_inicio__lt=filtros['fim'])
+    if filtros.get('recurso'):
+        reservas = reservas.filter(recurso_id=filtros['recurso'])
+    if filtros.get('status'):
+        reservas = reservas.filter(status__in=filtros['status'].split(','))
+
+    return reservas.order_by('-data_hora_inicio')
+
+
+# PDF
+
+# Colunas do PDF (A4 paisagem): (título, largura em pontos). 'Motivo' ocupa o espaço que sobra.
+COLUNAS_PDF = [
+    ('ID', 40), ('Recurso', 140), ('Usuário', 90), ('Início', 72), ('Fim', 72),
+    ('Duração', 48), ('Motivo', None), ('Status', 70),
+]
+
+# Linhas por tabela: menos que uma página, para que raramente seja preciso quebrar uma
+# tabela entre páginas (a quebra obriga o ReportLab a medir a tabela de novo)
+LINHAS_POR_TABELA_PDF = 25
+
+_MARGEM_PDF = 30
+_FONTE_PDF = 'Helvetica'
+_TAMANHO_FONTE_PDF = 8
+_PADDING_PDF = 3
+
+_ESTILO_TEXTO_PDF = ParagraphStyle(
+    'celula', fontName=_FONTE_PDF, fontSize=_TAMANHO_FONTE_PDF, leading=_TAMANHO_FONTE_PDF + 2,
+)
+
+_ESTILO_TABELA_PDF = [
+    ('FONT', (0, 0), (-1, -1), _FONTE_PDF, _TAMANHO_FONTE_PDF),
+    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ('LEFTPADDING', (0, 0), (-1, -1), _PADDING_PDF),
+    ('RIGHTPADDING', (0, 0), (-1, -1), _PADDING_PDF),
+    ('TOPPADDING', (0, 0), (-1, -1), 2),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 2),
+    ('LINEBELOW', (0, 0), (-1, -1), 0.25, colors.lightgrey),
+]
+# Estilos das faixas (linhas que ocupam a largura toda), aplicados à linha da faixa
+_ESTILO_GRUPO_PDF = [('BACKGROUND', colors.HexColor('#e8eef7'))]
+_ESTILO_SUBTOTAL_PDF = [('ALIGN', 'RIGHT'), ('LINEABOVE', 0.5, colors.grey)]
+_ESTILO_TOTAL_PDF = [('ALIGN', 'RIGHT'), ('LINEABOVE', 1, colors.black)]
+
+
+def _colunas_pdf(agrupar):
+    """Títulos e larguras das colunas. Agrupado por recurso, o nome dele já está no cabeçalho do grupo."""
+    colunas = [c for c in COLUNAS_PDF if not (agrupar == 'recurso' and c[0] == 'Recurso')]
+    livre = landscape(A4)[0] - 2 * _MARGEM_PDF - sum(largura or 0 for _, largura in colunas)
+    return [titulo for titulo, _ in colunas], [largura or livre for _, largura in colunas]
+
+
+def _celula_pdf(texto, largura):
+    """
+    Texto curto vai como string simples (rápido de medir e desenhar). Só o que não cabe
+    na coluna vira Paragraph, que quebra em várias linhas em vez de cortar o texto.
+    """
+    if stringWidth(texto, _FONTE_PDF, _TAMANHO_FONTE_PDF) <= largura - 2 * _PADDING_PDF:
+        return texto
+    return Paragraph(escape(texto), _ESTILO_TEXTO_PDF)
+
+
+def _duracao(delta):
+    minutos = int(delta.total_seconds()) // 60
+    return f'{minutos // 60}h{minutos % 60:02d}'
+
+
+def _data_hora_pdf(valor):
+    valor = timezone.localtime(valor)
+    return f'{valor.day:02d}/{valor.month:02d}/{valor.year} {valor.hour:02d}:{valor.minute:02d}'
+
+
+def _resumo(rotulo, quantidade, horas):
+    return f"{rotulo}: {quantidade} reserva{'s' if quantidade != 1 else ''} - {_duracao(horas)} reservadas"
+
+
+class _BlocoPdf:
+    """
+    Linhas da próxima tabela do PDF, com os estilos próprios delas (faixas de grupo e subtotal).
+
+    Cabeçalhos de grupo e subtotais são linhas da própria tabela (SPAN na largura toda), e não
+    flowables separados. Assim a tabela continua na mesma página, e o NOSPLIT garante que o
+    cabeçalho não fique sozinho no fim de uma página nem o subtotal sozinho no início da próxima.
+    """
+
+    def __init__(self, larguras):
+        self.larguras = larguras
+        # Quando todas as células são strings de uma linha, a altura da linha já é conhecida
+        # e o ReportLab não precisa medir célula por célula
+        self.altura_linha = Table([['']], colWidths=[1], style=_ESTILO_TABELA_PDF).wrap(0, 0)[1]
+        self._limpar()
+
+    def _limpar(self):
+        self.linhas, self.estilo, self.simples = [], [], True
+        self.inicio_grupo = None
+
+    def __len__(self):
+        return len(self.linhas)
+
+    def adicionar(self, linha):
+        self.linhas.append(linha)
+        self.simples = self.simples and all(isinstance(celula, str) for celula in linha)
+
+    def adicionar_faixa(self, texto, estilo, junto_da_anterior=False):
+        i = len(self.linhas)
+        self.adicionar([_celula_pdf(texto, sum(self.larguras))] + [''] * (len(self.larguras) - 1))
+        self.estilo += [('SPAN', (0, i), (-1, i)), ('FONT', (0, i), (-1, i), 'Helvetica-Bold', _TAMANHO_FONTE_PDF)]
+        self.estilo += [(comando, (0, i), (-1, i), *argumentos) for comando, *argumentos in estilo]
+        if junto_da_anterior and i > 0:
+            self.estilo.append(('NOSPLIT', (0, i - 1), (-1, i)))
+
+    def iniciar_grupo(self, rotulo):
+        self.inicio_grupo = len(self.linhas)
+        self.adicionar_faixa(rotulo, _ESTILO_GRUPO_PDF)
+
+    def tabela(self):
+        if self.inicio_grupo is not None:
+            ultima = min(self.inicio_grupo + 2, len(self.linhas) - 1)
+            self.estilo.append(('NOSPLIT', (0, self.inicio_grupo), (-1, ultima)))
+        tabela = Table(
+            self.linhas, colWidths=self.larguras,
+            rowHeights=[self.altura_linha] * len(self.linhas) if self.simples else None,
+            style=_ESTILO_TABELA_PDF + self.estilo,
+        )
+        self._limpar()
+        return tabela
+
+
+def _flowables_pdf(reservas, agrupar):
+    """
+    Gera o conteúdo do PDF sob demanda: tabelas de até LINHAS_POR_TABELA_PDF linhas e,
+    quando agrupado (por recurso ou por dia), um cabeçalho no início e um subtotal no fim
+    de cada grupo. As reservas são lidas do banco em lotes, como tuplas simples.
+    """
+    status_map = dict(Reserva.STATUS_CHOICES)
+    titulos, larguras = _colunas_pdf(agrupar)
+    largura_de = dict(zip(titulos, larguras))
+    largura_recurso = largura_de.get('Recurso')
+    largura_usuario, largura_motivo = largura_de['Usuário'], largura_de['Motivo']
+    # Recursos e usuários se repetem muito: a célula de cada um é montada uma única vez
+    celulas_recurso, celulas_usuario = {}, {}
+
+    # Por dia, a ordem padrão (mais recentes primeiro) já mantém cada grupo contíguo
+    if agrupar == 'recurso':
+        reservas = reservas.order_by('recurso__nome', 'recurso_id', '-data_hora_inicio')
+    linhas = reservas.values_list(
+        'id', 'recurso_id', 'recurso__nome', 'usuario__username', 'data_hora_inicio', 'data_hora_fim', 'motivo', 'status'
+    ).iterator(chunk_size=TAMANHO_LOTE)
+
+    bloco = _BlocoPdf(larguras)
+    grupo = rotulo_grupo = None
+    quantidade_grupo = total = 0
+    horas_grupo = horas_total = datetime.timedelta()
+
+    for id_reserva, recurso_id, recurso, usuario, inicio, fim, motivo, status in linhas:
+        if agrupar:
+            if agrupar == 'recurso':
+                chave, rotulo = recurso_id, f'Recurso: {recurso}'
+            else:
+                dia = timezone.localtime(inicio).date()
+                chave, rotulo = dia, f'Dia: {dia:%d/%m/%Y}'
+
+            if chave != grupo:
+                if grupo is not None:
+                    bloco.adicionar_faixa(_resumo(f'Subtotal ({rotulo_grupo})', quantidade_grupo, horas_grupo),
+                                          _ESTILO_SUBTOTAL_PDF, junto_da_anterior=True)
+                # O cabeçalho precisa das duas primeiras linhas do grupo na mesma tabela
+                if len(bloco) > LINHAS_POR_TABELA_PDF - 3:
+                    yield bloco.tabela()
+                bloco.iniciar_grupo(rotulo)
+                grupo, rotulo_grupo = chave, rotulo
+                quantidade_grupo, horas_grupo = 0, datetime.timedelta()
+
+        duracao = fim - inicio
+        linha = [str(id_reserva)]
+        if largura_recurso:
+            if recurso_id not in celulas_recurso:
+                celulas_recurso[recurso_id] = _celula_pdf(recurso, largura_recurso)
+            linha.append(celulas_recurso[recurso_id])
+        if usuario not in celulas_usuario:
+            celulas_usuario[usuario] = _celula_pdf(usuario, largura_usuario)
+        linha += [
+            celulas_usuario[usuario], _data_hora_pdf(inicio), _data_hora_pdf(fim), _duracao(duracao),
+            _celula_pdf(motivo, largura_motivo), status_map.get(status, status),
+        ]
+        bloco.adicionar(linha)
+
+        quantidade_grupo += 1
+        total += 1
+        horas_grupo += duracao
+        horas_total += duracao
+
+        if len(bloco) >= LINHAS_POR_TABELA_PDF:
+            yield bloco.tabela()
+
+    if agrupar and grupo is not None:
+        bloco.adicionar_faixa(_resumo(f'Subtotal ({rotulo_grupo})', quantidade_grupo, horas_grupo),
+                              _ESTILO_SUBTOTAL_PDF, junto_da_anterior=True)
+    bloco.adicionar_faixa(_resumo('Total', total, horas_total), _ESTILO_TOTAL_PDF, junto_da_anterior=True)
+    yield bloco.tabela()
+
+
+class _DocumentoEmPartes(BaseDocTemplate):
+    """
+    Documento do Platypus montado a partir de um gerador de flowables, sem ter a lista inteira.
+
+    Repete o laço do build(): cada passo entrega ao handle_flowable() a fila dos próximos
+    flowables, que desenha o primeiro (e, se ele não couber, devolve as partes à fila). A fila
+    é reabastecida do gerador antes de cada passo, mantendo alguns itens à frente para o
+    keepWithNext: só algumas tabelas ficam em memória por vez.
+    """
+
+    def montar(self, partes, a_frente=4):
+        self._startBuild()
+        self.canv._doctemplate = self
+        fila = []
+        try:
+            while True:
+                while len(fila) < a_frente and (parte := next(partes, None)) is not None:
+                    fila.append(parte)
+                if not fila:
+                    break
+                self.clean_hanging()
+                self.handle_flowable(fila)
+        finally:
+            del self.canv._doctemplate
+        self._endBuild()
+
+
+def gerar_pdf(reservas, destino, agrupar=None):
+    """
+    Gera o PDF das 'reservas' no arquivo 'destino', com as tabelas do Platypus (ReportLab).
+
+    - agrupar: None, 'recurso' ou 'dia'. Agrupa as linhas com cabeçalho e subtotal por grupo.
+    - O título, a data de geração, o número da página e os títulos das colunas são desenhados
+      em toda página pelo modelo de página. Assim as tabelas podem ser pequenas e independentes.
+    - As páginas são montadas uma a uma, conforme as reservas são lidas do banco.
+    """
+    titulos, larguras = _colunas_pdf(agrupar)
+    cabecalho = Table([titulos], colWidths=larguras, style=_ESTILO_TABELA_PDF + [
+        ('FONT', (0, 0), (-1, -1), 'Helvetica-Bold', _TAMANHO_FONTE_PDF),
+        ('BACKGROUND', (0, 0), (-1, -1), colors.HexColor('#d9d9d9')),
+    ])
+    largura_pagina, altura_pagina = landscape(A4)
+    _, altura_cabecalho = cabecalho.wrap(largura_pagina, altura_pagina)
+    topo_tabelas = altura_pagina - _MARGEM_PDF - 30 - altura_cabecalho
+    gerado_em = _data_hora_pdf(timezone.now())
+
+    def desenhar_pagina(p, documento):
+        p.saveState()
+        p.setFont('Helvetica-Bold', 14)
+        p.drawString(_MARGEM_PDF, altura_pagina - _MARGEM_PDF - 12, 'Relatório Geral de Reservas')
+        p.setFont(_FONTE_PDF, _TAMANHO_FONTE_PDF)
+        p.drawRightString(largura_pagina - _MARGEM_PDF, altura_pagina - _MARGEM_PDF - 12, f'Gerado em {gerado_em}')
+        p.drawRightString(largura_pagina - _MARGEM_PDF, _MARGEM_PDF / 2, f'Página {documento.page}')
+        cabecalho.drawOn(p, _MARGEM_PDF, topo_tabelas)
+        p.restoreState()
+
+    documento = _DocumentoEmPartes(destino, pagesize=landscape(A4), title='Relatório Geral de Reservas')
+    quadro = Frame(
+        _MARGEM_PDF, _MARGEM_PDF, largura_pagina - 2 * _MARGEM_PDF, topo_tabelas - _MARGEM_PDF,
+        leftPadding=0, rightPadding=0, topPadding=0, bottomPadding=0,
+    )
+    documento.addPageTemplates(PageTemplate(frames=[quadro], onPage=desenhar_pagina))
+    documento.montar(_flowables_pdf(reservas, agrupar))
+
+
+# Planilha em Streaming
+#
+# O .xlsx é um ZIP de arquivos XML. A planilha é escrita direto no ZIP, linha a linha, e os bytes
+# comprimidos são entregues (em blocos de TAMANHO_BLOCO_EXCEL) enquanto as próximas linhas ainda
+# são lidas do banco: o primeiro byte sai antes da primeira consulta, e a memória usada é a de um
+# lote mais um bloco. (O save() do OpenPyXL só monta o ZIP no fim, com a planilha inteira pronta.)
+# Sem seek() no destino, o zipfile grava o tamanho de cada parte depois dos dados (data
+# descriptor), formato que o Excel, o LibreOffice e o próprio OpenPyXL leem normalmente.
+
+# Bytes comprimidos acumulados antes de entregar um bloco
+TAMANHO_BLOCO_EXCEL = 64 * 1024
+
+_XML = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+_NS_PLANILHA = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+_NS_RELACOES = 'http://schemas.openxmlformats.org/package/2006/relationships'
+_NS_DOCUMENTO = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+_TIPO_OFFICE = 'application/vnd.openxmlformats-officedocument.spreadsheetml'
+
+# Partes fixas do pacote, escritas antes das linhas
+_PARTES_EXCEL = {
+    '[Content_Types].xml': (
+        f'{_XML}<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        f'<Override PartName="/xl/workbook.xml" ContentType="{_TIPO_OFFICE}.sheet.main+xml"/>'
+        f'<Override PartName="/xl/worksheets/sheet1.xml" ContentType="{_TIPO_OFFICE}.worksheet+xml"/>'
+        f'<Override PartName="/xl/styles.xml" ContentType="{_TIPO_OFFICE}.styles+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        f'{_XML}<Relationships xmlns="{_NS_RELACOES}">'
+        f'<Relationship Id="rId1" Type="{_NS_DOCUMENTO}/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        f'{_XML}<workbook xmlns="{_NS_PLANILHA}" xmlns:r="{_NS_DOCUMENTO}">'
+        '<sheets><sheet name="Reservas" sheetId="1" r:id="rId1"/></sheets></workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        f'{_XML}<Relationships xmlns="{_NS_RELACOES}">'
+        f'<Relationship Id="rId1" Type="{_NS_DOCUMENTO}/worksheet" Target="worksheets/sheet1.xml"/>'
+        f'<Relationship Id="rId2" Type="{_NS_DOCUMENTO}/styles" Target="styles.xml"/>'
+        '</Relationships>'
+    ),
+    # Estilos das células: 0 = padrão, 1 = cabeçalho (negrito), 2 = data e hora
+    'xl/styles.xml': (
+        f'{_XML}<styleSheet xmlns="{_NS_PLANILHA}">'
+        '<numFmts count="1"><numFmt numFmtId="164" formatCode="dd/mm/yyyy hh:mm"/></numFmts>'
+        '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+        '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+        '<fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="3"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/>'
+        '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>'
+    ),
+}
+_ESTILO_CABECALHO = 1
+_ESTILO_DATA_HORA = 2
+
+
+class _SaidaEmBlocos:
+    """Destino do ZipFile (sem seek()): acumula os bytes escritos até serem retirados."""
+
+    def __init__(self):
+        self._partes = []
+        self._tamanho = 0
+
+    def write(self, dados):
+        self._partes.append(bytes(dados))
+        self._tamanho += len(dados)
+        return len(dados)
+
+    def flush(self):
+        pass
+
+    def retirar(self, minimo=1):
+        """Os bytes acumulados, se já forem pelo menos 'minimo'; senão, b''."""
+        if self._tamanho < minimo:
+            return b''
+        bloco = b''.join(self._partes)
+        self._partes, self._tamanho = [], 0
+        return bloco
+
+
+def _texto(valor):
+    # Caracteres de controle não são permitidos no XML da planilha
+    return ILLEGAL_CHARACTERS_RE.sub('', valor)
+
+
+def _celula(coluna, linha, valor, estilo=0):
+    """XML de uma célula; None vira célula vazia (omitida)."""
+    if valor is None:
+        return ''
+    referencia = f'{get_column_letter(coluna)}{linha}'
+    atributo_estilo = f' s="{estilo}"' if estilo else ''
+    if isinstance(valor, str):
+        texto = escape(_texto(valor))
+        return f'<c r="{referencia}" t="inlineStr"{atributo_estilo}><is><t xml:space="preserve">{texto}</t></is></c>'
+    if isinstance(valor, datetime.datetime):
+        # O Excel não tem fuso horário: grava o horário local, como aparece no sistema
+        valor = to_excel(timezone.localtime(valor).replace(tzinfo=None))
+        atributo_estilo = f' s="{_ESTILO_DATA_HORA}"'
+    return f'<c r="{referencia}"{atributo_estilo}><v>{valor!r}</v></c>'
+
+
+def _linha_excel(numero, valores, estilo=0):
+    celulas = ''.join(_celula(coluna, numero, valor, estilo) for coluna, valor in enumerate(valores, start=1))
+    return f'<row r="{numero}">{celulas}</row>'.encode()
+
+
+def gerar_excel(reservas):
+    """
+    Gera a planilha (.xlsx) das 'reservas' como uma sequência de blocos de bytes.
+
+    As reservas são lidas do banco em lotes (iterator), como tuplas simples, sem instanciar
+    um objeto Reserva por linha, e cada linha vai direto para o ZIP comprimido: um bloco é
+    entregue assim que junta TAMANHO_BLOCO_EXCEL bytes, sem esperar o relatório inteiro.
+    """
+    status_map = dict(Reserva.STATUS_CHOICES)
+    saida = _SaidaEmBlocos()
+
+    with zipfile.ZipFile(saida, 'w', compression=zipfile.ZIP_DEFLATED) as pacote:
+        for nome, conteudo in _PARTES_EXCEL.items():
+            pacote.writestr(nome, conteudo)
+        # O cliente já recebe o início do arquivo antes da primeira consulta
+        yield saida.retirar()
+
+        with pacote.open('xl/worksheets/sheet1.xml', 'w') as planilha:
+            larguras = ''.join(
+                f'<col min="{coluna}" max="{coluna}" width="{largura}" customWidth="1"/>'
+                for coluna, largura in enumerate(LARGURAS_EXCEL, start=1)
+            )
+            planilha.write(f'{_XML}<worksheet xmlns="{_NS_PLANILHA}"><cols>{larguras}</cols><sheetData>'.encode())
+            planilha.write(_linha_excel(1, COLUNAS_EXCEL, _ESTILO_CABECALHO))
+
+            linhas = reservas.values_list(
+                'id', 'recurso__nome', 'usuario__username', 'data_hora_inicio', 'data_hora_fim', 'motivo', 'status'
+            ).iterator(chunk_size=TAMANHO_LOTE)
+            for numero, (id_reserva, recurso, usuario, inicio, fim, motivo, status) in enumerate(linhas, start=2):
+                planilha.write(_linha_excel(
+                    numero, [id_reserva, recurso, usuario, inicio, fim, motivo, status_map.get(status, status)]
+                ))
+                if bloco := saida.retirar(TAMANHO_BLOCO_EXCEL):
+                    yield bloco
+
+            planilha.write(b'</sheetData></worksheet>')
+
+    if bloco := saida.retirar():
+        yield bloco
+
+
+def resposta_excel(request, reservas, nome_arquivo='reservas_relatorio.xlsx'):
+    """Devolve a planilha em streaming: cada bloco sai assim que é comprimido (memória limitada)."""
+    return resposta_em_blocos(request, gerar_excel(reservas), CONTENT_TYPE_EXCEL, nome_arquivo)
+
+
+def resposta_em_blocos(request, blocos, content_type, nome_arquivo):
+    """
+    Envia os 'blocos' (gerador síncrono de bytes) via StreamingHttpResponse.
+
+    No Daphne (ASGI), um iterador síncrono seria lido INTEIRO para a memória antes do envio.
+    Por isso o gerador é avançado bloco a bloco com sync_to_async: o event loop continua livre
+    entre um bloco e outro, e cada passo roda na mesma thread da View (mesma conexão com o banco).
+    Em servidores WSGI (e no cliente de testes), o próprio gerador síncrono é usado.
+    """
+    if isinstance(request, ASGIRequest):
+        blocos = _blocos_async(blocos)
+
+    response = StreamingHttpResponse(blocos, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{nome_arquivo}"'
+    return response
+
+
+async def _blocos_async(blocos):
+    proximo = sync_to_async(next)
+    try:
+        while (bloco := await proximo(blocos, None)) is not None:
+            yield bloco
+    finally:
+        # Cliente desconectou (ou terminou): libera o cursor do banco ainda na thread da View
+        await sync_to_async(blocos.close)()
+
+
+# Relatórios em segundo plano
+
+def etiquetas_relatorio(usuario, filtros):
+    """
+    Etiquetas do cache compartilhado (reservas/cache.py) das quais o relatório depende: as
+    reservas do aluno; para Admins, as do recurso filtrado, as dos dias do período ou, sem
+    nenhum dos dois, a agenda inteira. 'recursos' cobre a troca de nome de uma sala.
+    """
+    etiquetas = ['recursos']
+    if not usuario.is_staff:
+        etiquetas.append(cache.etiqueta_usuario(usuario.pk))
+    elif filtros.get('recurso'):
+        etiquetas.append(cache.etiqueta_recurso(filtros['recurso']))
+    elif filtros.get('inicio') and filtros.get('fim'):
+        etiquetas += cache.etiquetas_periodo(filtros['inicio'], filtros['fim'])
+    else:
+        etiquetas.append('agenda')
+    return etiquetas
+
+
+def chave_relatorio(usuario, formato, filtros):
+    """
+    Chave de cache de um relatório: (escopo do usuário, formato, filtros, versões das etiquetas
+    dos dados filtrados). Admins compartilham o mesmo escopo (todos veem as mesmas reservas);
+    alunos, apenas o seu. Uma reserva de outra sala (ou de outro período) não muda a chave.
+
+    'filtros' é o dado serializado de um FiltrosRelatorioSerializer (como em RelatorioJob.filtros).
+    """
+    validados = FiltrosRelatorioSerializer(data=filtros)
+    validados.is_valid(raise_exception=True)
+    versao = cache.assinatura(etiquetas_relatorio(usuario, validados.validated_data))
+    escopo = 'todos' if usuario.is_staff else f'usuario:{usuario.pk}'
+    conteudo = json.dumps({
+        'escopo': escopo,
+        'formato': formato,
+        'filtros': filtros,
+        # Sem o cache, uma versão única: o arquivo não é reaproveitado
+        'versao': versao or uuid.uuid4().hex,
+    }, sort_keys=True)
+    return hashlib.sha256(conteudo.encode()).hexdigest()
+
+
+def processar_relatorio(job_id):
+    """
+    Renderiza o relatório de um RelatorioJob (roda no pool de tarefas, fora da requisição),
+    grava o arquivo em MEDIA_ROOT/relatorios/ e avisa quem acompanha pelo WebSocket.
+
+    A chave é recalculada aqui, ANTES de as reservas serem lidas: uma alteração feita depois
+    disso troca a versão das etiquetas (na hora e após o commit), então o arquivo nunca fica
+    guardado sob uma chave mais nova que o seu conteúdo. (Uma transação em volta da leitura
+    daria um snapshot, mas no SQLite com IMMEDIATE ela travaria as escritas durante a renderização.)
+    """
+    job = RelatorioJob.objects.select_related('usuario').get(pk=job_id)
+    job.status = 'E'
+
+    try:
+        job.chave = chave_relatorio(job.usuario, job.formato, job.filtros)
+        job.save(update_fields=['status', 'chave'])
+        filtros = FiltrosRelatorioSerializer(data=job.filtros)
+        filtros.is_valid(raise_exception=True)
+        reservas = reservas_do_relatorio(job.usuario, filtros.validated_data)
+
+        with tempfile.TemporaryFile() as arquivo:
+            if job.formato == 'pdf':
+                gerar_pdf(reservas, arquivo, agrupar=filtros.validated_data.get('agrupar'))
+            else:
+                for bloco in gerar_excel(reservas):
+                    arquivo.write(bloco)
+            arquivo.seek(0)
+            job.arquivo.save(f'{job.chave}.{job.formato}', File(arquivo), save=False)
+
+        job.status = 'C'
+    except Exception as e:
+        job.status = 'F'
+        job.erro = str(e)
+        raise
+    finally:
+        job.concluido_em = timezone.now()
+        job.save(update_fields=['status', 'arquivo', 'erro', 'concluido_em'])
+        notificar_relatorio(job)
+
+
+def notificar_relatorio(job):
+    """Envia o novo status para o grupo WebSocket do relatório (veja NotificacaoConsumer)."""
+    eventos.publicar(
+        f"relatorio_{job.pk}",
+        {
+            "type": "relatorio_atualizado",
+            "relatorio": str(job.pk),
+            "status": job.status,
+        }
+    )
@@ -1,8 +1,12 @@
+import datetime
+
+from django.utils import timezone
 from rest_framework import serializers
-from .models import Recurso, Reserva, CodigoConvite
+from .models import Recurso, Reserva, CodigoConvite, RelatorioJob
 from django.core.exceptions import ValidationError as DjangoValidationError
 from django.contrib.auth.models import User
 from django.contrib.auth.password_validation import validate_password 
+from django.urls import reverse
 
 class RecursoSerializer(serializers.ModelSerializer):
     """
@@ -29,27 +33,233 @@ class ReservaSerializer(serializers.ModelSerializer):
     def validate(self, data):
         """
         Validação Centralizada:
-        Ao invés de reescrever a lógica de conflito de horários aqui, instanciamos o modelo
-        e chamamos o método .clean().
+        Ao invés de reescrever as regras de horário aqui, instanciamos o modelo
+        e chamamos as validações dele.
         
         Isso garante o princípio DRY (Don't Repeat Yourself), mantendo a regra de negócio
         exclusivamente no Model (models.py), servindo tanto para o Admin do Django quanto para a API.
+
+        Aqui rodam só as regras que não consultam o banco (Model.validar_horario). A verificação de
+        conflito roda UMA única vez, no save() do Model, já sob o lock do Recurso.
         """
-        # Cria uma instância temporária com os dados recebidos (sem salvar no banco ainda)
+        # Cria uma instância temporária com os dados recebidos (sem salvar no banco ainda).
+        # Em edições (PUT/PATCH), campos não enviados vêm da reserva original.
         instance = Reserva(**data)
+        if self.instance is not None:
+            instance.pk = self.instance.pk
+            for campo in ('data_hora_inicio', 'data_hora_fim'):
+                if campo not in data:
+                    setattr(instance, campo, getattr(self.instance, campo))
         
         try:
-            instance.clean() # Dispara a verificação de conflito de horário definida no Model
+            instance.validar_horario()
         except DjangoValidationError as e:
-            # Converte o erro do Model (Django puro) para um erro de API (DRF JSON)
-            # Isso garante que o Frontend receba um erro 400 legível
-            if hasattr(e, 'message_dict'):
-                raise serializers.ValidationError(e.message_dict)
-            else:
-                raise serializers.ValidationError(e.messages)
+            raise self._erro_api(e)
         
         return data
 
+    def create(self, validated_data):
+        # A verificação de conflito acontece no save() do Model, sob lock do Recurso.
+        # Se o horário estiver ocupado (ou outra requisição simultânea ganhou a corrida), o erro chega aqui.
+        try:
+            return super().create(validated_data)
+        except DjangoValidationError as e:
+            raise self._erro_api(e)
+
+    def update(self, instance, validated_data):
+        try:
+            return super().update(instance, validated_data)
+        except DjangoValidationError as e:
+            raise self._erro_api(e)
+
+    @staticmethod
+    def _erro_api(e):
+        """
+        Converte o erro do Model (Django puro) para um erro de API (DRF JSON).
+        Isso garante que o Frontend receba um erro 400 legível.
+        """
+        if hasattr(e, 'message_dict'):
+            return serializers.ValidationError(e.message_dict)
+        return serializers.ValidationError(e.messages)
+
+
+class OcorrenciaSerializer(serializers.Serializer):
+    data_hora_inicio = serializers.DateTimeField()
+    data_hora_fim = serializers.DateTimeField()
+
+
+class RecorrenciaSerializer(serializers.Serializer):
+    """
+    Regra de repetição no estilo RRULE (iCalendar), a partir da primeira ocorrência:
+    - frequencia: 'diaria' ou 'semanal' (FREQ).
+    - intervalo: a cada quantos dias/semanas (INTERVAL).
+    - dias_semana: na frequência semanal, dias da semana (0 = segunda ... 6 = domingo; BYDAY).
+      Padrão: o dia da semana da primeira ocorrência.
+    - ate (UNTIL, data inclusiva) OU contagem (COUNT).
+    """
+    frequencia = serializers.ChoiceField(choices=['diaria', 'semanal'], default='semanal')
+    intervalo = serializers.IntegerField(min_value=1, max_value=52, default=1)
+    dias_semana = serializers.ListField(
+        child=serializers.IntegerField(min_value=0, max_value=6), required=False, allow_empty=False
+    )
+    ate = serializers.DateField(required=False)
+    contagem = serializers.IntegerField(min_value=1, required=False)
+
+    def validate(self, data):
+        if ('ate' in data) == ('contagem' in data):
+            raise serializers.ValidationError("Informe 'ate' ou 'contagem' (apenas um deles).")
+        if 'dias_semana' in data and data['frequencia'] != 'semanal':
+            raise serializers.ValidationError({"dias_semana": "Apenas na frequência semanal."})
+        return data
+
+    @staticmethod
+    def horarios(inicio, fim, regra, limite):
+        """
+        Expande a regra em [(inicio, fim), ...], mantendo o horário local da primeira ocorrência
+        (uma aula às 8h continua às 8h depois de uma mudança de horário de verão).
+        Para ao atingir 'limite' + 1 ocorrências: quem chama rejeita o excesso.
+        """
+        inicio_local, duracao = timezone.localtime(inicio), fim - inicio
+        primeiro_dia = inicio_local.date()
+        if regra['frequencia'] == 'diaria':
+            passo, dias_semana = datetime.timedelta(days=regra['intervalo']), None
+        else:
+            passo = datetime.timedelta(weeks=regra['intervalo'])
+            dias_semana = sorted(set(regra.get('dias_semana') or [primeiro_dia.weekday()]))
+        ultimo_dia = regra.get('ate')
+        maximo = min(regra.get('contagem', limite + 1), limite + 1)
+
+        horarios = []
+        # Semanal: percorre as semanas a partir da segunda-feira da primeira ocorrência
+        periodo = primeiro_dia if dias_semana is None else primeiro_dia - datetime.timedelta(days=primeiro_dia.weekday())
+        while len(horarios) < maximo:
+            dias = [periodo] if dias_semana is None else [periodo + datetime.timedelta(days=d) for d in dias_semana]
+            for dia in dias:
+                if ultimo_dia and dia > ultimo_dia:
+                    return horarios
+                if dia < primeiro_dia or len(horarios) >= maximo:
+                    continue
+                ocorrencia = timezone.make_aware(datetime.datetime.combine(dia, inicio_local.time()))
+                horarios.append((ocorrencia, ocorrencia + duracao))
+            periodo += passo
+        return horarios
+
+
+class ReservaLoteSerializer(serializers.Serializer):
+    """
+    Pedido de várias reservas do mesmo recurso de uma vez (ex: toda terça do semestre).
+    As ocorrências vêm de uma regra ('recorrencia', a partir de data_hora_inicio/data_hora_fim)
+    OU de uma lista explícita ('ocorrencias'). Com 'ignorar_conflitos', grava as ocorrências livres
+    e apenas informa as demais; sem ele, qualquer conflito cancela o pedido inteiro.
+    """
+    MAXIMO_OCORRENCIAS = 200
+
+    recurso = serializers.PrimaryKeyRelatedField(queryset=Recurso.objects.all())
+    motivo = serializers.CharField(max_length=255)
+    data_hora_inicio = serializers.DateTimeField(required=False)
+    data_hora_fim = serializers.DateTimeField(required=False)
+    recorrencia = RecorrenciaSerializer(required=False)
+    ocorrencias = OcorrenciaSerializer(many=True, required=False, allow_empty=False)
+    ignorar_conflitos = serializers.BooleanField(default=False)
+
+    def validate(self, data):
+        if ('recorrencia' in data) == ('ocorrencias' in data):
+            raise serializers.ValidationError("Informe 'recorrencia' ou 'ocorrencias' (apenas um deles).")
+
+        if 'recorrencia' in data:
+            if not data.get('data_hora_inicio') or not data.get('data_hora_fim'):
+                raise serializers.ValidationError("A recorrência parte de 'data_hora_inicio' e 'data_hora_fim'.")
+            horarios = RecorrenciaSerializer.horarios(
+                data['data_hora_inicio'], data['data_hora_fim'], data['recorrencia'], self.MAXIMO_OCORRENCIAS
+            )
+        else:
+            horarios = [(o['data_hora_inicio'], o['data_hora_fim']) for o in data['ocorrencias']]
+
+        if len(horarios) > self.MAXIMO_OCORRENCIAS:
+            raise serializers.ValidationError(f"No máximo {self.MAXIMO_OCORRENCIAS} ocorrências por pedido.")
+        if not horarios:
+            raise serializers.ValidationError("A regra não gerou nenhuma ocorrência.")
+        data['horarios'] = horarios
+        return data
+
+
+class DecisaoLoteSerializer(serializers.Serializer):
+    """Aprovação/rejeição em lote: IDs das reservas pendentes e a ação."""
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=5000)
+    acao = serializers.ChoiceField(choices=['aprovar', 'rejeitar'])
+
+
+class ReservaCalendarioSerializer(serializers.ModelSerializer):
+    """
+    Representação enxuta de uma Reserva, já no formato de Evento do FullCalendar.
+    Usada pelo feed do calendário: envia apenas o necessário para desenhar o evento.
+    """
+    title = serializers.SerializerMethodField()
+    start = serializers.DateTimeField(source='data_hora_inicio', read_only=True)
+    end = serializers.DateTimeField(source='data_hora_fim', read_only=True)
+    recurso = serializers.IntegerField(source='recurso_id', read_only=True)
+
+    class Meta:
+        model = Reserva
+        fields = ['id', 'title', 'start', 'end', 'recurso', 'status']
+
+    def get_title(self, obj):
+        return f"{obj.recurso.nome} - {obj.motivo}"
+
+
+class FiltrosRelatorioSerializer(serializers.Serializer):
+    """
+    Filtros opcionais dos relatórios (parâmetros de URL ou corpo de um RelatorioJob).
+    - inicio / fim: apenas reservas que intersectam o período (ISO 8601).
+    - recurso: ID do recurso.
+    - status: uma ou mais letras separadas por vírgula (ex: C,P).
+    - agrupar: 'recurso' ou 'dia', com subtotais por grupo (apenas no PDF).
+    """
+    inicio = serializers.DateTimeField(required=False)
+    fim = serializers.DateTimeField(required=False)
+    recurso = serializers.IntegerField(required=False, min_value=1)
+    status = serializers.CharField(required=False)
+    agrupar = serializers.ChoiceField(choices=['recurso', 'dia'], required=False)
+
+    def validate_status(self, value):
+        validos = dict(Reserva.STATUS_CHOICES)
+        status = {s.strip().upper() for s in value.split(',') if s.strip()}
+        if not status or any(s not in validos for s in status):
+            raise serializers.ValidationError(f"Use apenas: {', '.join(validos)}.")
+        # Forma canônica (ordenada): os mesmos filtros sempre geram a mesma chave de cache
+        return ','.join(sorted(status))
+
+    def validate(self, data):
+        if data.get('inicio') and data.get('fim') and data['inicio'] >= data['fim']:
+            raise serializers.ValidationError({"fim": "O fim deve ser posterior ao início."})
+        return data
+
+
+class RelatorioJobSerializer(serializers.ModelSerializer):
+    """Pedido de relatório em segundo plano: o cliente envia formato e filtros e acompanha o status."""
+    filtros = serializers.JSONField(required=False, default=dict)
+    download = serializers.SerializerMethodField()
+
+    class Meta:
+        model = RelatorioJob
+        fields = ['id', 'formato', 'filtros', 'status', 'erro', 'criado_em', 'concluido_em', 'download']
+        read_only_fields = ['id', 'status', 'erro', 'criado_em', 'concluido_em']
+
+    def validate_filtros(self, value):
+        if not isinstance(value, dict):
+            raise serializers.ValidationError("Os filtros devem ser um objeto JSON.")
+        filtros = FiltrosRelatorioSerializer(data=value)
+        filtros.is_valid(raise_exception=True)
+        # Guarda a versão serializada (datas em ISO 8601), normalizada para compor a chave de cache
+        return filtros.data
+
+    def get_download(self, obj):
+        if obj.status != 'C':
+            return None
+        request = self.context.get('request')
+        url = reverse('relatorio-download', args=[obj.pk])
+        return request.build_absolute_uri(url) if request else url
+
 
 class UserSerializer(serializers.ModelSerializer):
     """
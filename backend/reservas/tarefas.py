@@ -0,0 +1,92 @@
+"""
+Execução de tarefas demoradas fora do ciclo da requisição.
+
+Pools de threads do próprio processo (sem broker externo): a View apenas registra o pedido
+e responde na hora; o trabalho pesado (ex: renderizar um relatório) roda em segundo plano.
+Cada fila tem o seu pool, para que um envio de e-mails preso no SMTP não ocupe as threads
+que renderizam relatórios (e vice-versa).
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+logger = logging.getLogger(__name__)
+
+# Fila -> configuração com o número de threads do seu pool
+FILAS = {'tarefas': 'TAREFAS_WORKERS', 'emails': 'EMAIL_FILA_WORKERS'}
+
+_pools = {}
+_agendadas = {}   # função -> (instante de execução, Timer)
+_trava = threading.Lock()
+
+
+def _obter_pool(fila):
+    # Criado sob demanda: comandos de manage.py que nunca agendam tarefas não abrem threads
+    with _trava:
+        if fila not in _pools:
+            _pools[fila] = ThreadPoolExecutor(
+                max_workers=getattr(settings, FILAS[fila], 2),
+                thread_name_prefix=fila,
+            )
+        return _pools[fila]
+
+
+def executar_em_segundo_plano(funcao, *args, fila='tarefas'):
+    """
+    Agenda 'funcao(*args)' no pool da 'fila', somente APÓS o commit da transação atual
+    (assim a tarefa já enxerga no banco o que a requisição acabou de gravar).
+
+    Com TAREFAS_SINCRONAS = True (testes), a função roda na própria thread, logo após o commit.
+    """
+    def disparar():
+        if getattr(settings, 'TAREFAS_SINCRONAS', False):
+            funcao(*args)
+        else:
+            _obter_pool(fila).submit(_executar, funcao, *args)
+
+    transaction.on_commit(disparar)
+
+
+def agendar(funcao, atraso, fila='tarefas'):
+    """
+    Executa 'funcao()' no pool da 'fila' daqui a 'atraso' segundos. Guarda um único agendamento
+    por função: se já houver um para antes, este é ignorado; se for para depois, é substituído.
+
+    O agendamento vive só neste processo (perde-se ao reiniciar); quem precisa de garantia também
+    tem um comando com --continuo. Com TAREFAS_SINCRONAS = True (testes), nada é agendado.
+    """
+    if getattr(settings, 'TAREFAS_SINCRONAS', False):
+        return
+    quando = time.monotonic() + atraso
+    with _trava:
+        atual = _agendadas.get(funcao)
+        if atual and atual[0] <= quando:
+            return
+        if atual:
+            atual[1].cancel()
+        timer = threading.Timer(max(atraso, 0), _disparar_agendada, (funcao, fila))
+        timer.daemon = True
+        _agendadas[funcao] = (quando, timer)
+        timer.start()
+
+
+def _disparar_agendada(funcao, fila):
+    with _trava:
+        if _agendadas.get(funcao, (None, None))[1] is threading.current_thread():
+            del _agendadas[funcao]
+    _obter_pool(fila).submit(_executar, funcao)
+
+
+def _executar(funcao, *args):
+    close_old_connections()
+    try:
+        funcao(*args)
+    except Exception:
+        logger.exception("Falha na tarefa em segundo plano %s", funcao.__name__)
+    finally:
+        # Cada thread do pool tem a sua conexão com o banco: devolve-a ao terminar
+        connection.close()
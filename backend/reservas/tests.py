@@ -1,3 +1,2066 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import importlib.util
+import io
+import json
+import os
+import queue
+import re
+import runpy
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import Group, User
+from django.core import mail
+from django.core.management import call_command
+from django.core.cache import caches
+from django.core.cache.backends.redis import RedisCache
+from django.db import OperationalError, connection
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import AsyncClient, Client, RequestFactory, TestCase, TransactionTestCase
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from asgiref.sync import sync_to_async
+from channels.layers import ChannelLayerManager
+from channels.testing import WebsocketCommunicator
+from django.utils import timezone
+from django.utils.module_loading import import_string
+import openpyxl
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from . import autenticacao, cache, emails, eventos, limites, relatorios, tarefas
+from .consumers import NotificacaoConsumer
+from .models import (
+    ContadorVersao, EmailPendente, EstatisticaReserva, EventoAgenda, OcupacaoDia, Recurso, RelatorioJob, Reserva,
+    ValidadeToken,
+)
+
+
+@override_settings(TAREFAS_SINCRONAS=True)
+class ReservasTestCase(TestCase):
+    """
+    Base comum dos testes: um aluno, um admin, duas salas e um cliente autenticado por Token.
+    As datas partem de 'amanhã às 08:00' para não esbarrar na regra de retroatividade.
+    Tarefas em segundo plano (ex: envio da fila de e-mails) rodam na própria thread, após o commit.
+    """
+
+    def setUp(self):
+        # Os caches sobrevivem ao rollback de cada teste
+        caches['default'].clear()
+        autenticacao.cache_tokens.limpar()
+        self.aluno = User.objects.create_user('aluno', 'aluno@teste.com', 'senha-forte-123')
+        self.admin = User.objects.create_user('admin', 'admin@teste.com', 'senha-forte-123', is_staff=True)
+        self.sala = Recurso.objects.create(nome='Lab 1', capacidade_maxima=30)
+        self.auditorio = Recurso.objects.create(nome='Auditório', capacidade_maxima=200)
+
+        amanha = timezone.localtime() + datetime.timedelta(days=1)
+        self.base = amanha.replace(hour=8, minute=0, second=0, microsecond=0)
+
+        self.client = APIClient()
+        self.autenticar(self.aluno)
+
+    def autenticar(self, user):
+        token, _ = Token.objects.get_or_create(user=user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def horario(self, dias=0, horas=0):
+        return self.base + datetime.timedelta(days=dias, hours=horas)
+
+    def criar_reserva(self, recurso=None, usuario=None, dias=0, inicio=0, duracao=1, status='C', motivo='Aula'):
+        return Reserva.objects.create(
+            recurso=recurso or self.sala,
+            usuario=usuario or self.aluno,
+            data_hora_inicio=self.horario(dias, inicio),
+            data_hora_fim=self.horario(dias, inicio + duracao),
+            motivo=motivo,
+            status=status,
+        )
+
+
+class CalendarioFeedTests(ReservasTestCase):
+    url = '/reservas/api/reservas/calendario/'
+
+    def test_retorna_somente_reservas_da_janela(self):
+        dentro = self.criar_reserva(dias=1)
+        self.criar_reserva(dias=10)
+        self.criar_reserva(dias=1, inicio=2, status='R')
+
+        resposta = self.client.get(self.url, {
+            'start': self.horario(0).isoformat(),
+            'end': self.horario(3).isoformat(),
+        })
+
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual([e['id'] for e in resposta.data['results']], [dentro.id])
+        evento = resposta.data['results'][0]
+        self.assertEqual(evento['title'], 'Lab 1 - Aula')
+        self.assertEqual(set(evento), {'id', 'title', 'start', 'end', 'recurso', 'status'})
+
+    def test_filtra_por_recurso(self):
+        self.criar_reserva(dias=1)
+        auditorio = self.criar_reserva(recurso=self.auditorio, dias=1)
+
+        resposta = self.client.get(self.url, {
+            'start': self.horario(0).isoformat(),
+            'end': self.horario(3).isoformat(),
+            'recurso': self.auditorio.id,
+        })
+
+        self.assertEqual([e['id'] for e in resposta.data['results']], [auditorio.id])
+
+    def test_pagina_por_cursor_em_ordem_cronologica(self):
+        ids = [self.criar_reserva(dias=1, inicio=h).id for h in range(5)]
+
+        resposta = self.client.get(self.url, {
+            'start': self.horario(0).isoformat(),
+            'end': self.horario(3).isoformat(),
+            'page_size': 2,
+        })
+        vistos = [e['id'] for e in resposta.data['results']]
+        while resposta.data['next']:
+            resposta = self.client.get(resposta.data['next'])
+            vistos += [e['id'] for e in resposta.data['results']]
+
+        self.assertEqual(vistos, ids)
+
+    def test_janela_obrigatoria(self):
+        resposta = self.client.get(self.url, {'start': self.horario(0).isoformat()})
+        self.assertEqual(resposta.status_code, 400)
+
+
+class ConsultasPorEscritaTests(ReservasTestCase):
+    """
+    Fixa o número de comandos SQL por escrita na API, para que regressões (consulta de
+    conflito duplicada, FK revalidada, relação carregada preguiçosamente) quebrem o teste.
+    SAVEPOINT/RELEASE (artefato do TestCase) não entram na conta.
+
+    O que roda após o commit (log de eventos, envio da fila de e-mails) também é executado na
+    própria requisição: entra na conta, separado em 'apos_commit'.
+    """
+    url = '/reservas/api/reservas/'
+
+    def setUp(self):
+        super().setUp()
+        # Contador que serializa as gravações do log de eventos já existe (como em produção)
+        ContadorVersao.objects.create(nome='eventos_log')
+
+    def payload(self, **extra):
+        return {
+            'recurso': self.sala.id,
+            'data_hora_inicio': self.horario(1).isoformat(),
+            'data_hora_fim': self.horario(1, 1).isoformat(),
+            'motivo': 'Aula',
+            **extra,
+        }
+
+    def executar(self, requisicao):
+        with CaptureQueriesContext(connection) as contexto, self.captureOnCommitCallbacks() as callbacks:
+            resposta = requisicao()
+        with CaptureQueriesContext(connection) as depois, self.captureOnCommitCallbacks(execute=True):
+            for callback in callbacks:
+                callback()
+        consultas, self.apos_commit = (
+            [q['sql'] for q in capturadas.captured_queries if 'SAVEPOINT' not in q['sql']]
+            for capturadas in (contexto, depois)
+        )
+        conflito = [sql for sql in consultas if sql.startswith('SELECT') and '"reservas_reserva"."data_hora_fim" >' in sql]
+        return resposta, consultas, conflito
+
+    def test_criacao(self):
+        resposta, consultas, conflito = self.executar(lambda: self.client.post(self.url, self.payload(), format='json'))
+
+        self.assertEqual(resposta.status_code, 201)
+        # Token+User, Recurso (serializer), lock do Recurso, conflito, INSERT, versão da agenda,
+        # ocupação por hora (INSERT OR IGNORE + UPDATE), estatísticas (UPSERT), INSERT na fila de e-mails.
+        self.assertEqual(len(consultas), 10, consultas)
+        # Após o commit, ainda na requisição: trava do log de eventos (UPDATE do contador), INSERT no
+        # log (todos os tópicos de uma vez) e o envio da fila de e-mails: reserva do lote (SELECT +
+        # UPDATE), leitura do lote, UPDATE para enviado, SELECT do próximo lote (vazio) e SELECT da
+        # próxima nova tentativa
+        self.assertEqual(len(self.apos_commit), 8, self.apos_commit)
+        self.assertEqual(len(consultas) + len(self.apos_commit), 18)
+        self.assertFalse([sql for sql in consultas if 'reservas_eventoagenda' in sql])
+        self.assertEqual(len(conflito), 1)
+
+    def test_criacao_com_conflito(self):
+        self.criar_reserva(usuario=self.admin, dias=1)
+
+        resposta, consultas, conflito = self.executar(lambda: self.client.post(self.url, self.payload(), format='json'))
+
+        self.assertEqual(resposta.status_code, 400)
+        self.assertIn('admin', str(resposta.data))
+        # Token+User, Recurso, lock, conflito (já com o usuário via JOIN); nada após o commit
+        self.assertEqual(len(consultas), 4, consultas)
+        self.assertEqual(self.apos_commit, [])
+        self.assertEqual(len(conflito), 1)
+
+    def test_edicao(self):
+        reserva = self.criar_reserva(dias=1)
+
+        resposta, consultas, conflito = self.executar(
+            lambda: self.client.patch(f'{self.url}{reserva.id}/', {'motivo': 'Prova'}, format='json')
+        )
+
+        self.assertEqual(resposta.status_code, 200)
+        # Token+User, Reserva (com Recurso e Usuário), lock, conflito, UPDATE, versão da agenda
+        # (só o motivo mudou: estatísticas intactas)
+        self.assertEqual(len(consultas), 6, consultas)
+        # Após o commit: trava do log de eventos e INSERT no log
+        self.assertEqual(len(self.apos_commit), 2, self.apos_commit)
+        self.assertEqual(len(consultas) + len(self.apos_commit), 8)
+        self.assertEqual(len(conflito), 1)
+
+
+class ListagensSemN1Tests(ReservasTestCase):
+    """
+    As listagens devem carregar Recurso/Usuário em lote: o número de consultas
+    precisa ser o mesmo com 2 ou com 20 reservas (sem o padrão N+1).
+    """
+
+    def popular(self, quantidade):
+        # Metade das reservas é do aluno logado (meus_agendamentos), metade de outros usuários
+        for i in range(quantidade):
+            usuario = self.aluno if i % 2 else User.objects.create_user(f'usuario{Reserva.objects.count()}')
+            recurso = Recurso.objects.create(nome=f'Sala {Recurso.objects.count()}')
+            self.criar_reserva(recurso=recurso, usuario=usuario, dias=i)
+
+    def assertConsultasConstantes(self, requisicao):
+        def executar():
+            resposta = requisicao()
+            self.assertEqual(resposta.status_code, 200)
+            if resposta.streaming:
+                # As consultas de um relatório em streaming só rodam quando o conteúdo é lido
+                b''.join(resposta.streaming_content)
+
+        # Aquecimento: a primeira requisição guarda o token no cache (TokenAuthenticationEmCache)
+        executar()
+        self.popular(2)
+        with CaptureQueriesContext(connection) as poucas:
+            executar()
+        self.popular(18)
+        with CaptureQueriesContext(connection) as muitas:
+            executar()
+        self.assertEqual(len(poucas), len(muitas), [q['sql'] for q in muitas.captured_queries])
+
+    def test_listagem(self):
+        self.assertConsultasConstantes(lambda: self.client.get('/reservas/api/reservas/'))
+
+    def test_meus_agendamentos(self):
+        self.assertConsultasConstantes(lambda: self.client.get('/reservas/api/reservas/meus_agendamentos/'))
+
+    def test_relatorio_pdf(self):
+        self.autenticar(self.admin)
+        self.assertConsultasConstantes(lambda: self.client.get('/reservas/api/reservas/relatorio_pdf/'))
+
+    def test_relatorio_excel(self):
+        self.autenticar(self.admin)
+        self.assertConsultasConstantes(lambda: self.client.get('/reservas/api/reservas/relatorio_excel/'))
+
+    def test_changelist_do_admin(self):
+        self.admin.is_superuser = True
+        self.admin.save()
+        navegador = Client()
+        navegador.force_login(self.admin)
+        self.assertConsultasConstantes(lambda: navegador.get('/admin/reservas/reserva/'))
+
+
+class EstatisticasTests(ReservasTestCase):
+    """Os contadores do Dashboard são mantidos por diferença e devem bater com um recálculo completo."""
+
+    def contadores(self):
+        return {
+            (tipo, chave): (quantidade, minutos)
+            for tipo, chave, quantidade, minutos in EstatisticaReserva.objects.exclude(quantidade=0, minutos=0)
+            .values_list('tipo', 'chave', 'quantidade', 'minutos')
+        }
+
+    def test_incremental_igual_ao_recalculo(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            reserva = self.criar_reserva(dias=1, duracao=2)
+            cancelada = self.criar_reserva(recurso=self.auditorio, dias=1)
+            self.criar_reserva(dias=2, status='P')
+        with self.captureOnCommitCallbacks(execute=True):
+            cancelada.status = 'X'
+            cancelada.save()
+            reserva.recurso = self.auditorio
+            reserva.save()
+            Reserva.objects.get(pk=reserva.pk).delete()
+
+        amanha, depois = (timezone.localdate(self.horario(d)).isoformat() for d in (1, 2))
+        incremental = self.contadores()
+        self.assertEqual(incremental, {
+            ('total', ''): (2, 0),
+            ('recurso', str(self.sala.id)): (1, 0),
+            ('recurso', str(self.auditorio.id)): (1, 0),
+            ('status', 'X'): (1, 0),
+            ('status', 'P'): (1, 0),
+            ('dia', depois): (1, 60),
+        })
+
+        EstatisticaReserva.reconstruir()
+        self.assertEqual(self.contadores(), incremental)
+        self.assertNotIn(('dia', amanha), incremental)
+
+    def test_reserva_que_atravessa_a_meia_noite(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.criar_reserva(dias=1, inicio=15, duracao=3)  # 23h às 2h (horário local)
+
+        amanha, depois = (timezone.localdate(self.horario(d)).isoformat() for d in (1, 2))
+        contadores = self.contadores()
+        self.assertEqual(contadores[('dia', amanha)], (1, 60))
+        self.assertEqual(contadores[('dia', depois)], (0, 120))
+
+    def test_dashboard_le_as_estatisticas(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.criar_reserva(dias=1)
+            self.criar_reserva(dias=2)
+            self.criar_reserva(recurso=self.auditorio, dias=1, status='P')
+
+        navegador = Client()
+        navegador.force_login(self.admin)
+        with CaptureQueriesContext(connection) as contexto:
+            resposta = navegador.get('/admin/')
+        self.assertEqual(resposta.context['total_reservas'], 3)
+        self.assertEqual(resposta.context['chart_salas_labels'], '["Lab 1", "Audit\\u00f3rio"]')
+        self.assertEqual(resposta.context['chart_status_data'], '[2, 1]')
+        # Nenhuma consulta agrega a tabela de reservas
+        self.assertFalse([q for q in contexto.captured_queries if 'reservas_reserva' in q['sql']])
+
+    def test_recurso_excluido_sai_do_ranking(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.criar_reserva(recurso=self.auditorio, dias=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.auditorio.delete()
+
+        self.assertEqual(self.contadores(), {})
+
+
+@override_settings(EXPEDIENTE_INICIO=7, EXPEDIENTE_FIM=22, EXPEDIENTE_DIAS_SEMANA=[0, 1, 2, 3, 4, 5])
+class OcupacaoTests(ReservasTestCase):
+    url = '/reservas/api/recursos/ocupacao/'
+
+    def setUp(self):
+        super().setUp()
+        self.autenticar(self.admin)
+        # Uma semana fechada, de segunda a segunda (meia-noite local), no futuro
+        amanha = timezone.localtime(self.base).replace(hour=0)
+        self.segunda = amanha + datetime.timedelta(days=7 - amanha.weekday())
+        self.periodo = {'inicio': self.segunda.isoformat(), 'fim': (self.segunda + datetime.timedelta(days=7)).isoformat()}
+
+    def reservar(self, recurso, dia, inicio, fim, status='C'):
+        return Reserva.objects.create(
+            recurso=recurso, usuario=self.aluno, motivo='Aula', status=status,
+            data_hora_inicio=self.segunda + datetime.timedelta(days=dia, hours=inicio),
+            data_hora_fim=self.segunda + datetime.timedelta(days=dia, hours=fim),
+        )
+
+    def test_taxas_por_hora_dia_e_semana(self):
+        self.reservar(self.sala, 0, 8, 10)        # segunda, 2h
+        self.reservar(self.sala, 1, 21.5, 23)     # terça: só 30min dentro do expediente (até 22h)
+        self.reservar(self.sala, 6, 9, 12)        # domingo: fora do expediente
+        self.reservar(self.auditorio, 0, 8, 12, status='X')  # cancelada não ocupa
+
+        resposta = self.client.get(self.url, self.periodo)
+        self.assertEqual(resposta.status_code, 200)
+        dados = resposta.data
+
+        self.assertEqual(dados['rotulos']['hora'][0], '07h')
+        self.assertEqual(len(dados['rotulos']['hora']), 15)
+        self.assertEqual(dados['rotulos']['dia_semana'], ['Seg', 'Ter', 'Qua', 'Qui', 'Sex', 'Sáb'])
+        self.assertEqual(dados['rotulos']['semana'], [self.segunda.date().isoformat()])
+
+        auditorio, sala = dados['recursos']
+        self.assertEqual(sala['nome'], 'Lab 1')
+        self.assertEqual(sala['horas_disponiveis'], 90)   # 15h x 6 dias
+        self.assertEqual(sala['horas_reservadas'], 2.5)
+        self.assertEqual(sala['taxa'], 2.8)
+        self.assertEqual(sala['semana'], [2.8])
+        self.assertEqual(sala['dia_semana'], [13.3, 3.3, 0, 0, 0, 0])
+        horas = dict(zip(dados['rotulos']['hora'], sala['hora']))
+        self.assertEqual((horas['08h'], horas['09h'], horas['10h'], horas['21h']), (16.7, 16.7, 0, 8.3))
+        self.assertEqual(auditorio['taxa'], 0)
+
+    def test_periodo_parcial_e_filtro_de_recursos(self):
+        self.reservar(self.sala, 0, 8, 10)
+        periodo = {'inicio': (self.segunda + datetime.timedelta(hours=9)).isoformat(),
+                   'fim': (self.segunda + datetime.timedelta(hours=11)).isoformat(),
+                   'recursos': str(self.sala.id)}
+
+        dados = self.client.get(self.url, periodo).data
+
+        self.assertEqual(len(dados['recursos']), 1)
+        self.assertEqual(dados['rotulos']['hora'], ['09h', '10h'])
+        self.assertEqual(dados['recursos'][0]['hora'], [100, 0])
+        self.assertEqual(dados['recursos'][0]['taxa'], 50)
+
+    def test_fracoes_de_hora_e_dias_parciais(self):
+        self.reservar(self.sala, 0, 8, 10)
+        self.reservar(self.sala, 1, 21, 24 + 9)   # terça 21h até quarta 9h (atravessa a meia-noite)
+        periodo = {'inicio': (self.segunda + datetime.timedelta(hours=9, minutes=30)).isoformat(),
+                   'fim': (self.segunda + datetime.timedelta(days=2, hours=8, minutes=30)).isoformat(),
+                   'recursos': str(self.sala.id)}
+
+        sala = self.client.get(self.url, periodo).data['recursos'][0]
+
+        # Segunda 9h30-10h (0,5h) + terça 21h-22h (1h) + quarta 7h-8h30 (1,5h)
+        self.assertEqual(sala['horas_reservadas'], 3)
+        self.assertEqual(sala['dia_semana'], [4, 6.7, 100])
+
+    def test_contadores_acompanham_as_alteracoes(self):
+        reserva = self.reservar(self.sala, 0, 8, 10)
+        with self.captureOnCommitCallbacks(execute=True):
+            reserva.data_hora_fim = self.segunda + datetime.timedelta(hours=9)
+            reserva.save()
+        self.assertEqual(self.client.get(self.url, self.periodo).data['recursos'][1]['horas_reservadas'], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            reserva.status = 'X'
+            reserva.save()
+        self.assertEqual(self.client.get(self.url, self.periodo).data['recursos'][1]['horas_reservadas'], 0)
+
+    def test_reconstrucao_igual_aos_contadores_incrementais(self):
+        self.reservar(self.sala, 0, 8, 10)
+        self.reservar(self.sala, 1, 21.5, 23)
+        self.reservar(self.auditorio, 2, 7.25, 9.75, status='M')
+        colunas = ['recurso_id', 'dia'] + [OcupacaoDia.coluna(hora) for hora in range(24)]
+        incrementais = list(OcupacaoDia.objects.exclude(**{c: 0 for c in colunas[2:]}).order_by('recurso_id', 'dia').values_list(*colunas))
+
+        EstatisticaReserva.reconstruir()
+        reconstruidos = list(OcupacaoDia.objects.order_by('recurso_id', 'dia').values_list(*colunas))
+        self.assertEqual(incrementais, reconstruidos)
+        self.assertEqual(len(reconstruidos), 3)
+
+    def test_validacao_e_permissao(self):
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {**self.periodo, 'recursos': 'a'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'inicio': '2026-01-01', 'fim': '2028-01-01'}).status_code, 400)
+
+        self.autenticar(self.aluno)
+        self.assertEqual(self.client.get(self.url, self.periodo).status_code, 403)
+
+
+class BuscaDisponiveisTests(ReservasTestCase):
+    url = '/reservas/api/recursos/buscar_disponiveis/'
+
+    def buscar(self, dias=1, inicio=0, fim=1, **extra):
+        resposta = self.client.get(self.url, {
+            'inicio': self.horario(dias, inicio).isoformat(), 'fim': self.horario(dias, fim).isoformat(), **extra,
+        })
+        self.assertEqual(resposta.status_code, 200)
+        return sorted(r['nome'] for r in resposta.data)
+
+    def test_indice_sem_consultar_reservas_e_atualizado_nas_escritas(self):
+        reserva = self.criar_reserva(dias=1, inicio=0, duracao=2)
+        self.assertEqual(self.buscar(inicio=1, fim=3), ['Auditório'])
+
+        with CaptureQueriesContext(connection) as contexto:
+            self.assertEqual(self.buscar(inicio=2, fim=3), ['Auditório', 'Lab 1'])
+        self.assertFalse([q for q in contexto.captured_queries if 'reservas_reserva' in q['sql']])
+
+        self.assertEqual(self.buscar(capacidade=100), ['Auditório'])
+
+        reserva.status = 'X'
+        reserva.save()
+        self.assertEqual(self.buscar(inicio=1, fim=3), ['Auditório', 'Lab 1'])
+
+    def test_escrita_de_outro_processo_percebida_pela_versao(self):
+        self.criar_reserva(dias=1)
+        self.assertEqual(self.buscar(), ['Auditório'])
+
+        # update() não dispara sinais (como uma escrita em outro processo): só a versão muda
+        Reserva.objects.update(status='X')
+        self.assertEqual(self.buscar(), ['Auditório'])
+        ContadorVersao.incrementar('agenda')
+        self.assertEqual(self.buscar(), ['Auditório', 'Lab 1'])
+
+    def test_periodo_passado_consulta_o_banco(self):
+        reserva = self.criar_reserva(dias=1)
+        Reserva.objects.filter(pk=reserva.pk).update(
+            data_hora_inicio=self.horario(-10), data_hora_fim=self.horario(-10, 1),
+        )
+        ContadorVersao.incrementar('agenda')
+
+        self.assertEqual(self.buscar(dias=-10), ['Auditório'])
+        self.assertEqual(self.buscar(), ['Auditório', 'Lab 1'])
+
+    def test_validacao(self):
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+        periodo = {'inicio': self.horario(1, 1).isoformat(), 'fim': self.horario(1).isoformat()}
+        self.assertEqual(self.client.get(self.url, periodo).status_code, 400)
+        periodo = {'inicio': self.horario(1).isoformat(), 'fim': self.horario(1, 1).isoformat(), 'capacidade': 'x'}
+        self.assertEqual(self.client.get(self.url, periodo).status_code, 400)
+
+
+class CatalogoRecursosTests(ReservasTestCase):
+    """Listagem de recursos com ETag, servida do cache do processo."""
+    url = '/reservas/api/recursos/'
+
+    def test_etag_responde_304_sem_consultar_o_banco(self):
+        resposta = self.client.get(self.url)
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(sorted(r['nome'] for r in resposta.json()), ['Auditório', 'Lab 1'])
+        etag = resposta['ETag']
+
+        with self.assertNumQueries(0):
+            condicional = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(condicional.status_code, 304)
+            self.assertEqual(condicional.content, b'')
+            self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=f'W/{etag}').status_code, 304)
+            # ETag antigo: corpo completo, vindo dos bytes já renderizados
+            completa = self.client.get(self.url, HTTP_IF_NONE_MATCH='"antigo"')
+        self.assertEqual(completa.status_code, 200)
+        self.assertEqual(completa.content, resposta.content)
+
+    def test_alteracao_de_recurso_muda_o_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.sala.capacidade_maxima = 40
+            self.sala.save()
+
+        resposta = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resposta.status_code, 200)
+        self.assertNotEqual(resposta['ETag'], etag)
+        self.assertIn(40, [r['capacidade_maxima'] for r in resposta.json()])
+
+    def test_alteracao_em_outro_processo_percebida_pela_versao(self):
+        etag = self.client.get(self.url)['ETag']
+        # update() não dispara sinais (como uma escrita em outro processo): só a versão muda
+        Recurso.objects.filter(pk=self.sala.pk).update(nome='Lab 2')
+        ContadorVersao.incrementar('recursos')
+
+        with override_settings(CATALOGO_VERIFICACAO=0):
+            resposta = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resposta.status_code, 200)
+        self.assertIn('Lab 2', [r['nome'] for r in resposta.json()])
+
+
+class CacheCompartilhadoTests(ReservasTestCase):
+    """Leituras no cache compartilhado (reservas/cache.py): etiquetas, single-flight e backends."""
+    url_calendario = '/reservas/api/reservas/calendario/'
+
+    def calendario(self, dias=0):
+        resposta = self.client.get(self.url_calendario, {
+            'start': self.horario(dias).isoformat(), 'end': self.horario(dias + 3).isoformat(),
+        })
+        self.assertEqual(resposta.status_code, 200)
+        return [e['id'] for e in resposta.data['results']]
+
+    def consultas_de_reservas(self, requisicao):
+        with CaptureQueriesContext(connection) as contexto:
+            requisicao()
+        return [q['sql'] for q in contexto.captured_queries if 'reservas_reserva' in q['sql']]
+
+    def test_calendario_invalidado_so_pelos_dias_tocados(self):
+        primeira = self.criar_reserva(dias=1)
+        self.assertEqual(self.calendario(), [primeira.id])
+        self.assertEqual(self.calendario(10), [])
+        self.assertFalse(self.consultas_de_reservas(self.calendario))
+
+        # Reserva em outra semana: a janela já em cache continua valendo
+        self.criar_reserva(dias=20)
+        self.assertFalse(self.consultas_de_reservas(self.calendario))
+
+        segunda = self.criar_reserva(dias=11)
+        self.assertEqual(self.calendario(10), [segunda.id])
+
+        # Mudança de horário: sai dos dias antigos e entra nos novos
+        segunda.data_hora_inicio, segunda.data_hora_fim = self.horario(2), self.horario(2, 1)
+        segunda.save()
+        self.assertEqual(self.calendario(10), [])
+        self.assertEqual(self.calendario(), [primeira.id, segunda.id])
+
+    def test_meus_agendamentos_por_usuario(self):
+        url = '/reservas/api/reservas/meus_agendamentos/'
+        self.criar_reserva(dias=1)
+        self.assertEqual(len(self.client.get(url).data), 1)
+
+        self.criar_reserva(usuario=self.admin, dias=2)
+        self.assertFalse(self.consultas_de_reservas(lambda: self.client.get(url)))
+
+        self.criar_reserva(dias=3)
+        self.assertEqual(len(self.client.get(url).data), 2)
+
+        # Nome da sala aparece na listagem: alterar a sala também invalida
+        self.sala.nome = 'Lab 9'
+        self.sala.save()
+        self.assertEqual({r['recurso_nome'] for r in self.client.get(url).data}, {'Lab 9'})
+
+    def test_lote_invalida_as_etiquetas(self):
+        self.assertEqual(self.calendario(), [])
+        self.assertEqual(self.calendario(7), [])
+        resposta = self.client.post('/reservas/api/reservas/lote/', {
+            'recurso': self.sala.id, 'motivo': 'Aula',
+            'data_hora_inicio': self.horario(1).isoformat(), 'data_hora_fim': self.horario(1, 1).isoformat(),
+            'recorrencia': {'contagem': 2},
+        }, format='json')
+        self.assertEqual(resposta.status_code, 201, resposta.data)
+        self.assertEqual(len(self.calendario()), 1)
+        self.assertEqual(len(self.calendario(7)), 1)
+
+    def test_dashboard_em_cache_ate_a_proxima_reserva(self):
+        self.admin.is_superuser = True
+        self.admin.save()
+        navegador = Client()
+        navegador.force_login(self.admin)
+
+        self.assertEqual(navegador.get('/admin/').context['total_reservas'], 0)
+        with CaptureQueriesContext(connection) as contexto:
+            navegador.get('/admin/')
+        self.assertFalse([q for q in contexto.captured_queries if 'estatisticareserva' in q['sql']])
+
+        # A invalidação após o commit acontece depois de as estatísticas serem gravadas
+        with self.captureOnCommitCallbacks(execute=True):
+            self.criar_reserva(dias=1)
+        self.assertEqual(navegador.get('/admin/').context['total_reservas'], 1)
+
+    def test_single_flight_calcula_uma_vez(self):
+        chamadas = []
+        liberar = threading.Event()
+
+        def calcular():
+            chamadas.append(1)
+            liberar.wait(5)
+            return {'valor': 42}
+
+        resultados = []
+        threads = [
+            threading.Thread(target=lambda: resultados.append(cache.obter('teste', ['x'], calcular, ['agenda'])))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.2)
+        liberar.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(chamadas), 1)
+        self.assertEqual(resultados, [{'valor': 42}] * 8)
+
+    def test_backend_em_arquivo(self):
+        pasta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, pasta, ignore_errors=True)
+        configuracao = {'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': pasta,
+        }}
+        with override_settings(CACHES=configuracao):
+            calcular = mock.Mock(side_effect=[1, 2])
+            self.assertEqual(cache.obter('teste', ['x'], calcular, ['recursos']), 1)
+            self.assertEqual(cache.obter('teste', ['x'], calcular, ['recursos']), 1)
+            cache.invalidar('recursos')
+            self.assertEqual(cache.obter('teste', ['x'], calcular, ['recursos']), 2)
+
+    def test_cache_fora_do_ar_calcula_direto(self):
+        with mock.patch.object(caches['default'], 'get_many', side_effect=ConnectionError), \
+                self.assertLogs('reservas.cache', 'ERROR'):
+            self.assertEqual(cache.obter('teste', ['x'], lambda: 'direto', ['agenda']), 'direto')
+
+
+@override_settings(EXPEDIENTE_INICIO=7, EXPEDIENTE_FIM=22, EXPEDIENTE_DIAS_SEMANA=[0, 1, 2, 3, 4, 5, 6])
+class SugestaoHorariosTests(ReservasTestCase):
+    url = '/reservas/api/recursos/sugerir_horarios/'
+
+    def sugerir(self, inicio, fim, **extra):
+        resposta = self.client.get(self.url, {
+            'inicio': self.horario(1, inicio).isoformat(), 'fim': self.horario(1, fim).isoformat(), **extra,
+        })
+        self.assertEqual(resposta.status_code, 200)
+        return [
+            (s['recurso_nome'], timezone.localtime(s['inicio']).strftime('%H:%M'),
+             timezone.localtime(s['livre_ate']).strftime('%d %H:%M'))
+            for s in resposta.data
+        ]
+
+    def test_primeiros_horarios_livres_entre_as_salas(self):
+        dia = self.horario(1).strftime('%d')
+        self.criar_reserva(dias=1, inicio=0, duracao=1)                         # Lab 1: 08h-09h
+        self.criar_reserva(dias=1, inicio=2, duracao=1)                         # Lab 1: 10h-11h
+        self.criar_reserva(recurso=self.auditorio, dias=1, inicio=0, duracao=2.5)  # Auditório: 08h-10h30
+
+        self.assertEqual(self.sugerir(0, 4, duracao=60), [
+            ('Lab 1', '09:00', f'{dia} 10:00'),
+            ('Auditório', '10:30', f'{dia} 12:00'),
+            ('Lab 1', '11:00', f'{dia} 12:00'),
+        ])
+        self.assertEqual(self.sugerir(0, 4, duracao=61), [('Auditório', '10:30', f'{dia} 12:00')])
+        self.assertEqual(self.sugerir(0, 4, duracao=60, quantidade=1), [('Lab 1', '09:00', f'{dia} 10:00')])
+        self.assertEqual(self.sugerir(0, 4, duracao=30, capacidade=100), [('Auditório', '10:30', f'{dia} 12:00')])
+
+    def test_horario_de_funcionamento(self):
+        dia, seguinte = self.horario(1).strftime('%d'), self.horario(2).strftime('%d')
+        self.criar_reserva(recurso=self.auditorio, dias=1, inicio=12, duracao=2)   # 20h-22h
+
+        self.assertEqual(self.sugerir(12, 25, duracao=60), [
+            ('Lab 1', '20:00', f'{dia} 22:00'),
+            ('Lab 1', '07:00', f'{seguinte} 09:00'),
+            ('Auditório', '07:00', f'{seguinte} 09:00'),
+        ])
+        self.assertEqual(self.sugerir(12, 25, duracao=60, expediente=0), [
+            ('Lab 1', '20:00', f'{seguinte} 09:00'),
+            ('Auditório', '22:00', f'{seguinte} 09:00'),
+        ])
+
+    def test_validacao(self):
+        periodo = {'inicio': self.horario(1).isoformat(), 'fim': self.horario(2).isoformat()}
+        self.assertEqual(self.client.get(self.url, periodo).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {**periodo, 'duracao': 60, 'quantidade': 51}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {**periodo, 'duracao': 'x'}).status_code, 400)
+        longo = {'inicio': self.horario(1).isoformat(), 'fim': self.horario(90).isoformat(), 'duracao': 60}
+        self.assertEqual(self.client.get(self.url, longo).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'duracao': 60}).status_code, 200)
+
+
+class EstatisticasNaTransacaoTests(ReservasTestCase):
+    """Contadores do Dashboard e da ocupação gravados junto com a reserva, nunca depois do commit."""
+
+    def test_contadores_gravados_antes_do_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.criar_reserva(dias=1)
+
+        # Nenhum callback executado: os contadores já estão na transação da reserva
+        self.assertEqual(EstatisticaReserva.objects.get(tipo='total').quantidade, 1)
+        inicio = timezone.localtime(self.horario(1))
+        linha = OcupacaoDia.objects.get(recurso=self.sala, dia=inicio.date())
+        self.assertEqual(getattr(linha, OcupacaoDia.coluna(inicio.hour)), 3600)
+        self.assertTrue(callbacks)
+
+    def test_falha_nos_contadores_desfaz_a_reserva(self):
+        with mock.patch.object(OcupacaoDia, 'registrar', side_effect=OperationalError('database is locked')):
+            with self.assertRaises(OperationalError):
+                self.criar_reserva(dias=1)
+
+        self.assertFalse(Reserva.objects.exists())
+        self.assertFalse(EstatisticaReserva.objects.exists())
+
+
+class ReservaLoteTests(ReservasTestCase):
+    url = '/reservas/api/reservas/lote/'
+
+    def recorrencia(self, **regra):
+        return {
+            'recurso': self.sala.id, 'motivo': 'Aula de Redes',
+            'data_hora_inicio': self.horario(1).isoformat(), 'data_hora_fim': self.horario(1, 2).isoformat(),
+            'recorrencia': regra,
+        }
+
+    def test_serie_semanal_em_uma_transacao(self):
+        versao = ContadorVersao.atual('agenda')
+        with CaptureQueriesContext(connection) as contexto, self.captureOnCommitCallbacks(execute=True):
+            resposta = self.client.post(self.url, self.recorrencia(contagem=18), format='json')
+
+        self.assertEqual(resposta.status_code, 201, resposta.data)
+        self.assertEqual(len(resposta.data['criadas']), 18)
+        self.assertEqual(resposta.data['conflitos'], [])
+        inicios = list(Reserva.objects.values_list('data_hora_inicio', flat=True))
+        self.assertEqual(inicios, [self.horario(7 * semana + 1) for semana in range(18)])
+        self.assertTrue(all(r.status == 'P' for r in Reserva.objects.all()))
+
+        # Uma consulta de conflitos e um INSERT para a série inteira
+        sqls = [q['sql'] for q in contexto.captured_queries]
+        self.assertEqual(len([q for q in sqls if q.startswith('SELECT') and 'FROM "reservas_reserva"' in q]), 1)
+        self.assertEqual(len([q for q in sqls if q.startswith('INSERT INTO "reservas_reserva"')]), 1)
+        # Uma única notificação
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('18 reservas', mail.outbox[0].body)
+        # Estatísticas e versão da agenda atualizadas, apesar do bulk_create
+        self.assertEqual(EstatisticaReserva.objects.get(tipo='total').quantidade, 18)
+        self.assertEqual(ContadorVersao.atual('agenda'), versao + 1)
+
+    def test_conflitos_por_ocorrencia(self):
+        self.criar_reserva(usuario=self.admin, dias=15, inicio=1)
+
+        resposta = self.client.post(self.url, self.recorrencia(contagem=4), format='json')
+        self.assertEqual(resposta.status_code, 400)
+        self.assertEqual(len(resposta.data['conflitos']), 1)
+        self.assertIn('admin', resposta.data['conflitos'][0]['erro'])
+        self.assertEqual(Reserva.objects.count(), 1)
+
+        resposta = self.client.post(self.url, {**self.recorrencia(contagem=4), 'ignorar_conflitos': True}, format='json')
+        self.assertEqual(resposta.status_code, 201)
+        self.assertEqual(len(resposta.data['criadas']), 3)
+        self.assertEqual(resposta.data['conflitos'][0]['data_hora_inicio'], self.horario(15))
+        self.assertEqual(Reserva.objects.count(), 4)
+
+    def test_lista_explicita(self):
+        def ocorrencia(dias, inicio, duracao):
+            return {'data_hora_inicio': self.horario(dias, inicio).isoformat(),
+                    'data_hora_fim': self.horario(dias, inicio + duracao).isoformat()}
+
+        self.autenticar(self.admin)
+        resposta = self.client.post(self.url, {
+            'recurso': self.auditorio.id, 'motivo': 'Semana acadêmica', 'ignorar_conflitos': True,
+            'ocorrencias': [ocorrencia(2, 0, 2), ocorrencia(1, 0, 2), ocorrencia(1, 1, 2), ocorrencia(-3, 0, 1)],
+        }, format='json')
+
+        self.assertEqual(resposta.status_code, 201)
+        self.assertEqual([r['status'] for r in resposta.data['criadas']], ['C', 'C'])
+        erros = sorted(c['erro'] for c in resposta.data['conflitos'])
+        self.assertIn('passado', erros[1])
+        self.assertIn('mesmo pedido', erros[0])
+
+    def test_dias_da_semana_ate_uma_data(self):
+        segunda = self.horario(7 - self.base.weekday())
+        pedido = {
+            **self.recorrencia(dias_semana=[0, 2], intervalo=2, ate=(segunda + datetime.timedelta(days=16)).date().isoformat()),
+            'data_hora_inicio': segunda.isoformat(), 'data_hora_fim': (segunda + datetime.timedelta(hours=1)).isoformat(),
+        }
+        resposta = self.client.post(self.url, pedido, format='json')
+
+        self.assertEqual(resposta.status_code, 201, resposta.data)
+        dias = [timezone.localtime(Reserva.objects.get(pk=r['id']).data_hora_inicio) for r in resposta.data['criadas']]
+        self.assertEqual([(d - segunda).days for d in dias], [0, 2, 14, 16])
+        self.assertTrue(all(d.hour == 8 for d in dias))
+
+    def test_validacao(self):
+        self.assertEqual(self.client.post(self.url, {'recurso': self.sala.id, 'motivo': 'x'}, format='json').status_code, 400)
+        self.assertEqual(self.client.post(self.url, self.recorrencia(contagem=201), format='json').status_code, 400)
+        self.assertEqual(self.client.post(self.url, self.recorrencia(), format='json').status_code, 400)
+        self.assertEqual(Reserva.objects.count(), 0)
+
+
+class DecisaoLoteTests(ReservasTestCase):
+    url = '/reservas/api/reservas/decidir/'
+
+    def setUp(self):
+        super().setUp()
+        self.professor = User.objects.create_user('professor', 'professor@teste.com', 'senha-forte-123')
+
+    def pendente(self, usuario, dias, inicio, duracao=1, recurso=None):
+        # bulk_create não passa pelo clean(): permite montar pendentes sobrepostas (ex: dados legados)
+        return Reserva.objects.bulk_create([Reserva(
+            recurso=recurso or self.sala, usuario=usuario, motivo='Aula', status='P',
+            data_hora_inicio=self.horario(dias, inicio), data_hora_fim=self.horario(dias, inicio + duracao),
+        )])[0]
+
+    def status(self, *reservas):
+        return [Reserva.objects.get(pk=r.pk).status for r in reservas]
+
+    def test_aprovacao_em_lote(self):
+        reservas = [self.pendente(self.aluno, 1, h) for h in (0, 2, 4)] + [self.pendente(self.professor, 2, 0)]
+        self.autenticar(self.admin)
+
+        with CaptureQueriesContext(connection) as contexto, self.captureOnCommitCallbacks(execute=True):
+            resposta = self.client.post(self.url, {'ids': [r.pk for r in reservas], 'acao': 'aprovar'}, format='json')
+
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(sorted(resposta.data['aprovadas']), [r.pk for r in reservas])
+        self.assertEqual(self.status(*reservas), ['C'] * 4)
+        updates = [q for q in contexto.captured_queries if q['sql'].startswith('UPDATE "reservas_reserva"')]
+        self.assertEqual(len(updates), 1)
+        # Um e-mail por usuário, com todas as decisões que o envolvem
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ['aluno@teste.com', 'professor@teste.com'])
+        corpo = next(m.body for m in mail.outbox if m.to == ['aluno@teste.com'])
+        self.assertEqual(corpo.count('Lab 1'), 3)
+        self.assertEqual(EstatisticaReserva.objects.get(tipo='status', chave='C').quantidade, 4)
+
+    def test_revalidacao_e_rejeicao_automatica(self):
+        confirmada = self.criar_reserva(usuario=self.admin, dias=1, inicio=0)            # 08h-09h
+        perde_para_confirmada = self.pendente(self.aluno, 1, 0.5)                         # 08h30-09h30
+        vence = self.pendente(self.aluno, 1, 2)                                           # 10h-11h
+        perde_no_lote = self.pendente(self.professor, 1, 2.5)                             # 10h30-11h30, selecionada
+        perde_fora_do_lote = self.pendente(self.professor, 1, 1.5)                        # 09h30-10h30, não selecionada
+        outra_sala = self.pendente(self.professor, 1, 2, recurso=self.auditorio)
+        self.autenticar(self.admin)
+
+        ids = [confirmada.pk, perde_para_confirmada.pk, vence.pk, perde_no_lote.pk, outra_sala.pk]
+        resposta = self.client.post(self.url, {'ids': ids, 'acao': 'aprovar'}, format='json')
+
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(sorted(resposta.data['aprovadas']), [vence.pk, outra_sala.pk])
+        self.assertEqual(
+            sorted((c['id'], c['conflito_com']) for c in resposta.data['rejeitadas_por_conflito']),
+            [(perde_para_confirmada.pk, confirmada.pk), (perde_no_lote.pk, vence.pk), (perde_fora_do_lote.pk, vence.pk)],
+        )
+        self.assertEqual(resposta.data['ignoradas'], [confirmada.pk])
+        self.assertEqual(
+            self.status(confirmada, perde_para_confirmada, vence, perde_no_lote, perde_fora_do_lote, outra_sala),
+            ['C', 'R', 'C', 'R', 'R', 'C'],
+        )
+        emails.enviar_pendentes()
+        corpo = next(m.body for m in mail.outbox if m.to == ['professor@teste.com'])
+        self.assertIn('aprovadas', corpo)
+        self.assertEqual(corpo.count('já reservado por aluno'), 2)
+
+    def test_bloqueios_sobrepostos_no_banco(self):
+        # Manutenção lançada por cima de uma aula: a busca não pode parar no bloco mais curto
+        aula = self.criar_reserva(usuario=self.admin, dias=1, inicio=0, duracao=4)       # 08h-12h
+        Reserva.objects.bulk_create([Reserva(
+            recurso=self.sala, usuario=self.admin, motivo='Manutenção', status='M',
+            data_hora_inicio=self.horario(1, 1), data_hora_fim=self.horario(1, 2),       # 09h-10h
+        )])
+        antes = self.pendente(self.aluno, 1, -1, duracao=0.5)                             # 07h-07h30
+        perde = self.pendente(self.aluno, 1, 2.5)                                         # 10h30-11h30
+        depois = self.pendente(self.aluno, 1, 4)                                          # 12h-13h
+
+        ids = [antes.pk, perde.pk, depois.pk]
+        resultado = Reserva.decidir_em_lote(Reserva.objects.filter(pk__in=ids), aprovar=True)
+
+        self.assertEqual(resultado['aprovadas'], [antes, depois])
+        self.assertEqual([(r.pk, v.pk) for r, v in resultado['perdedoras']], [(perde.pk, aula.pk)])
+        self.assertEqual(self.status(antes, perde, depois), ['C', 'R', 'C'])
+
+    def test_so_altera_quem_ainda_esta_pendente(self):
+        cancelada, aprovada = self.pendente(self.aluno, 1, 0), self.pendente(self.aluno, 1, 2)
+        revalidar = Reserva._revalidar_aprovacoes
+
+        def cancelar_no_meio(*args):
+            # Outra conexão cancela a reserva depois da leitura das pendentes
+            Reserva.objects.filter(pk=cancelada.pk).update(status='X')
+            return revalidar(*args)
+
+        with mock.patch.object(Reserva, '_revalidar_aprovacoes', side_effect=cancelar_no_meio):
+            resultado = Reserva.decidir_em_lote(Reserva.objects.filter(pk__in=[cancelada.pk, aprovada.pk]), aprovar=True)
+
+        self.assertEqual(resultado['aprovadas'], [aprovada])
+        self.assertEqual(self.status(cancelada, aprovada), ['X', 'C'])
+
+    def test_rejeicao_e_permissao(self):
+        reserva = self.pendente(self.aluno, 1, 0)
+        self.assertEqual(self.client.post(self.url, {'ids': [reserva.pk], 'acao': 'rejeitar'}, format='json').status_code, 403)
+
+        self.autenticar(self.admin)
+        self.assertEqual(self.client.post(self.url, {'ids': [], 'acao': 'rejeitar'}, format='json').status_code, 400)
+        resposta = self.client.post(self.url, {'ids': [reserva.pk], 'acao': 'rejeitar'}, format='json')
+        self.assertEqual(resposta.data['rejeitadas'], [reserva.pk])
+        self.assertEqual(self.status(reserva), ['R'])
+
+    def test_acao_do_admin(self):
+        reservas = [self.pendente(self.aluno, 1, h) for h in (0, 2)]
+        self.admin.is_superuser = True
+        self.admin.save()
+        navegador = Client()
+        navegador.force_login(self.admin)
+
+        resposta = navegador.post('/admin/reservas/reserva/', {
+            'action': 'aprovar_pendentes', '_selected_action': [r.pk for r in reservas],
+        })
+
+        self.assertEqual(resposta.status_code, 302)
+        self.assertEqual(self.status(*reservas), ['C', 'C'])
+        self.assertEqual(emails.enviar_pendentes(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+
+
+class FilaEmailsTests(ReservasTestCase):
+    def test_requisicao_nao_espera_o_smtp(self):
+        payload = {
+            'recurso': self.sala.id, 'motivo': 'Aula',
+            'data_hora_inicio': self.horario(1).isoformat(), 'data_hora_fim': self.horario(1, 1).isoformat(),
+        }
+        with self.captureOnCommitCallbacks() as callbacks:
+            resposta = self.client.post('/reservas/api/reservas/', payload, format='json')
+
+        self.assertEqual(resposta.status_code, 201)
+        # Dentro da requisição, a mensagem só foi gravada na fila
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(EmailPendente.objects.get().status, 'P')
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['aluno@teste.com'])
+        self.assertEqual(EmailPendente.objects.get().status, 'E')
+
+    @override_settings(EMAIL_FILA_LOTE=50)
+    def test_lotes_pela_mesma_conexao(self):
+        emails.enfileirar_varios([(f'Aviso {i}', 'Texto', '', [f'u{i}@teste.com']) for i in range(120)])
+
+        with mock.patch('reservas.emails.get_connection', wraps=emails.get_connection) as conexao:
+            self.assertEqual(emails.enviar_pendentes(), (120, 0))
+
+        self.assertEqual(conexao.call_count, 1)
+        self.assertEqual(len(mail.outbox), 120)
+        self.assertEqual(emails.enviar_pendentes(), (0, 0))
+
+    @override_settings(EMAIL_FILA_TENTATIVAS=3, EMAIL_FILA_ESPERA=60)
+    def test_novas_tentativas_e_dead_letter(self):
+        emails.enfileirar('Aviso', 'Texto', ['aluno@teste.com'])
+        pendente = EmailPendente.objects.get()
+
+        falha_smtp = mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('SMTP fora do ar'))
+        with falha_smtp, self.assertLogs('reservas.emails', 'WARNING'):
+            self.assertEqual(emails.enviar_pendentes(), (0, 1))
+            pendente.refresh_from_db()
+            self.assertEqual((pendente.status, pendente.tentativas), ('P', 1))
+            self.assertIn('SMTP fora do ar', pendente.ultimo_erro)
+            self.assertAlmostEqual(
+                (pendente.proxima_tentativa - timezone.now()).total_seconds(), 60, delta=5
+            )
+            # Ainda não venceu: nada a enviar
+            self.assertEqual(emails.enviar_pendentes(), (0, 0))
+
+            for tentativa in (2, 3):
+                EmailPendente.objects.update(proxima_tentativa=timezone.now())
+                emails.enviar_pendentes()
+                pendente.refresh_from_db()
+                self.assertEqual(pendente.tentativas, tentativa)
+            self.assertEqual(pendente.status, 'F')
+
+        # Reenvio pelo Admin (dead letter)
+        self.admin.is_superuser = True
+        self.admin.save()
+        navegador = Client()
+        navegador.force_login(self.admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            navegador.post('/admin/reservas/emailpendente/', {'action': 'reenviar', '_selected_action': [pendente.pk]})
+
+        pendente.refresh_from_db()
+        self.assertEqual((pendente.status, pendente.tentativas), ('E', 0))
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_falha_agenda_o_proximo_envio(self):
+        emails.enfileirar('Aviso', 'Texto', ['aluno@teste.com'])
+
+        falha_smtp = mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('SMTP fora do ar'))
+        with falha_smtp, self.assertLogs('reservas.emails', 'WARNING'), mock.patch('reservas.emails.agendar') as agendar:
+            emails.enviar_pendentes()
+
+        funcao, atraso = agendar.call_args.args
+        self.assertEqual((funcao, agendar.call_args.kwargs), (emails.enviar_pendentes, {'fila': 'emails'}))
+        self.assertAlmostEqual(atraso, 60, delta=5)
+
+        with mock.patch('reservas.emails.agendar') as agendar:
+            EmailPendente.objects.update(proxima_tentativa=timezone.now())
+            self.assertEqual(emails.enviar_pendentes(), (1, 0))
+        agendar.assert_not_called()
+
+    @override_settings(TAREFAS_SINCRONAS=False)
+    def test_agendamento_no_pool_dos_emails(self):
+        executou, threads = threading.Event(), []
+
+        def enviar():
+            threads.append(threading.current_thread().name)
+            executou.set()
+
+        tarefas.agendar(enviar, 30, fila='emails')
+        tarefas.agendar(enviar, 0.05, fila='emails')   # mais cedo: substitui
+        tarefas.agendar(enviar, 60, fila='emails')     # mais tarde: ignorado
+
+        self.assertTrue(executou.wait(5))
+        time.sleep(0.1)
+        self.assertEqual(len(threads), 1)
+        self.assertTrue(threads[0].startswith('emails'))
+        self.assertNotIn(enviar, tarefas._agendadas)
+
+    def test_recuperacao_de_senha_usa_a_fila(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            resposta = self.client.post('/reservas/api/password_reset/', {'email': 'aluno@teste.com'}, format='json')
+
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(EmailPendente.objects.get().status, 'E')
+        self.assertIn('nova-senha?token=', mail.outbox[0].body)
+
+
+class RelatorioExcelTests(ReservasTestCase):
+    url = '/reservas/api/reservas/relatorio_excel/'
+
+    def planilha(self, resposta):
+        self.assertEqual(resposta.status_code, 200)
+        conteudo = b''.join(resposta.streaming_content)
+        return list(openpyxl.load_workbook(io.BytesIO(conteudo)).active.values)
+
+    def test_exporta_em_streaming(self):
+        reserva = self.criar_reserva(dias=1)
+
+        linhas = self.planilha(self.client.get(self.url))
+
+        self.assertEqual(linhas[0], ('ID', 'Recurso', 'Usuário', 'Início', 'Fim', 'Motivo', 'Status'))
+        self.assertEqual(linhas[1][:3], (reserva.id, 'Lab 1', 'aluno'))
+        self.assertEqual(linhas[1][-1], 'Confirmada')
+        # Horário local (como na tela), não UTC
+        self.assertEqual(linhas[1][3], timezone.localtime(reserva.data_hora_inicio).replace(tzinfo=None))
+
+    def test_primeiro_bloco_antes_de_ler_as_reservas(self):
+        reserva = self.criar_reserva(dias=1)
+        with mock.patch.object(relatorios, 'TAMANHO_BLOCO_EXCEL', 256):
+            blocos = relatorios.gerar_excel(Reserva.objects.select_related('recurso', 'usuario'))
+            with self.assertNumQueries(0):
+                primeiro = next(blocos)
+            conteudo = primeiro + b''.join(blocos)
+
+        self.assertTrue(primeiro.startswith(b'PK'))
+        planilha = openpyxl.load_workbook(io.BytesIO(conteudo)).active
+        self.assertTrue(planilha['A1'].font.b)
+        self.assertEqual(planilha['A2'].value, reserva.id)
+        self.assertEqual(planilha['D2'].number_format, 'dd/mm/yyyy hh:mm')
+
+    def test_caracteres_de_controle_removidos(self):
+        self.criar_reserva(dias=1, motivo='Aula\x07 de Física')
+        linhas = self.planilha(self.client.get(self.url))
+        self.assertEqual(linhas[1][5], 'Aula de Física')
+
+    async def test_exporta_em_streaming_no_asgi(self):
+        # No Daphne o conteúdo precisa ser um iterador assíncrono (senão seria lido todo para a memória)
+        reserva = await Reserva.objects.acreate(
+            recurso=self.sala, usuario=self.aluno, motivo='Aula', status='C',
+            data_hora_inicio=self.horario(1), data_hora_fim=self.horario(1, 1),
+        )
+        token = await Token.objects.aget(user=self.aluno)
+        resposta = await AsyncClient().get(self.url, headers={'Authorization': f'Token {token.key}'})
+
+        self.assertTrue(resposta.is_async)
+        conteudo = b''.join([bloco async for bloco in resposta.streaming_content])
+        linhas = list(openpyxl.load_workbook(io.BytesIO(conteudo)).active.values)
+        self.assertEqual(linhas[1][0], reserva.id)
+
+    def test_filtros(self):
+        self.autenticar(self.admin)
+        self.criar_reserva(dias=1)
+        self.criar_reserva(dias=5)
+        no_auditorio = self.criar_reserva(recurso=self.auditorio, dias=1, status='P')
+
+        linhas = self.planilha(self.client.get(self.url, {
+            'inicio': self.horario(0).isoformat(),
+            'fim': self.horario(2).isoformat(),
+            'recurso': self.auditorio.id,
+            'status': 'P,C',
+        }))
+
+        self.assertEqual([linha[0] for linha in linhas[1:]], [no_auditorio.id])
+
+    def test_filtro_invalido(self):
+        resposta = self.client.get(self.url, {'status': 'Z'})
+        self.assertEqual(resposta.status_code, 400)
+
+
+class RelatorioPdfTests(ReservasTestCase):
+    url = '/reservas/api/reservas/relatorio_pdf/'
+
+    def linhas(self, agrupar=None):
+        """Conteúdo das tabelas do PDF, linha a linha (células Paragraph viram o texto delas)."""
+        reservas = relatorios.reservas_do_relatorio(self.admin, {})
+        return [
+            [getattr(celula, 'text', celula) for celula in linha]
+            for tabela in relatorios._flowables_pdf(reservas, agrupar)
+            for linha in tabela._cellvalues
+        ]
+
+    def test_gera_pdf(self):
+        self.criar_reserva(dias=1)
+        resposta = self.client.get(self.url, {'agrupar': 'dia'})
+        self.assertEqual(resposta.status_code, 200)
+        self.assertTrue(resposta.content.startswith(b'%PDF'))
+
+    def test_agrupamento_invalido(self):
+        self.assertEqual(self.client.get(self.url, {'agrupar': 'semana'}).status_code, 400)
+
+    def test_agrupa_por_recurso_com_subtotais(self):
+        self.criar_reserva(dias=1, duracao=2)
+        self.criar_reserva(dias=2)
+        self.criar_reserva(recurso=self.auditorio, dias=1)
+
+        faixas = [linha[0] for linha in self.linhas('recurso') if linha[1] == '']
+        self.assertEqual(faixas, [
+            'Recurso: Auditório',
+            'Subtotal (Recurso: Auditório): 1 reserva - 1h00 reservadas',
+            'Recurso: Lab 1',
+            'Subtotal (Recurso: Lab 1): 2 reservas - 3h00 reservadas',
+            'Total: 3 reservas - 4h00 reservadas',
+        ])
+
+    def test_agrupa_por_dia(self):
+        self.criar_reserva(dias=1)
+        self.criar_reserva(recurso=self.auditorio, dias=1)
+        self.criar_reserva(dias=2)
+
+        faixas = [linha[0] for linha in self.linhas('dia') if linha[1] == '']
+        amanha, depois = (timezone.localtime(self.horario(d)).strftime('%d/%m/%Y') for d in (1, 2))
+        self.assertEqual(faixas, [
+            f'Dia: {depois}',
+            f'Subtotal (Dia: {depois}): 1 reserva - 1h00 reservadas',
+            f'Dia: {amanha}',
+            f'Subtotal (Dia: {amanha}): 2 reservas - 2h00 reservadas',
+            'Total: 3 reservas - 3h00 reservadas',
+        ])
+
+    def test_nome_longo_nao_e_cortado(self):
+        self.sala.nome = 'Laboratório de Informática Avançada do Bloco C - Sala 204'
+        self.sala.save()
+        self.criar_reserva(dias=1)
+
+        self.assertEqual(self.linhas()[0][1], self.sala.nome)
+
+    def test_varias_paginas(self):
+        Reserva.objects.bulk_create(
+            Reserva(recurso=self.sala, usuario=self.aluno, motivo='Aula', status='C',
+                    data_hora_inicio=self.horario(1 + i // 10, i % 10), data_hora_fim=self.horario(1 + i // 10, i % 10 + 1))
+            for i in range(150)
+        )
+        for agrupar in ('', 'recurso', 'dia'):
+            with self.subTest(agrupar=agrupar):
+                pdf = self.client.get(self.url, {'agrupar': agrupar} if agrupar else {}).content
+                self.assertGreater(len(re.findall(rb'/Type /Page\b', pdf)), 3)
+
+                # Montado parte a parte, o PDF tem as mesmas páginas que o build() da lista inteira
+                reservas = relatorios.reservas_do_relatorio(self.admin, {})
+                em_partes, lista = io.BytesIO(), io.BytesIO()
+                relatorios.gerar_pdf(reservas, em_partes, agrupar or None)
+                with mock.patch.object(relatorios._DocumentoEmPartes, 'montar',
+                                       lambda documento, partes: documento.build(list(partes))):
+                    relatorios.gerar_pdf(reservas, lista, agrupar or None)
+                self.assertEqual(
+                    len(re.findall(rb'/Type /Page\b', em_partes.getvalue())),
+                    len(re.findall(rb'/Type /Page\b', lista.getvalue())),
+                )
+
+
+@override_settings(TAREFAS_SINCRONAS=True)
+class RelatorioJobTests(ReservasTestCase):
+    url = '/reservas/api/relatorios/'
+
+    def setUp(self):
+        super().setUp()
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        override = override_settings(MEDIA_ROOT=media)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.criar_reserva(dias=1)
+
+    def pedir(self, formato='xlsx', filtros=None):
+        # O pool roda a tarefa após o commit; aqui, na própria thread (TAREFAS_SINCRONAS)
+        with self.captureOnCommitCallbacks(execute=True):
+            resposta = self.client.post(self.url, {'formato': formato, 'filtros': filtros or {}}, format='json')
+        self.assertEqual(resposta.status_code, 202)
+        return resposta.data
+
+    def test_gera_e_baixa(self):
+        for formato, assinatura in (('pdf', b'%PDF'), ('xlsx', b'PK')):
+            job = self.pedir(formato)
+            self.assertEqual(self.client.get(f"{self.url}{job['id']}/").data['status'], 'C')
+
+            resposta = self.client.get(f"{self.url}{job['id']}/download/")
+            self.assertEqual(resposta.status_code, 200)
+            self.assertTrue(b''.join(resposta.streaming_content).startswith(assinatura))
+
+    def test_reaproveita_arquivo_enquanto_os_dados_nao_mudam(self):
+        primeiro = self.pedir(filtros={'status': 'p,c'})
+
+        with mock.patch.object(relatorios, 'processar_relatorio') as processar:
+            segundo = self.pedir(filtros={'status': 'C,P'})
+        processar.assert_not_called()
+        self.assertEqual(segundo['status'], 'C')
+        self.assertEqual(
+            RelatorioJob.objects.get(pk=primeiro['id']).arquivo.name,
+            RelatorioJob.objects.get(pk=segundo['id']).arquivo.name,
+        )
+
+        # Uma nova reserva muda a versão dos dados: o relatório precisa ser gerado de novo
+        with self.captureOnCommitCallbacks(execute=True):
+            self.criar_reserva(dias=2)
+        terceiro = self.pedir(filtros={'status': 'C,P'})
+        self.assertNotEqual(
+            RelatorioJob.objects.get(pk=primeiro['id']).chave,
+            RelatorioJob.objects.get(pk=terceiro['id']).chave,
+        )
+
+    def test_chave_depende_apenas_dos_dados_filtrados(self):
+        self.autenticar(self.admin)
+        filtros = {'recurso': self.auditorio.pk}
+        primeiro = self.pedir(filtros=filtros)
+
+        # Reserva em outra sala: o relatório do auditório continua o mesmo
+        with self.captureOnCommitCallbacks(execute=True):
+            self.criar_reserva(dias=3)
+        with mock.patch.object(relatorios, 'processar_relatorio') as processar:
+            self.assertEqual(self.pedir(filtros=filtros)['status'], 'C')
+        processar.assert_not_called()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.criar_reserva(recurso=self.auditorio, dias=3)
+        terceiro = self.pedir(filtros=filtros)
+        self.assertNotEqual(
+            RelatorioJob.objects.get(pk=primeiro['id']).chave, RelatorioJob.objects.get(pk=terceiro['id']).chave,
+        )
+
+    def test_chave_calculada_na_renderizacao(self):
+        with mock.patch.object(relatorios, 'processar_relatorio'):
+            job = self.pedir()
+        chave_do_pedido = RelatorioJob.objects.get(pk=job['id']).chave
+
+        # Alteração entre o pedido e a renderização: o arquivo fica sob a chave dos dados lidos
+        with self.captureOnCommitCallbacks(execute=True):
+            self.criar_reserva(dias=2)
+        relatorios.processar_relatorio(job['id'])
+        renderizado = RelatorioJob.objects.get(pk=job['id'])
+        self.assertNotEqual(renderizado.chave, chave_do_pedido)
+
+        with mock.patch.object(relatorios, 'processar_relatorio') as processar:
+            self.assertEqual(self.pedir()['status'], 'C')
+        processar.assert_not_called()
+
+    def test_expira_pedidos_e_arquivos_antigos(self):
+        antigo = self.pedir()
+        reaproveitado = self.pedir()
+        recente = self.pedir(formato='pdf')
+        RelatorioJob.objects.filter(pk=antigo['id']).update(criado_em=timezone.now() - datetime.timedelta(days=2))
+        arquivo = RelatorioJob.objects.get(pk=antigo['id']).arquivo
+
+        # O arquivo ainda é usado pelo pedido que o reaproveitou
+        self.assertEqual(RelatorioJob.expirar(datetime.timedelta(days=1)), (1, 0))
+        self.assertTrue(arquivo.storage.exists(arquivo.name))
+
+        RelatorioJob.objects.filter(pk=reaproveitado['id']).update(criado_em=timezone.now() - datetime.timedelta(days=2))
+        saida = io.StringIO()
+        with mock.patch.object(arquivo.storage, 'get_modified_time', return_value=timezone.now() - datetime.timedelta(days=2)):
+            call_command('expirar_relatorios', stdout=saida)
+        self.assertIn('1 pedido(s), 1 arquivo(s)', saida.getvalue())
+        self.assertFalse(arquivo.storage.exists(arquivo.name))
+        self.assertEqual([str(pk) for pk in RelatorioJob.objects.values_list('pk', flat=True)], [recente['id']])
+
+    def test_relatorio_de_outro_usuario_nao_e_visivel(self):
+        job = self.pedir()
+        self.autenticar(self.admin)
+        self.assertEqual(self.client.get(f"{self.url}{job['id']}/download/").status_code, 404)
+
+    def test_filtros_invalidos(self):
+        resposta = self.client.post(self.url, {'formato': 'pdf', 'filtros': {'status': 'Z'}}, format='json')
+        self.assertEqual(resposta.status_code, 400)
+
+
+@override_settings(TAREFAS_SINCRONAS=True)
+class NotificacaoRelatorioTests(TestCase):
+
+    async def test_avisa_quem_acompanha_o_relatorio(self):
+        comunicador = WebsocketCommunicator(NotificacaoConsumer.as_asgi(), '/ws/notificacoes/')
+        conectado, _ = await comunicador.connect()
+        self.assertTrue(conectado)
+
+        job = RelatorioJob(status='C')
+        await comunicador.send_json_to({'acompanhar_relatorio': str(job.pk)})
+        await comunicador.receive_nothing()  # garante que a inscrição foi processada
+
+        def notificar():
+            # O evento só sai após o commit (reservas/eventos.py)
+            with self.captureOnCommitCallbacks(execute=True):
+                relatorios.notificar_relatorio(job)
+        await sync_to_async(notificar)()
+
+        self.assertEqual(
+            await comunicador.receive_json_from(),
+            {'tipo': 'relatorio', 'relatorio': str(job.pk), 'status': 'C'},
+        )
+        await comunicador.disconnect()
+
+
+@override_settings(TAREFAS_SINCRONAS=False, EVENTOS_TIMEOUT=0.2)
+class EventosTests(ReservasTestCase):
+    """Publicação dos eventos de WebSocket em segundo plano (reservas/eventos.py)."""
+
+    def payload(self):
+        return {
+            'recurso': self.sala.pk, 'motivo': 'Aula',
+            'data_hora_inicio': self.horario().isoformat(), 'data_hora_fim': self.horario(horas=1).isoformat(),
+        }
+
+    def test_camada_lenta_nao_atrasa_a_criacao(self):
+        class CamadaTravada:
+            async def group_send(self, grupo, mensagem):
+                await asyncio.sleep(5)
+
+        falhas = eventos.metricas()['falhas']
+        with mock.patch('reservas.eventos.get_channel_layer', return_value=CamadaTravada()):
+            inicio = time.perf_counter()
+            with self.captureOnCommitCallbacks(execute=True):
+                resposta = self.client.post('/reservas/api/reservas/', self.payload(), format='json')
+            duracao = time.perf_counter() - inicio
+            with self.assertLogs('reservas.eventos', 'WARNING'):
+                eventos.aguardar()
+
+        self.assertEqual(resposta.status_code, 201)
+        self.assertLess(duracao, 1)
+        # admin_reservas + os tópicos da reserva (recurso, usuário e dia)
+        self.assertEqual(eventos.metricas()['falhas'], falhas + 4)
+
+    def test_nada_e_publicado_sem_commit(self):
+        with mock.patch('reservas.eventos._obter_fila') as fila:
+            with self.captureOnCommitCallbacks() as callbacks:
+                eventos.publicar('admin_reservas', {'type': 'enviar_notificacao', 'message': 'oi'})
+            fila.assert_not_called()
+            for callback in callbacks:
+                callback()
+        fila.return_value.put_nowait.assert_called_once()
+
+    def test_fila_cheia_descarta_e_conta(self):
+        cheia = queue.Queue(maxsize=1)
+        cheia.put_nowait(('admin_reservas', {'type': 'enviar_notificacao', 'message': 'antigo'}))
+        descartados = eventos.metricas()['descartados']
+        with mock.patch('reservas.eventos._obter_fila', return_value=cheia), self.assertLogs('reservas.eventos', 'WARNING'):
+            with self.captureOnCommitCallbacks(execute=True):
+                eventos.publicar('admin_reservas', {'type': 'enviar_notificacao', 'message': 'novo'})
+        self.assertEqual(eventos.metricas()['descartados'], descartados + 1)
+
+    def test_rajada_e_combinada(self):
+        combinados = eventos.coalescer([
+            ('admin_reservas', {'type': 'enviar_notificacao', 'message': 'a'}),
+            ('relatorio_1', {'type': 'relatorio_atualizado', 'relatorio': '1', 'status': 'P'}),
+            ('admin_reservas', {'type': 'enviar_notificacao', 'message': 'b'}),
+            ('relatorio_1', {'type': 'relatorio_atualizado', 'relatorio': '1', 'status': 'C'}),
+        ])
+        self.assertEqual(combinados, [
+            ('admin_reservas', {'type': 'enviar_notificacao', 'message': 'a\nb'}),
+            ('relatorio_1', {'type': 'relatorio_atualizado', 'relatorio': '1', 'status': 'C'}),
+        ])
+
+    def test_metricas_apenas_admin(self):
+        self.assertEqual(self.client.get('/reservas/api/eventos/metricas/').status_code, 403)
+        self.autenticar(self.admin)
+        resposta = self.client.get('/reservas/api/eventos/metricas/')
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(
+            set(resposta.json()), {'profundidade', 'capacidade', 'publicados', 'descartados', 'combinados', 'falhas'}
+        )
+
+
+# O consumer fecha as conexões "velhas" com o banco a cada mensagem, inclusive a da transação do TestCase
+@mock.patch('channels.db.close_old_connections', new=lambda: None)
+class TopicosAgendaTests(ReservasTestCase):
+    """Inscrição por recurso/usuário/dia e deltas da agenda pelo WebSocket."""
+
+    async def conectar(self, pedido, usuario=None):
+        token, _ = await sync_to_async(Token.objects.get_or_create)(user=usuario or self.aluno)
+        comunicador = WebsocketCommunicator(
+            autenticacao.TokenAuthMiddleware(NotificacaoConsumer.as_asgi()), f'/ws/notificacoes/?token={token.key}'
+        )
+        conectado, _ = await comunicador.connect()
+        self.assertTrue(conectado)
+        await comunicador.send_json_to({'inscrever': pedido})
+        resposta = await comunicador.receive_json_from()
+        self.assertEqual(resposta['tipo'], 'inscricoes')
+        return comunicador
+
+    async def gravar(self, funcao):
+        def executar():
+            with self.captureOnCommitCallbacks(execute=True):
+                return funcao()
+        return await sync_to_async(executar)()
+
+    async def test_delta_chega_so_a_quem_acompanha_o_recurso(self):
+        sala = await self.conectar({'recursos': [self.sala.pk]})
+        auditorio = await self.conectar({'recursos': [self.auditorio.pk]})
+
+        reserva = await self.gravar(lambda: self.criar_reserva())
+
+        mensagem = await sala.receive_json_from()
+        self.assertEqual(mensagem['tipo'], 'reservas')
+        self.assertEqual(len(mensagem['alteracoes']), 1)
+        self.assertEqual(mensagem['alteracoes'][0]['acao'], 'criada')
+        self.assertEqual(mensagem['alteracoes'][0]['reserva']['id'], reserva.pk)
+        self.assertEqual(mensagem['alteracoes'][0]['reserva']['title'], 'Lab 1 - Aula')
+        self.assertTrue(await auditorio.receive_nothing())
+        await sala.disconnect()
+        await auditorio.disconnect()
+
+    async def test_varios_topicos_entregam_uma_vez(self):
+        dia = self.horario().date().isoformat()
+        comunicador = await self.conectar({'recursos': [self.sala.pk], 'inicio': dia, 'fim': self.horario(dias=1).date().isoformat()})
+        reserva = await self.gravar(lambda: self.criar_reserva())
+        self.assertEqual(len((await comunicador.receive_json_from())['alteracoes']), 1)
+        self.assertTrue(await comunicador.receive_nothing())
+
+        def cancelar():
+            reserva.status = 'X'
+            reserva.save()
+        await self.gravar(cancelar)
+        mensagem = await comunicador.receive_json_from()
+        self.assertEqual(mensagem['alteracoes'][0]['acao'], 'cancelada')
+        await comunicador.disconnect()
+
+    async def test_reserva_movida_avisa_o_dia_antigo(self):
+        dia = self.horario().date()
+        comunicador = await self.conectar({'inicio': dia.isoformat(), 'fim': (dia + datetime.timedelta(days=1)).isoformat()})
+        reserva = await self.gravar(lambda: self.criar_reserva())
+        await comunicador.receive_json_from()
+
+        def mover():
+            reserva.data_hora_inicio, reserva.data_hora_fim = self.horario(dias=2), self.horario(dias=2, horas=1)
+            reserva.save()
+        await self.gravar(mover)
+        mensagem = await comunicador.receive_json_from()
+        self.assertEqual(mensagem['alteracoes'][0]['acao'], 'atualizada')
+        self.assertEqual(mensagem['alteracoes'][0]['reserva']['start'], self.horario(dias=2).isoformat())
+        await comunicador.disconnect()
+
+    async def test_decisao_em_lote_vai_em_uma_mensagem(self):
+        pendentes = [await sync_to_async(self.criar_reserva)(inicio=i, status='P') for i in range(3)]
+        comunicador = await self.conectar({'recursos': [self.sala.pk]})
+        await self.gravar(lambda: Reserva.decidir_em_lote(Reserva.objects.filter(pk__in=[r.pk for r in pendentes]), aprovar=False))
+
+        mensagem = await comunicador.receive_json_from()
+        self.assertEqual([a['acao'] for a in mensagem['alteracoes']], ['cancelada'] * 3)
+        self.assertEqual({a['reserva']['status'] for a in mensagem['alteracoes']}, {'R'})
+        await comunicador.disconnect()
+
+    async def test_pedidos_invalidos(self):
+        anonimo = WebsocketCommunicator(NotificacaoConsumer.as_asgi(), '/ws/notificacoes/')
+        await anonimo.connect()
+        await anonimo.send_json_to({'inscrever': {'recursos': [1]}})
+        self.assertEqual((await anonimo.receive_json_from())['erro'], 'A agenda exige login.')
+        await anonimo.disconnect()
+
+        comunicador = await self.conectar({'recursos': [1, 2]})
+        for pedido in ({'recursos': 'todos'}, {'usuarios': [self.admin.pk]}, {'inicio': '2026-01-01', 'fim': '2026-12-31'}):
+            await comunicador.send_json_to({'inscrever': pedido})
+            self.assertEqual((await comunicador.receive_json_from())['tipo'], 'erro')
+
+        await comunicador.send_json_to({'cancelar_inscricao': {'recursos': [1]}})
+        self.assertEqual((await comunicador.receive_json_from())['topicos'], ['recurso_2'])
+        await comunicador.disconnect()
+
+    async def test_retomada_entrega_so_o_que_foi_perdido(self):
+        comunicador = await self.conectar({'recursos': [self.sala.pk]})
+        primeira = await self.gravar(lambda: self.criar_reserva())
+        cursor = (await comunicador.receive_json_from())['alteracoes'][0]['seq']
+        await comunicador.disconnect()
+
+        # Enquanto o cliente está desconectado
+        segunda = await self.gravar(lambda: self.criar_reserva(inicio=2))
+        await self.gravar(lambda: self.criar_reserva(recurso=self.auditorio))
+
+        def cancelar():
+            primeira.status = 'X'
+            primeira.save()
+        await self.gravar(cancelar)
+
+        comunicador = await self.conectar({'recursos': [self.sala.pk]})
+        await comunicador.send_json_to({'retomar': cursor})
+        retomada = await comunicador.receive_json_from()
+        self.assertEqual(retomada['tipo'], 'retomada')
+        self.assertTrue(retomada['completa'])
+        self.assertEqual(
+            [(a['acao'], a['reserva']['id']) for a in retomada['alteracoes']],
+            [('criada', segunda.pk), ('cancelada', primeira.pk)],
+        )
+        self.assertEqual(retomada['cursor'], retomada['alteracoes'][-1]['seq'])
+        await comunicador.disconnect()
+
+    async def test_inscricao_informa_o_cursor(self):
+        await self.gravar(lambda: self.criar_reserva())
+        comunicador = WebsocketCommunicator(NotificacaoConsumer.as_asgi(), '/ws/notificacoes/')
+        comunicador.scope['user'] = self.aluno
+        await comunicador.connect()
+        await comunicador.send_json_to({'inscrever': {'minhas': True}})
+        resposta = await comunicador.receive_json_from()
+        self.assertEqual(resposta['cursor'], await sync_to_async(EventoAgenda.ultima_sequencia)())
+        await comunicador.disconnect()
+
+    async def test_admin_acompanha_outros_usuarios(self):
+        comunicador = await self.conectar({'usuarios': [self.aluno.pk]}, usuario=self.admin)
+        await self.gravar(lambda: self.criar_reserva())
+        mensagem = await comunicador.receive_json_from()
+        self.assertEqual(mensagem['tipo'], 'reservas')
+        await comunicador.disconnect()
+
+
+@mock.patch('channels.db.close_old_connections', new=lambda: None)
+class AutenticacaoWebSocketTests(ReservasTestCase):
+    """Handshake autenticado pelo Token do DRF, com cache de token -> usuário."""
+
+    def setUp(self):
+        super().setUp()
+        autenticacao.cache_tokens.limpar()
+
+    def comunicador(self, chave):
+        return WebsocketCommunicator(
+            autenticacao.TokenAuthMiddleware(NotificacaoConsumer.as_asgi()), f'/ws/notificacoes/?token={chave}'
+        )
+
+    async def token(self, usuario):
+        return (await sync_to_async(Token.objects.get_or_create)(user=usuario))[0].key
+
+    async def test_token_invalido_e_recusado(self):
+        conectado, codigo = await self.comunicador('nao-existe').connect()
+        self.assertFalse(conectado)
+        self.assertEqual(codigo, 4401)
+
+    async def test_painel_admin_so_para_staff(self):
+        admin = self.comunicador(await self.token(self.admin))
+        aluno = self.comunicador(await self.token(self.aluno))
+        self.assertTrue((await admin.connect())[0])
+        self.assertTrue((await aluno.connect())[0])
+
+        def notificar():
+            with self.captureOnCommitCallbacks(execute=True):
+                eventos.publicar('admin_reservas', {'type': 'enviar_notificacao', 'message': 'Nova reserva'})
+        await sync_to_async(notificar)()
+
+        self.assertEqual(await admin.receive_json_from(), {'message': 'Nova reserva'})
+        self.assertTrue(await aluno.receive_nothing())
+        await admin.disconnect()
+        await aluno.disconnect()
+
+    async def test_rajada_de_conexoes_usa_uma_consulta(self):
+        def criar_tokens():
+            usuarios = User.objects.bulk_create(User(username=f'u{i}') for i in range(30))
+            return [Token.objects.create(user=usuario).key for usuario in usuarios]
+        chaves = await sync_to_async(criar_tokens)()
+        autenticacao.cache_tokens.limpar()
+
+        with mock.patch('reservas.autenticacao.buscar_usuarios', wraps=autenticacao.buscar_usuarios) as buscar:
+            comunicadores = [self.comunicador(chave) for chave in chaves + chaves[:5]]
+            resultados = await asyncio.gather(*(c.connect() for c in comunicadores))
+            self.assertTrue(all(conectado for conectado, _ in resultados))
+            self.assertEqual(buscar.call_count, 1)
+            self.assertEqual(len(buscar.call_args.args[0]), 30)
+
+            # Reconexões dentro do TTL não vão ao banco
+            de_novo = self.comunicador(chaves[0])
+            self.assertTrue((await de_novo.connect())[0])
+            self.assertEqual(buscar.call_count, 1)
+
+        for comunicador in comunicadores + [de_novo]:
+            await comunicador.disconnect()
+
+    async def test_token_excluido_sai_do_cache(self):
+        chave = await self.token(self.aluno)
+        comunicador = self.comunicador(chave)
+        self.assertTrue((await comunicador.connect())[0])
+        await comunicador.disconnect()
+
+        await sync_to_async(Token.objects.filter(key=chave).delete)()
+        self.assertFalse((await self.comunicador(chave).connect())[0])
+
+
+class AutenticacaoApiTests(ReservasTestCase):
+    """TokenAuthenticationEmCache: o usuário do Token vem do cache nas requisições seguintes."""
+    url = '/reservas/api/reservas/meus_agendamentos/'
+
+    def consultas_de_token(self):
+        with CaptureQueriesContext(connection) as contexto:
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+        return [q['sql'] for q in contexto.captured_queries if 'authtoken_token' in q['sql']]
+
+    def test_token_consultado_uma_vez(self):
+        self.assertEqual(len(self.consultas_de_token()), 1)
+        self.assertEqual(self.consultas_de_token(), [])
+
+    def test_token_excluido_e_usuario_desativado_deixam_de_valer(self):
+        self.consultas_de_token()
+        Token.objects.filter(user=self.aluno).delete()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+        self.autenticar(self.aluno)
+        self.consultas_de_token()
+        self.aluno.is_active = False
+        self.aluno.save()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_admin_rebaixado_perde_o_acesso(self):
+        self.autenticar(self.admin)
+        url = '/reservas/api/eventos/metricas/'
+        self.assertEqual(self.client.get(url).status_code, 200)
+        self.admin.is_staff = False
+        self.admin.save()
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_alteracao_do_perfil_nao_vaza_para_o_cache(self):
+        self.consultas_de_token()
+        usuario = autenticacao.cache_tokens.consultar(Token.objects.get(user=self.aluno).key)[1]
+        resposta = self.client.patch('/reservas/api/perfil/', {'first_name': 'Ana'}, format='json')
+        self.assertEqual(resposta.status_code, 200, resposta.data)
+        self.assertEqual(usuario.first_name, '')
+
+
+    def outro_processo(self, usuario):
+        # Cache de tokens de outro processo: só o CACHES 'default' é compartilhado
+        outro = autenticacao.CacheTokens()
+        chave = Token.objects.get_or_create(user=usuario)[0].key
+        with mock.patch.object(autenticacao, 'cache_tokens', outro):
+            autenticacao.buscar_usuarios([chave])
+        self.assertEqual(outro.consultar(chave), (True, usuario))
+        return outro, chave
+
+    def test_alteracoes_chegam_aos_outros_processos(self):
+        outro, chave = self.outro_processo(self.admin)
+        self.admin.is_staff = False
+        self.admin.save()
+        self.assertEqual(outro.consultar(chave), (False, None))
+
+        outro, chave = self.outro_processo(self.aluno)
+        with self.captureOnCommitCallbacks(execute=True):
+            ValidadeToken.rotacionar(self.aluno)
+        self.assertEqual(outro.consultar(chave), (False, None))
+
+    def test_descarte_por_usuario_pelo_indice(self):
+        outro = autenticacao.CacheTokens()
+        outro.guardar('a1', self.aluno)
+        outro.guardar('a2', self.aluno)
+        outro.guardar('b1', self.admin)
+        outro.guardar('x', None)
+
+        outro.descartar(usuario_id=self.aluno.pk)
+
+        self.assertEqual([outro.consultar(c)[0] for c in ('a1', 'a2', 'b1', 'x')], [False, False, True, True])
+        self.assertEqual(outro._por_usuario, {self.admin.pk: {'b1'}})
+        # A entrada substituída ou despejada (LRU) também sai do índice
+        outro.guardar('b1', self.aluno)
+        self.assertEqual(outro._por_usuario, {self.aluno.pk: {'b1'}})
+
+
+class ValidadeTokenTests(ReservasTestCase):
+    """Expiração, renovação deslizante, rotação, limpeza e revogação dos Tokens de login."""
+    url = '/reservas/api/reservas/meus_agendamentos/'
+
+    def login(self):
+        resposta = self.client.post('/reservas/api-token-auth/', {'username': 'aluno', 'password': 'senha-forte-123'})
+        self.assertEqual(resposta.status_code, 200)
+        return resposta.data
+
+    def test_token_expirado_recusado_e_login_emite_outro(self):
+        primeiro = self.login()
+        self.assertEqual(self.login()['token'], primeiro['token'])
+
+        ValidadeToken.objects.update(expira_em=timezone.now() - datetime.timedelta(seconds=1))
+        # A entrada do cache (guardada no login) duraria até o fim do TTL: descarta como se ele tivesse passado
+        autenticacao.cache_tokens.limpar()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+        segundo = self.login()
+        self.assertNotEqual(segundo['token'], primeiro['token'])
+        self.assertGreater(segundo['expira_em'], timezone.now())
+
+    def test_renovacao_deslizante_sem_escrita_por_requisicao(self):
+        validade = ValidadeToken.objects.get(token__user=self.aluno)
+        validade.expira_em = timezone.now() + ValidadeToken.duracao() / 3
+        validade.save()
+
+        with CaptureQueriesContext(connection) as contexto:
+            for _ in range(5):
+                self.assertEqual(self.client.get(self.url).status_code, 200)
+        atualizacoes = [q for q in contexto.captured_queries if q['sql'].startswith('UPDATE "reservas_validadetoken"')]
+        self.assertEqual(len(atualizacoes), 1)
+        validade.refresh_from_db()
+        self.assertGreater(validade.expira_em, timezone.now() + ValidadeToken.duracao() * 0.9)
+
+    def test_cache_nao_passa_da_validade(self):
+        autenticacao.cache_tokens.guardar('chave', self.aluno, timezone.now() - datetime.timedelta(seconds=1))
+        self.assertEqual(autenticacao.cache_tokens.consultar('chave'), (False, None))
+
+    def test_rotacao(self):
+        antigo = Token.objects.get(user=self.aluno).key
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+        resposta = self.client.post('/reservas/api/token/rotacionar/')
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {resposta.data['token']}")
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.assertFalse(Token.objects.filter(key=antigo).exists())
+
+    def test_purgar_em_lotes(self):
+        usuarios = [User.objects.create_user(f'expirado{i}') for i in range(3)]
+        for usuario in usuarios:
+            Token.objects.create(user=usuario)
+        ValidadeToken.objects.filter(token__user__in=usuarios).update(expira_em=timezone.now())
+
+        saida = io.StringIO()
+        call_command('expirar_tokens', lote=2, stdout=saida)
+        self.assertIn('apagados: 3', saida.getvalue())
+        self.assertEqual(list(Token.objects.values_list('user__username', flat=True)), ['aluno'])
+
+    def test_revogar_por_grupo_e_usuario(self):
+        turma = Group.objects.create(name='Turma A')
+        self.aluno.groups.add(turma)
+        Token.objects.create(user=self.admin)
+        outro = User.objects.create_user('outro')
+        Token.objects.create(user=outro)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+        call_command('revogar_tokens', grupos=['Turma A'], usuarios=['admin'], stdout=io.StringIO())
+
+        self.assertEqual(list(Token.objects.values_list('user__username', flat=True)), ['outro'])
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+
+    def test_revogacao_chega_ao_cache_de_outro_processo(self):
+        # O servidor (outro processo) guardou os tokens no seu cache; o comando roda com o próprio cache
+        outro = User.objects.create_user('outro')
+        chaves = [Token.objects.get(user=self.aluno).key, Token.objects.create(user=outro).key]
+        servidor = autenticacao.CacheTokens()
+        with mock.patch.object(autenticacao, 'cache_tokens', servidor):
+            autenticacao.buscar_usuarios(chaves)
+        self.assertEqual([servidor.consultar(chave) for chave in chaves], [(True, self.aluno), (True, outro)])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('revogar_tokens', usuarios=['aluno'], lote=1, stdout=io.StringIO())
+
+        self.assertEqual([servidor.consultar(chave) for chave in chaves], [(False, None), (True, outro)])
+
+class LimitesTests(ReservasTestCase):
+    """Janelas de pedidos por cliente/rota e limite de pedidos simultâneos (reservas/limites.py)."""
+    url_busca = '/reservas/api/recursos/buscar_disponiveis/'
+
+    def buscar(self):
+        return self.client.get(self.url_busca, {
+            'inicio': self.horario(1).isoformat(), 'fim': self.horario(1, 1).isoformat(),
+        })
+
+    @override_settings(LIMITES_TAXA={**settings.LIMITES_TAXA, 'busca': (2, 86400)})
+    def test_busca_limitada_por_usuario(self):
+        self.assertEqual([self.buscar().status_code for _ in range(2)], [200, 200])
+        resposta = self.buscar()
+        self.assertEqual(resposta.status_code, 429)
+        self.assertGreaterEqual(int(resposta['Retry-After']), 1)
+
+        # Outro usuário tem o próprio contador; outras rotas não usam o contador da busca
+        self.assertEqual(self.client.get('/reservas/api/reservas/meus_agendamentos/').status_code, 200)
+        self.autenticar(self.admin)
+        self.assertEqual(self.buscar().status_code, 200)
+
+    @override_settings(LIMITES_TAXA={**settings.LIMITES_TAXA, 'busca': (1, 0.005)})
+    def test_nova_janela_libera_os_pedidos(self):
+        self.assertEqual(self.buscar().status_code, 200)
+        time.sleep(0.01)
+        self.assertEqual(self.buscar().status_code, 200)
+
+    @override_settings(LIMITES_TAXA={**settings.LIMITES_TAXA, 'busca': (50, 86400)})
+    def test_contagem_atomica_entre_threads(self):
+        # Sem trava no código: o incr do cache é quem garante que nenhum pedido passa a mais
+        barreira = threading.Barrier(8)
+
+        def pedir():
+            barreira.wait()
+            return [limites.consumir('busca', 'ip_1') for _ in range(10)]
+
+        resultados = []
+        threads = [threading.Thread(target=lambda: resultados.extend(pedir())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sum(1 for espera in resultados if not espera), 50)
+
+    @override_settings(LIMITES_TAXA={**settings.LIMITES_TAXA, 'login': (2, 86400)})
+    def test_login_limitado_por_ip(self):
+        anonimo = APIClient()
+        dados = {'username': 'aluno', 'password': 'errada'}
+        codigos = [anonimo.post('/reservas/api-token-auth/', dados).status_code for _ in range(3)]
+        self.assertEqual(codigos, [400, 400, 429])
+        outro_ip = anonimo.post('/reservas/api-token-auth/', dados, REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(outro_ip.status_code, 400)
+
+    def test_cache_fora_do_ar_nao_bloqueia(self):
+        with mock.patch.object(caches['default'], 'incr', side_effect=ConnectionError), \
+                self.assertLogs('reservas', 'ERROR'):
+            self.assertEqual(self.buscar().status_code, 200)
+
+    @override_settings(CONCORRENCIA={'escritas': 1, 'relatorios': 1})
+    def test_concorrencia_recusa_o_excesso_e_libera_no_fim_do_streaming(self):
+        liberar = threading.Event()
+
+        def view(request):
+            if request.method == 'POST':
+                liberar.wait(5)
+                return HttpResponse('ok')
+            return StreamingHttpResponse(iter([b'a', b'b']))
+
+        middleware = limites.LimiteConcorrenciaMiddleware(view)
+        fabrica = RequestFactory()
+        primeira = threading.Thread(target=middleware, args=(fabrica.post('/reservas/api/reservas/'),))
+        primeira.start()
+        time.sleep(0.1)
+
+        with self.assertLogs('reservas.limites', 'WARNING'):
+            recusada = middleware(fabrica.post('/reservas/api/reservas/'))
+        self.assertEqual(recusada.status_code, 429)
+        self.assertEqual(recusada['Retry-After'], '1')
+        # Leituras comuns não disputam as vagas
+        self.assertEqual(middleware(fabrica.get('/reservas/api/reservas/')).status_code, 200)
+        liberar.set()
+        primeira.join()
+        self.assertEqual(middleware(fabrica.post('/reservas/api/reservas/')).status_code, 200)
+
+        relatorio = middleware(fabrica.get('/reservas/api/reservas/relatorio_excel/'))
+        with self.assertLogs('reservas.limites', 'WARNING'):
+            self.assertEqual(middleware(fabrica.get('/reservas/api/reservas/relatorio_pdf/')).status_code, 429)
+        b''.join(relatorio.streaming_content)
+        self.assertEqual(middleware(fabrica.get('/reservas/api/reservas/relatorio_pdf/')).status_code, 200)
+
+
+class LogEventosAgendaTests(ReservasTestCase):
+    """Compactação e expiração do log de retomada (EventoAgenda)."""
+
+    def test_compactar_mantem_a_ultima_de_cada_topico(self):
+        # As três alterações na mesma transação: cada linha do log guarda o estado da sua alteração
+        with self.captureOnCommitCallbacks(execute=True):
+            reserva = self.criar_reserva()
+            for motivo in ('Prova', 'Reunião'):
+                reserva.motivo = motivo
+                reserva.save()
+        restantes = EventoAgenda.objects.filter(grupo=f'recurso_{self.sala.pk}').order_by('id')
+        self.assertEqual([linha.dados['title'] for linha in restantes], ['Lab 1 - Aula', 'Lab 1 - Prova', 'Lab 1 - Reunião'])
+
+        EventoAgenda.compactar()
+
+        restantes = EventoAgenda.objects.filter(grupo=f'recurso_{self.sala.pk}')
+        self.assertEqual([linha.dados['title'] for linha in restantes], ['Lab 1 - Reunião'])
+
+    def test_expirar_avanca_o_horizonte(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.criar_reserva()
+        cursor = EventoAgenda.ultima_sequencia()
+        EventoAgenda.objects.update(criado_em=timezone.now() - datetime.timedelta(days=2))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.criar_reserva(inicio=2)
+
+        self.assertEqual(EventoAgenda.expirar(datetime.timedelta(days=1)), 3)
+
+        grupos = [f'recurso_{self.sala.pk}']
+        self.assertEqual(EventoAgenda.desde(grupos, 0), ([], False))
+        linhas, completo = EventoAgenda.desde(grupos, cursor)
+        self.assertTrue(completo)
+        self.assertEqual(len(linhas), 1)
+
+    def test_falha_no_log_manda_recarregar(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.criar_reserva()
+        cursor = EventoAgenda.ultima_sequencia()
+        falhas = eventos.metricas()['falhas']
+        payload = {
+            'recurso': self.sala.pk, 'motivo': 'Prova',
+            'data_hora_inicio': self.horario(horas=2).isoformat(), 'data_hora_fim': self.horario(horas=3).isoformat(),
+        }
+        with mock.patch.object(EventoAgenda, 'gravar', side_effect=OperationalError('database is locked')), \
+                mock.patch('reservas.eventos.publicar') as publicar, \
+                self.assertLogs('reservas.eventos', 'ERROR'):
+            with self.captureOnCommitCallbacks(execute=True):
+                resposta = self.client.post('/reservas/api/reservas/', payload, format='json')
+
+        # A reserva já foi gravada: a falha do log não vira erro para quem a criou
+        self.assertEqual(resposta.status_code, 201)
+        self.assertEqual(eventos.metricas()['falhas'], falhas + 1)
+        avisos = {grupo for (grupo, mensagem), _ in publicar.call_args_list if mensagem['type'] == 'agenda_desatualizada'}
+        self.assertIn(f'recurso_{self.sala.pk}', avisos)
+        self.assertIn(f'usuario_{self.aluno.pk}', avisos)
+        # Quem retomar do cursor anterior à falha recarrega a agenda, em vez de perder o delta
+        self.assertEqual(EventoAgenda.desde([f'recurso_{self.sala.pk}'], cursor), ([], False))
+
+    async def test_consumer_repassa_agenda_desatualizada(self):
+        consumer = NotificacaoConsumer()
+        consumer.send = mock.AsyncMock()
+        await consumer.agenda_desatualizada({'type': 'agenda_desatualizada', 'cursor': 7})
+        consumer.send.assert_awaited_once_with(text_data=json.dumps({
+            'tipo': 'retomada', 'completa': False, 'cursor': 7, 'alteracoes': [],
+        }))
+
+
+class CamadaDeCanaisTests(TestCase):
+
+    def test_escolha_pelo_redis_url(self):
+        from reserva_salas.settings import camada_de_canais
+
+        self.assertEqual(camada_de_canais('')['default']['BACKEND'], 'channels.layers.InMemoryChannelLayer')
+        self.assertEqual(
+            camada_de_canais('redis://redis:6379/0')['default']['BACKEND'],
+            'channels_redis.pubsub.RedisPubSubChannelLayer',
+        )
+        filas = camada_de_canais('redis://redis:6379/0', 'filas')['default']
+        self.assertEqual(filas['BACKEND'], 'channels_redis.core.RedisChannelLayer')
+        self.assertEqual(filas['CONFIG']['hosts'], ['redis://redis:6379/0'])
+
+    def configuracao_com_redis(self, **ambiente):
+        # Executa o settings.py de novo, como um processo iniciado com estas variáveis de ambiente
+        ambiente = {'REDIS_URL': 'redis://redis:6379/0', 'CACHE_BACKEND': '', 'CHANNEL_LAYER_MODO': '', **ambiente}
+        with mock.patch.dict(os.environ, ambiente):
+            return runpy.run_path(os.path.join(settings.BASE_DIR, 'reserva_salas', 'settings.py'))
+
+    def test_redis_url_configura_canais_e_cache(self):
+        configuracao = self.configuracao_com_redis(CHANNEL_LAYER_MODO='pubsub')
+
+        self.assertEqual(configuracao['CHANNEL_LAYERS'], {'default': {
+            'BACKEND': 'channels_redis.pubsub.RedisPubSubChannelLayer',
+            'CONFIG': {'hosts': ['redis://redis:6379/0']},
+        }})
+        self.assertEqual(configuracao['CACHES'], {'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': 'redis://redis:6379/0',
+            'KEY_PREFIX': 'reservas',
+        }})
+        # O backend do cache é montado a partir da configuração (a conexão só é aberta no 1º uso)
+        opcoes = dict(configuracao['CACHES']['default'])
+        backend = import_string(opcoes.pop('BACKEND'))(opcoes.pop('LOCATION'), opcoes)
+        self.assertIsInstance(backend, RedisCache)
+        self.assertEqual(backend._servers, ['redis://redis:6379/0'])
+        self.assertEqual(backend.make_key('agenda'), 'reservas:1:agenda')
+
+        # CACHE_BACKEND prevalece sobre o REDIS_URL; CHANNEL_LAYER_MODO escolhe as filas
+        configuracao = self.configuracao_com_redis(CACHE_BACKEND='arquivo', CHANNEL_LAYER_MODO='filas')
+        self.assertEqual(
+            configuracao['CACHES']['default']['BACKEND'], 'django.core.cache.backends.filebased.FileBasedCache'
+        )
+        self.assertEqual(configuracao['CHANNEL_LAYERS']['default']['CONFIG'], {
+            'hosts': ['redis://redis:6379/0'], 'capacity': 1500, 'expiry': 30,
+        })
+
+    @skipUnless(importlib.util.find_spec('channels_redis'), 'channels_redis não instalado')
+    def test_camada_redis_montada_pelo_channels(self):
+        for modo, classe in (('pubsub', 'RedisPubSubChannelLayer'), ('filas', 'RedisChannelLayer')):
+            configuracao = self.configuracao_com_redis(CHANNEL_LAYER_MODO=modo)
+            with override_settings(CHANNEL_LAYERS=configuracao['CHANNEL_LAYERS']):
+                camada = ChannelLayerManager()['default']
+            self.assertEqual(type(camada).__name__, classe)
+
+
+# O limite de escritas simultâneas (reservas/limites.py) recusaria parte da rajada antes do lock
+@override_settings(CONCORRENCIA={'escritas': 100, 'relatorios': 2})
+class ConcorrenciaTests(TransactionTestCase):
+    """
+    Rajada de POSTs simultâneos para o MESMO horário (ex: dia de matrícula).
+    Todos passam pela pré-validação do serializer ao mesmo tempo; o lock no save()
+    precisa garantir que exatamente um vença e os demais recebam 400.
+    """
+    requisicoes = 12
+
+    def setUp(self):
+        # Alarga a janela entre "verificar conflito" e "gravar", tornando a corrida
+        # reproduzível: sem o lock, todas as threads verificariam antes de qualquer INSERT.
+        clean_original = Reserva.clean
+
+        def clean_lento(reserva):
+            clean_original(reserva)
+            time.sleep(0.05)
+
+        patcher = mock.patch.object(Reserva, 'clean', clean_lento)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_apenas_uma_reserva_vence_a_corrida(self):
+        sala = Recurso.objects.create(nome='Lab Concorrido', capacidade_maxima=30)
+        inicio = (timezone.now() + datetime.timedelta(days=1)).replace(microsecond=0)
+        payload = {
+            'recurso': sala.id,
+            'data_hora_inicio': inicio.isoformat(),
+            'data_hora_fim': (inicio + datetime.timedelta(hours=1)).isoformat(),
+            'motivo': 'Matrícula',
+        }
+        tokens = []
+        for i in range(self.requisicoes):
+            aluno = User.objects.create_user(f'aluno{i}')
+            tokens.append(Token.objects.create(user=aluno).key)
+
+        largada = threading.Barrier(self.requisicoes)
+        respostas = []
+
+        def reservar(token):
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+            try:
+                largada.wait()
+                respostas.append(client.post('/reservas/api/reservas/', payload, format='json').status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=reservar, args=(token,)) for token in tokens]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(sorted(respostas), [201] + [400] * (self.requisicoes - 1))
+        self.assertEqual(Reserva.objects.filter(recurso=sala).count(), 1)
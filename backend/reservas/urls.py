@@ -1,13 +1,14 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from django.views.decorators.csrf import csrf_exempt
-from reservas.api_views import (   RecursoViewSet, ReservaViewSet, RegisterView, CustomAuthToken,UserProfileView )
+from reservas.api_views import (   RecursoViewSet, ReservaViewSet, RelatorioJobViewSet, RegisterView, CustomAuthToken, UserProfileView )
 from reservas.admin import admin_site 
 
 # Configuração do Roteador (DRF) 
 router = DefaultRouter()
 router.register(r'recursos', RecursoViewSet)
 router.register(r'reservas', ReservaViewSet)
+router.register(r'relatorios', RelatorioJobViewSet, basename='relatorio')
 
 urlpatterns = [
     # Inclui todas as rotas geradas automaticamente pelo router acima
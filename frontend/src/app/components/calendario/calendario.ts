@@ -1,11 +1,13 @@
-import { Component, OnInit, ChangeDetectorRef } from '@angular/core'; 
+import { Component, ChangeDetectorRef, OnDestroy, OnInit, ViewChild } from '@angular/core'; 
 import { CommonModule } from '@angular/common';
-import { FullCalendarModule } from '@fullcalendar/angular'; 
-import { CalendarOptions } from '@fullcalendar/core'; 
+import { FullCalendarComponent, FullCalendarModule } from '@fullcalendar/angular'; 
+import { CalendarOptions, DatesSetArg, EventInput, EventSourceFuncArg } from '@fullcalendar/core'; 
+import { Subscription } from 'rxjs';
 import dayGridPlugin from '@fullcalendar/daygrid';
 import timeGridPlugin from '@fullcalendar/timegrid';
 import interactionPlugin from '@fullcalendar/interaction';
 import { ApiService } from '../../services/api'; 
+import { AlteracaoReserva, NotificationService } from '../../services/notification';
 import ptBrLocale from '@fullcalendar/core/locales/pt-br';
 
 /**
@@ -22,7 +24,11 @@ import ptBrLocale from '@fullcalendar/core/locales/pt-br';
   templateUrl: './calendario.html',
   styleUrl: './calendario.css'
 })
-export class CalendarioComponent implements OnInit {
+export class CalendarioComponent implements OnInit, OnDestroy {
+
+  @ViewChild(FullCalendarComponent) calendario?: FullCalendarComponent;
+
+  private assinaturas = new Subscription();
 
   // Configurações globais do componente de calendário
   calendarOptions: CalendarOptions = {
@@ -42,7 +48,12 @@ export class CalendarioComponent implements OnInit {
       right: 'dayGridMonth,timeGridWeek,timeGridDay'
     },
     
-    events: [], // Inicialmente vazio, será populado via API
+    // Fonte de eventos dinâmica: o FullCalendar informa a janela visível (start/end)
+    // e buscamos no backend somente as reservas daquele intervalo.
+    events: (info, successCallback, failureCallback) => this.carregarEventos(info, successCallback, failureCallback),
+
+    // A cada navegação, passa a receber pelo WebSocket as alterações da nova janela
+    datesSet: (info: DatesSetArg) => this.notificationService.acompanharAgenda(info.startStr, info.endStr),
 
     // Customização da UI: Remove slot de "dia inteiro" e limita o horário visível
     allDaySlot: false, 
@@ -55,48 +66,62 @@ export class CalendarioComponent implements OnInit {
     private apiService: ApiService,
     // ChangeDetectorRef: Necessário para forçar a atualização da UI quando dados assíncronos
     // modificam propriedades profundas de objetos complexos (como calendarOptions).
-    private cdr: ChangeDetectorRef 
+    private cdr: ChangeDetectorRef,
+    private notificationService: NotificationService
   ) {}
 
   ngOnInit(): void {
-    this.carregarEventos();
+    this.assinaturas.add(this.notificationService.alteracoes$.subscribe(
+      alteracoes => this.aplicarAlteracoes(alteracoes)
+    ));
+    // Ficou desconectado tempo demais para retomar: busca a janela visível de novo
+    this.assinaturas.add(this.notificationService.recarregar$.subscribe(
+      () => this.calendario?.getApi().refetchEvents()
+    ));
+  }
+
+  ngOnDestroy(): void {
+    this.assinaturas.unsubscribe();
   }
 
   /**
-   * Busca as reservas no backend e as converte para o formato de Evento do FullCalendar.
+   * Aplica os deltas recebidos pelo WebSocket direto no calendário, sem buscar a semana de novo:
+   * o evento antigo (se houver) sai e, se a reserva continua na agenda, entra a versão nova.
    */
-  carregarEventos() {
-    this.apiService.getReservas().subscribe({
-      next: (reservas: any[]) => {
-        console.log('Reservas vindas do Django:', reservas); 
+  aplicarAlteracoes(alteracoes: AlteracaoReserva[]) {
+    const api = this.calendario?.getApi();
+    if (!api) return;
 
-        // Padrão Adapter (Adaptação de Dados):
-        // O Backend envia: { data_hora_inicio, recurso_nome, ... }
-        // O FullCalendar espera: { start, title, end, ... }
-        const eventosFormatados = reservas.map(reserva => {
-          
-          console.log('Montando evento:', reserva.recurso_nome, reserva.data_hora_inicio, reserva.data_hora_fim);
-          
-          return {
-            title: `${reserva.recurso_nome} - ${reserva.motivo}`,
-            start: reserva.data_hora_inicio, // ISO String é aceita nativamente
-            end: reserva.data_hora_fim,
-            color: this.getCor(reserva.recurso) // Atribuição dinâmica de cor
-          };
-        });
+    // Adicionados à fonte de eventos, somem na próxima busca em vez de duplicar com ela
+    const fonte = api.getEventSources()[0];
+    for (const { acao, reserva } of alteracoes) {
+      api.getEventById(String(reserva.id))?.remove();
+      if (acao !== 'cancelada') {
+        api.addEvent({ ...reserva, color: this.getCor(reserva.recurso) }, fonte);
+      }
+    }
+  }
 
-      
-        // Imutabilidade:
-        // Ao invés de fazer this.calendarOptions.events.push(...), nós recriamos o objeto.
-        // Isso avisa ao Angular e ao FullCalendar que a referência mudou e um re-render é necessário.
-        this.calendarOptions = { ...this.calendarOptions, events: eventosFormatados };
-        
-        // Dispara manualmente a detecção de mudanças para garantir que o calendário
-        // seja redesenhado imediatamente após a chegada dos dados assíncronos.
-        this.cdr.detectChanges(); 
-        console.log('ChangeDetectorRef disparado!');
+  /**
+   * Busca no backend as reservas da janela visível e as converte para o formato de Evento do FullCalendar.
+   * É chamado pelo próprio calendário a cada navegação (semana anterior, próximo mês, etc.).
+   */
+  carregarEventos(
+    info: EventSourceFuncArg,
+    successCallback: (eventos: EventInput[]) => void,
+    failureCallback: (erro: Error) => void
+  ) {
+    this.apiService.getCalendario(info.startStr, info.endStr).subscribe({
+      next: (eventos: any[]) => {
+        // O backend já envia { id, title, start, end, recurso };
+        // aqui só atribuímos a cor de cada recurso.
+        successCallback(eventos.map(evento => ({ ...evento, color: this.getCor(evento.recurso) })));
+        this.cdr.detectChanges();
       },
-      error: (erro) => console.error('Erro ao carregar calendário:', erro)
+      error: (erro) => {
+        console.error('Erro ao carregar calendário:', erro);
+        failureCallback(erro);
+      }
     });
   }
 
@@ -14,9 +14,8 @@ export class RelatoriosComponent {
   constructor(private apiService: ApiService) {}
 
   downloadArquivo(tipo: 'pdf' | 'excel') {
-    const request$ = tipo === 'pdf' 
-      ? this.apiService.baixarPDF() 
-      : this.apiService.baixarExcel();
+    // O servidor gera o arquivo em segundo plano; a página não fica presa esperando a renderização
+    const request$ = this.apiService.gerarRelatorio(tipo === 'pdf' ? 'pdf' : 'xlsx');
 
     request$.subscribe({
       next: (blob: Blob) => {
@@ -1,6 +1,7 @@
 import { Injectable } from '@angular/core';
-import { HttpClient, HttpHeaders } from '@angular/common/http';
-import { Observable, BehaviorSubject } from 'rxjs';
+import { HttpClient, HttpHeaders, HttpParams } from '@angular/common/http';
+import { Observable, BehaviorSubject, EMPTY, timer } from 'rxjs';
+import { expand, map, reduce, switchMap, takeWhile, last } from 'rxjs/operators';
 
 /**
  * @class ApiService
@@ -129,6 +130,25 @@ export class ApiService {
     return this.http.get(`${this.apiUrl}/reservas/api/reservas/`, { headers: this.getAuthHeaders() });
   }
 
+  /**
+   * Feed do calendário: apenas as reservas que intersectam a janela [inicio, fim).
+   * O backend pagina por cursor; seguimos os links 'next' até a última página
+   * e emitimos a lista completa de eventos (já no formato do FullCalendar).
+   */
+  getCalendario(inicio: string, fim: string, recurso?: number): Observable<any[]> {
+    let params = new HttpParams().set('start', inicio).set('end', fim);
+    if (recurso) {
+      params = params.set('recurso', recurso);
+    }
+    const headers = this.getAuthHeaders();
+
+    return this.http.get<any>(`${this.apiUrl}/reservas/api/reservas/calendario/`, { headers, params }).pipe(
+      expand(pagina => pagina.next ? this.http.get<any>(pagina.next, { headers }) : EMPTY),
+      map(pagina => pagina.results),
+      reduce((eventos: any[], pagina: any[]) => eventos.concat(pagina), [])
+    );
+  }
+
   criarReserva(dados: any): Observable<any> {
     return this.http.post(`${this.apiUrl}/reservas/api/reservas/`, dados, { headers: this.getAuthHeaders() });
   }
@@ -171,4 +191,28 @@ export class ApiService {
       responseType: 'blob' 
     });
   }
+
+  /**
+   * Relatório em segundo plano: cria o pedido, consulta o status a cada 2s
+   * até ficar pronto (C) ou falhar (F) e então baixa o arquivo gerado.
+   * Relatórios iguais e sem mudanças nos dados já voltam prontos (arquivo em cache no servidor).
+   */
+  gerarRelatorio(formato: 'pdf' | 'xlsx', filtros: any = {}): Observable<Blob> {
+    const headers = this.getAuthHeaders();
+    const url = `${this.apiUrl}/reservas/api/relatorios/`;
+
+    return this.http.post<any>(url, { formato, filtros }, { headers }).pipe(
+      switchMap(job => timer(0, 2000).pipe(
+        switchMap(() => this.http.get<any>(`${url}${job.id}/`, { headers })),
+        takeWhile(atual => atual.status === 'P' || atual.status === 'E', true),
+        last()
+      )),
+      switchMap(job => {
+        if (job.status !== 'C') {
+          throw new Error(job.erro || 'Falha ao gerar o relatório.');
+        }
+        return this.http.get(`${url}${job.id}/download/`, { headers, responseType: 'blob' });
+      })
+    );
+  }
 }
\ No newline at end of file
@@ -1,8 +1,18 @@
 import { Injectable } from '@angular/core';
 import { webSocket, WebSocketSubject } from 'rxjs/webSocket';
-import { timer, retry } from 'rxjs'; 
+import { timer, retry, Subject } from 'rxjs'; 
 import Swal from 'sweetalert2';
 
+/**
+ * Delta da agenda enviado pelo backend (veja reservas/eventos.py).
+ * 'reserva' vem no mesmo formato do feed do calendário: { id, title, start, end, recurso, status }.
+ */
+export interface AlteracaoReserva {
+  seq: number;
+  acao: 'criada' | 'atualizada' | 'cancelada';
+  reserva: any;
+}
+
 /**
  * @class NotificationService
  * @description
@@ -20,6 +30,20 @@ export class NotificationService {
   
   // Endpoint do Django Channels (definido no asgi.py e routing.py do backend)
   private readonly WS_ENDPOINT = 'ws://127.0.0.1:8000/ws/notificacoes/';
+
+  // Deltas da agenda dos tópicos inscritos (o calendário os aplica sem recarregar a semana)
+  private alteracoes = new Subject<AlteracaoReserva[]>();
+  public readonly alteracoes$ = this.alteracoes.asObservable();
+
+  // Emite quando a retomada não foi possível: a agenda deve ser recarregada inteira
+  private recarregar = new Subject<void>();
+  public readonly recarregar$ = this.recarregar.asObservable();
+
+  // Janela da agenda acompanhada; reenviada a cada (re)conexão, pois as inscrições vivem na conexão
+  private janela: { inicio: string, fim: string } | undefined;
+
+  // Última sequência recebida do log de eventos: ao reconectar, pedimos só o que veio depois
+  private cursor: number | undefined;
   
   constructor() { }
 
@@ -33,13 +57,21 @@ export class NotificationService {
       console.log('🔌 Tentando conectar ao WebSocket...');
       
       // Configuração dos gatilhos de ciclo de vida da conexão
+      // O navegador não envia cabeçalhos no handshake: o Token do DRF vai na URL
+      const token = localStorage.getItem('token');
       this.socket$ = webSocket({
-        url: this.WS_ENDPOINT,
+        url: token ? `${this.WS_ENDPOINT}?token=${encodeURIComponent(token)}` : this.WS_ENDPOINT,
         closeObserver: {
           next: () => console.log('❌ WebSocket desconectado.')
         },
         openObserver: {
-          next: () => console.log('✅ WebSocket conectado!')
+          next: () => {
+            console.log('✅ WebSocket conectado!');
+            if (this.janela) {
+              const retomar = this.cursor !== undefined ? { retomar: this.cursor } : {};
+              this.socket$?.next({ inscrever: this.janela, ...retomar });
+            }
+          }
         }
       });
       
@@ -61,11 +93,47 @@ export class NotificationService {
     }
   }
 
+  /**
+   * Passa a acompanhar os dias [inicio, fim) da agenda (ex: a semana visível no calendário),
+   * deixando de acompanhar a janela anterior.
+   */
+  public acompanharAgenda(inicio: string, fim: string): void {
+    if (this.janela && this.socket$) {
+      this.socket$.next({ cancelar_inscricao: this.janela });
+    }
+    this.janela = { inicio, fim };
+    this.socket$?.next({ inscrever: this.janela });
+  }
+
   /**
    * Processa as mensagens recebidas do Backend.
    * Transforma o payload de dados (JSON) em feedback visual para o usuário (UI).
    */
   private handleMessage(msg: any) {
+    // Deltas da agenda e respostas às inscrições não viram popup
+    if (msg.tipo === 'reservas') {
+      this.avancarCursor(Math.max(...msg.alteracoes.map((a: AlteracaoReserva) => a.seq)));
+      this.alteracoes.next(msg.alteracoes);
+      return;
+    }
+    if (msg.tipo === 'retomada') {
+      // Deltas perdidos durante a desconexão; se o servidor não os tem mais, recarrega tudo
+      if (msg.completa) {
+        this.alteracoes.next(msg.alteracoes);
+      } else {
+        this.recarregar.next();
+      }
+      this.avancarCursor(msg.cursor);
+      return;
+    }
+    if (msg.tipo === 'inscricoes' || msg.tipo === 'erro') {
+      console.log('📡 Inscrições:', msg);
+      if (msg.cursor !== undefined && this.cursor === undefined) {
+        this.cursor = msg.cursor;
+      }
+      return;
+    }
+
     console.log('📩 Notificação:', msg);
     
     // Configuração do "Toast" (Notificação flutuante não intrusiva)
@@ -88,6 +156,12 @@ export class NotificationService {
     });
   }
 
+  private avancarCursor(seq: number) {
+    if (this.cursor === undefined || seq > this.cursor) {
+      this.cursor = seq;
+    }
+  }
+
   /**
    * Encerra a conexão de forma limpa.
    * Importante chamar ao fazer logout para evitar vazamento de memória.